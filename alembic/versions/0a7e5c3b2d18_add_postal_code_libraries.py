@@ -0,0 +1,73 @@
+"""Add postal code libraries
+
+Revision ID: 0a7e5c3b2d18
+Revises: f2c8a4d9e610
+Create Date: 2026-10-19 13:48:30.662091+00:00
+
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "0a7e5c3b2d18"
+down_revision = "f2c8a4d9e610"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "postalcodelibraries",
+        sa.Column("place_id", sa.Integer(), nullable=False),
+        sa.Column("library_id", sa.Integer(), nullable=False),
+        sa.Column("serves", sa.Boolean(), nullable=False),
+        sa.Column("distance", sa.Float(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["library_id"],
+            ["libraries.id"],
+        ),
+        sa.ForeignKeyConstraint(
+            ["place_id"],
+            ["places.id"],
+        ),
+        sa.PrimaryKeyConstraint("place_id", "library_id"),
+    )
+    op.create_index(
+        op.f("ix_postalcodelibraries_library_id"),
+        "postalcodelibraries",
+        ["library_id"],
+    )
+
+    # Work out which libraries serve, or are within 150 kilometers
+    # of, each postal code.
+    op.execute(
+        """
+        INSERT INTO postalcodelibraries (place_id, library_id, serves, distance)
+        SELECT postal_codes.id, serviceareas.library_id,
+               bool_or(ST_Intersects(postal_code_pieces.geometry, served_pieces.geometry)),
+               min(CASE WHEN ST_Intersects(postal_code_pieces.geometry, served_pieces.geometry)
+                        THEN 0
+                        ELSE ST_DistanceSphere(postal_code_pieces.geometry, served_pieces.geometry)
+                   END) AS distance
+        FROM places AS postal_codes
+        JOIN placesubdivisions AS postal_code_pieces
+            ON postal_codes.id = postal_code_pieces.place_id
+        JOIN placesubdivisions AS served_pieces
+            ON ST_DWithin(postal_code_pieces.geometry, served_pieces.geometry, 3)
+        JOIN serviceareas ON serviceareas.place_id = served_pieces.place_id
+        WHERE postal_codes.type = 'postal_code'
+        GROUP BY postal_codes.id, serviceareas.library_id
+        HAVING min(CASE WHEN ST_Intersects(postal_code_pieces.geometry, served_pieces.geometry)
+                        THEN 0
+                        ELSE ST_DistanceSphere(postal_code_pieces.geometry, served_pieces.geometry)
+                   END) <= 150000
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(
+        op.f("ix_postalcodelibraries_library_id"), table_name="postalcodelibraries"
+    )
+    op.drop_table("postalcodelibraries")
@@ -0,0 +1,24 @@
+"""Add place content hash
+
+Revision ID: 0c7e5a2d9b31
+Revises: b6d1e4f08a73
+Create Date: 2026-10-19 17:24:05.331870+00:00
+
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "0c7e5a2d9b31"
+down_revision = "b6d1e4f08a73"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("places", sa.Column("content_hash", sa.Unicode(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("places", "content_hash")
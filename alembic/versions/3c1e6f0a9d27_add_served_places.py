@@ -0,0 +1,77 @@
+"""Add served places
+
+Revision ID: 3c1e6f0a9d27
+Revises: 7dc7590e1819
+Create Date: 2026-10-19 09:12:41.318204+00:00
+
+"""
+import sqlalchemy as sa
+from geoalchemy2 import Geometry
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "3c1e6f0a9d27"
+down_revision = "7dc7590e1819"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "servedplaces",
+        sa.Column("place_id", sa.Integer(), nullable=False),
+        sa.Column(
+            "geometry",
+            Geometry(srid=4326, spatial_index=False),
+            nullable=True,
+        ),
+        sa.Column("in_production_feed", sa.Boolean(), nullable=False),
+        sa.Column("in_testing_feed", sa.Boolean(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["place_id"],
+            ["places.id"],
+        ),
+        sa.PrimaryKeyConstraint("place_id"),
+    )
+    op.create_index(
+        "idx_servedplaces_geometry",
+        "servedplaces",
+        ["geometry"],
+        postgresql_using="gist",
+    )
+    op.create_index(
+        op.f("ix_servedplaces_in_production_feed"),
+        "servedplaces",
+        ["in_production_feed"],
+    )
+    op.create_index(
+        op.f("ix_servedplaces_in_testing_feed"),
+        "servedplaces",
+        ["in_testing_feed"],
+    )
+
+    # Populate the table from the existing service areas.
+    op.execute(
+        """
+        INSERT INTO servedplaces (place_id, geometry, in_production_feed, in_testing_feed)
+        SELECT served.place_id, places.geometry, served.in_production_feed, served.in_testing_feed
+        FROM (
+            SELECT serviceareas.place_id,
+                   bool_or(libraries.library_stage = 'production'
+                           AND libraries.registry_stage = 'production') AS in_production_feed,
+                   bool_or(libraries.library_stage IN ('production', 'testing')
+                           AND libraries.registry_stage IN ('production', 'testing')) AS in_testing_feed
+            FROM serviceareas JOIN libraries ON serviceareas.library_id = libraries.id
+            GROUP BY serviceareas.place_id
+        ) AS served JOIN places ON served.place_id = places.id
+        WHERE served.in_testing_feed
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(op.f("ix_servedplaces_in_testing_feed"), table_name="servedplaces")
+    op.drop_index(op.f("ix_servedplaces_in_production_feed"), table_name="servedplaces")
+    op.drop_index("idx_servedplaces_geometry", table_name="servedplaces")
+    op.drop_table("servedplaces")
@@ -0,0 +1,39 @@
+"""Add trigram indexes on name fields
+
+Revision ID: 3e8b5c7a1f46
+Revises: 7a3f9c1e5d28
+Create Date: 2026-10-19 19:02:31.447120+00:00
+
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "3e8b5c7a1f46"
+down_revision = "7a3f9c1e5d28"
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ("ix_libraries_name_trgm", "libraries", "name"),
+    ("ix_libraryalias_name_trgm", "libraryalias", "name"),
+    ("ix_places_external_name_trgm", "places", "external_name"),
+    ("ix_placealiases_name_trgm", "placealiases", "name"),
+]
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for name, table, column in INDEXES:
+        op.create_index(
+            name,
+            table,
+            [sa.text("lower(%s) gin_trgm_ops" % column)],
+            postgresql_using="gin",
+        )
+
+
+def downgrade() -> None:
+    for name, table, column in INDEXES:
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,29 @@
+"""Add a trigram index on library descriptions
+
+Revision ID: 5d2a8f6c1e43
+Revises: e7b3d1f5a924
+Create Date: 2026-10-20 14:36:52.108734+00:00
+
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "5d2a8f6c1e43"
+down_revision = "e7b3d1f5a924"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        "ix_libraries_description_trgm",
+        "libraries",
+        [sa.text("lower(description) gin_trgm_ops")],
+        postgresql_using="gin",
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_libraries_description_trgm", table_name="libraries")
@@ -0,0 +1,76 @@
+"""Add place library overlaps
+
+Revision ID: 5e91b7f3a042
+Revises: 0a7e5c3b2d18
+Create Date: 2026-10-19 14:55:12.093877+00:00
+
+"""
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "5e91b7f3a042"
+down_revision = "0a7e5c3b2d18"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    overlap_type = postgresql.ENUM("interior", "border", name="overlap_type")
+    overlap_type.create(op.get_bind())
+    op.create_table(
+        "placelibraryoverlaps",
+        sa.Column("place_id", sa.Integer(), nullable=False),
+        sa.Column("library_id", sa.Integer(), nullable=False),
+        sa.Column(
+            "overlap_type",
+            postgresql.ENUM(name="overlap_type", create_type=False),
+            nullable=False,
+        ),
+        sa.ForeignKeyConstraint(
+            ["library_id"],
+            ["libraries.id"],
+        ),
+        sa.ForeignKeyConstraint(
+            ["place_id"],
+            ["places.id"],
+        ),
+        sa.PrimaryKeyConstraint("place_id", "library_id"),
+    )
+    op.create_index(
+        op.f("ix_placelibraryoverlaps_library_id"),
+        "placelibraryoverlaps",
+        ["library_id"],
+    )
+    op.create_index(
+        op.f("ix_placelibraryoverlaps_overlap_type"),
+        "placelibraryoverlaps",
+        ["overlap_type"],
+    )
+
+    op.execute(
+        """
+        INSERT INTO placelibraryoverlaps (place_id, library_id, overlap_type)
+        SELECT pieces.place_id, serviceareas.library_id,
+               CAST(CASE WHEN bool_or(NOT ST_Touches(pieces.geometry, served_pieces.geometry))
+                         THEN 'interior' ELSE 'border' END AS overlap_type)
+        FROM placesubdivisions AS pieces
+        JOIN placesubdivisions AS served_pieces
+            ON ST_Intersects(pieces.geometry, served_pieces.geometry)
+        JOIN serviceareas ON serviceareas.place_id = served_pieces.place_id
+        GROUP BY pieces.place_id, serviceareas.library_id
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(
+        op.f("ix_placelibraryoverlaps_overlap_type"), table_name="placelibraryoverlaps"
+    )
+    op.drop_index(
+        op.f("ix_placelibraryoverlaps_library_id"), table_name="placelibraryoverlaps"
+    )
+    op.drop_table("placelibraryoverlaps")
+    postgresql.ENUM(name="overlap_type").drop(op.get_bind())
@@ -0,0 +1,40 @@
+"""Add collection size statistics
+
+Revision ID: 7a3f9c1e5d28
+Revises: 0c7e5a2d9b31
+Create Date: 2026-10-19 18:11:47.902316+00:00
+
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "7a3f9c1e5d28"
+down_revision = "0c7e5a2d9b31"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "collectionsizestatistics",
+        sa.Column("language", sa.Unicode(), nullable=False),
+        sa.Column("max_size", sa.Integer(), nullable=False),
+        sa.Column("total_size", sa.BigInteger(), nullable=False),
+        sa.Column("libraries", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("language"),
+    )
+    op.execute(
+        """INSERT INTO collectionsizestatistics
+        (language, max_size, total_size, libraries)
+        SELECT language, max(coalesce(size, 0)), sum(coalesce(size, 0)),
+            count(DISTINCT library_id)
+        FROM collectionsummaries
+        WHERE language IS NOT NULL AND library_id IS NOT NULL
+        GROUP BY language"""
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("collectionsizestatistics")
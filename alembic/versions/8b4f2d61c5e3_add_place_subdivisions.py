@@ -0,0 +1,63 @@
+"""Add place subdivisions
+
+Revision ID: 8b4f2d61c5e3
+Revises: 3c1e6f0a9d27
+Create Date: 2026-10-19 10:04:17.552930+00:00
+
+"""
+import sqlalchemy as sa
+from geoalchemy2 import Geometry
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "8b4f2d61c5e3"
+down_revision = "3c1e6f0a9d27"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "placesubdivisions",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("place_id", sa.Integer(), nullable=False),
+        sa.Column(
+            "geometry",
+            Geometry(srid=4326, spatial_index=False),
+            nullable=False,
+        ),
+        sa.ForeignKeyConstraint(
+            ["place_id"],
+            ["places.id"],
+        ),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        op.f("ix_placesubdivisions_place_id"),
+        "placesubdivisions",
+        ["place_id"],
+    )
+
+    # Cut up every existing place before building the spatial index,
+    # which is much faster than maintaining the index row by row.
+    op.execute(
+        """
+        INSERT INTO placesubdivisions (place_id, geometry)
+        SELECT id, ST_Subdivide(geometry, 256)
+        FROM places
+        WHERE geometry IS NOT NULL
+        """
+    )
+    op.create_index(
+        "idx_placesubdivisions_geometry",
+        "placesubdivisions",
+        ["geometry"],
+        postgresql_using="gist",
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("idx_placesubdivisions_geometry", table_name="placesubdivisions")
+    op.drop_index(op.f("ix_placesubdivisions_place_id"), table_name="placesubdivisions")
+    op.drop_table("placesubdivisions")
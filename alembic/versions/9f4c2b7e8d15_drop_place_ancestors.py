@@ -0,0 +1,46 @@
+"""Drop place ancestors
+
+Revision ID: 9f4c2b7e8d15
+Revises: 5d2a8f6c1e43
+Create Date: 2026-10-20 15:21:08.472915+00:00
+
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "9f4c2b7e8d15"
+down_revision = "5d2a8f6c1e43"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Nothing reads this table; parentage is looked up in memory by the
+    # Gazetteer.
+    op.drop_index("ix_placeancestors_ancestor_id_depth", table_name="placeancestors")
+    op.drop_table("placeancestors")
+
+
+def downgrade() -> None:
+    op.create_table(
+        "placeancestors",
+        sa.Column("place_id", sa.Integer(), nullable=False),
+        sa.Column("ancestor_id", sa.Integer(), nullable=False),
+        sa.Column("depth", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["ancestor_id"],
+            ["places.id"],
+        ),
+        sa.ForeignKeyConstraint(
+            ["place_id"],
+            ["places.id"],
+        ),
+        sa.PrimaryKeyConstraint("place_id", "ancestor_id"),
+    )
+    op.create_index(
+        "ix_placeancestors_ancestor_id_depth",
+        "placeancestors",
+        ["ancestor_id", "depth"],
+    )
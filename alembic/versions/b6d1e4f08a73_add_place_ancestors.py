@@ -0,0 +1,58 @@
+"""Add place ancestors
+
+Revision ID: b6d1e4f08a73
+Revises: 5e91b7f3a042
+Create Date: 2026-10-19 16:02:41.518204+00:00
+
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "b6d1e4f08a73"
+down_revision = "5e91b7f3a042"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "placeancestors",
+        sa.Column("place_id", sa.Integer(), nullable=False),
+        sa.Column("ancestor_id", sa.Integer(), nullable=False),
+        sa.Column("depth", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["ancestor_id"],
+            ["places.id"],
+        ),
+        sa.ForeignKeyConstraint(
+            ["place_id"],
+            ["places.id"],
+        ),
+        sa.PrimaryKeyConstraint("place_id", "ancestor_id"),
+    )
+    op.create_index(
+        "ix_placeancestors_ancestor_id_depth",
+        "placeancestors",
+        ["ancestor_id", "depth"],
+    )
+
+    op.execute(
+        """
+        INSERT INTO placeancestors (place_id, ancestor_id, depth)
+        WITH RECURSIVE chain (place_id, ancestor_id, parent_id, depth) AS (
+            SELECT id, id, parent_id, 0 FROM places
+            UNION ALL
+            SELECT chain.place_id, parent.id, parent.parent_id, chain.depth + 1
+            FROM chain JOIN places AS parent ON parent.id = chain.parent_id
+            WHERE chain.depth < 16
+        )
+        SELECT place_id, ancestor_id, depth FROM chain
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_placeancestors_ancestor_id_depth", table_name="placeancestors")
+    op.drop_table("placeancestors")
@@ -0,0 +1,42 @@
+"""Add library search document
+
+Revision ID: c4d7e2a9b583
+Revises: 3e8b5c7a1f46
+Create Date: 2026-10-19 19:47:05.318652+00:00
+
+"""
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "c4d7e2a9b583"
+down_revision = "3e8b5c7a1f46"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "libraries", sa.Column("search_document", postgresql.TSVECTOR(), nullable=True)
+    )
+    op.execute(
+        """UPDATE libraries SET search_document =
+        setweight(to_tsvector('english', coalesce(name, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(
+            (SELECT string_agg(libraryalias.name, ' ') FROM libraryalias
+             WHERE libraryalias.library_id = libraries.id), '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(description, '')), 'C')"""
+    )
+    op.create_index(
+        "ix_libraries_search_document",
+        "libraries",
+        ["search_document"],
+        postgresql_using="gin",
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_libraries_search_document", table_name="libraries")
+    op.drop_column("libraries", "search_document")
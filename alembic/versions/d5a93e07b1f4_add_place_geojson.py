@@ -0,0 +1,55 @@
+"""Add precomputed place GeoJSON
+
+Revision ID: d5a93e07b1f4
+Revises: 8b4f2d61c5e3
+Create Date: 2026-10-19 11:21:09.817431+00:00
+
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "d5a93e07b1f4"
+down_revision = "8b4f2d61c5e3"
+branch_labels = None
+depends_on = None
+
+
+# The GeoJSON expression used for each resolution. These match
+# PlaceGeoJSON.RESOLUTIONS at the time this migration was written.
+RESOLUTIONS = {
+    "full": "ST_AsGeoJSON(geometry)",
+    "high": "ST_AsGeoJSON(ST_SimplifyPreserveTopology(geometry, 0.0001), 6)",
+    "medium": "ST_AsGeoJSON(ST_SimplifyPreserveTopology(geometry, 0.001), 5)",
+    "low": "ST_AsGeoJSON(ST_SimplifyPreserveTopology(geometry, 0.01), 4)",
+}
+
+
+def upgrade() -> None:
+    op.create_table(
+        "placegeojson",
+        sa.Column("place_id", sa.Integer(), nullable=False),
+        sa.Column("resolution", sa.Unicode(length=16), nullable=False),
+        sa.Column("geojson", sa.Unicode(), nullable=False),
+        sa.Column("digest", sa.Unicode(length=32), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["place_id"],
+            ["places.id"],
+        ),
+        sa.PrimaryKeyConstraint("place_id", "resolution"),
+    )
+
+    for resolution, geojson in RESOLUTIONS.items():
+        op.execute(
+            f"""
+            INSERT INTO placegeojson (place_id, resolution, geojson, digest)
+            SELECT id, '{resolution}', {geojson}, md5({geojson})
+            FROM places
+            WHERE geometry IS NOT NULL
+            """
+        )
+
+
+def downgrade() -> None:
+    op.drop_table("placegeojson")
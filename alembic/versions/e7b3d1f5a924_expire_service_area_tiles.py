@@ -0,0 +1,36 @@
+"""Expire cached service area tiles
+
+Revision ID: e7b3d1f5a924
+Revises: c4d7e2a9b583
+Create Date: 2026-10-20 09:14:27.640193+00:00
+
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "e7b3d1f5a924"
+down_revision = "c4d7e2a9b583"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # The existing tiles may include empty or very detailed tiles
+    # that are no longer cached, so start over.
+    op.execute("DELETE FROM serviceareatiles")
+    op.add_column(
+        "serviceareatiles", sa.Column("created", sa.DateTime(), nullable=False)
+    )
+    op.create_index(
+        op.f("ix_serviceareatiles_created"),
+        "serviceareatiles",
+        ["created"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(op.f("ix_serviceareatiles_created"), table_name="serviceareatiles")
+    op.drop_column("serviceareatiles", "created")
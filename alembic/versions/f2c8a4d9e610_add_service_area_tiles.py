@@ -0,0 +1,32 @@
+"""Add service area tile cache
+
+Revision ID: f2c8a4d9e610
+Revises: d5a93e07b1f4
+Create Date: 2026-10-19 12:37:52.104388+00:00
+
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "f2c8a4d9e610"
+down_revision = "d5a93e07b1f4"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "serviceareatiles",
+        sa.Column("production", sa.Boolean(), nullable=False),
+        sa.Column("z", sa.Integer(), nullable=False),
+        sa.Column("x", sa.Integer(), nullable=False),
+        sa.Column("y", sa.Integer(), nullable=False),
+        sa.Column("data", sa.LargeBinary(), nullable=False),
+        sa.PrimaryKeyConstraint("production", "z", "x", "y"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("serviceareatiles")
@@ -115,6 +115,20 @@ def search_qa(_location):
     return app.library_registry.registry_controller.search(_location, live=False)
 
 
+@app.route("/typeahead")
+@uses_location
+@returns_problem_detail
+def typeahead(_location):
+    return app.library_registry.registry_controller.typeahead(_location)
+
+
+@app.route("/qa/typeahead")
+@uses_location
+@returns_problem_detail
+def typeahead_qa(_location):
+    return app.library_registry.registry_controller.typeahead(_location, live=False)
+
+
 @app.route("/confirm/<int:resource_id>/<secret>")
 @returns_problem_detail
 def confirm_resource(resource_id, secret):
@@ -227,6 +241,18 @@ def coverage():
     return app.library_registry.coverage_controller.lookup()
 
 
+@app.route("/tiles/<int:z>/<int:x>/<int:y>.mvt")
+@returns_problem_detail
+def tile(z, x, y):
+    return app.library_registry.coverage_controller.tile(z, x, y)
+
+
+@app.route("/qa/tiles/<int:z>/<int:x>/<int:y>.mvt")
+@returns_problem_detail
+def tile_qa(z, x, y):
+    return app.library_registry.coverage_controller.tile(z, x, y, live=False)
+
+
 @app.route("/version.json")
 def application_version():
     return app.library_registry.version.version()
@@ -5,7 +5,7 @@ from io import BytesIO
 import flask
 
 from model import Admin
-from util import GeometryUtility
+from util import LazyLocation
 from util.flask_util import originating_ip
 from util.problem_detail import ProblemDetail
 
@@ -40,13 +40,14 @@ def uses_location_factory(app):
     def factory(f):
         @wraps(f)
         def decorated(*args, **kwargs):
-            """A decorator that guesses at a location for the client."""
-            location = flask.request.args.get("_location")
-            if location:
-                location = GeometryUtility.point_from_string(location)
-            if not location:
-                ip = originating_ip()
-                location = GeometryUtility.point_from_ip(ip)
+            """A decorator that guesses at a location for the client.
+
+            The guess isn't made until the decorated function asks for
+            it, by calling LazyLocation.value_of().
+            """
+            location = LazyLocation(
+                flask.request.args.get("_location"), originating_ip()
+            )
             return f(*args, _location=location, **kwargs)
 
         return decorated
@@ -5,7 +5,14 @@ from flask_babel import lazy_gettext as _
 from sqlalchemy.orm.exc import MultipleResultsFound, NoResultFound
 from sqlalchemy.orm.session import Session
 
-from model import Audience, CollectionSummary, Place, ServiceArea, get_one_or_create
+from model import (
+    Audience,
+    CollectionSizeStatistics,
+    CollectionSummary,
+    Place,
+    ServiceArea,
+    get_one_or_create,
+)
 from problem_details import INVALID_INTEGRATION_DOCUMENT
 
 
@@ -193,10 +200,22 @@ class AuthenticationDocument:
                 unknown["??"] = coverage
                 coverage = dict()  # Do no more processing
 
+        # Gather up the names of the places within each nation, so
+        # they can all be looked up at once.
+        place_names = dict()
+        for nation, places in coverage.items():
+            if places == cls.COVERAGE_EVERYWHERE:
+                places = []
+            elif isinstance(places, str):
+                # This is invalid -- you're supposed to always
+                # pass in a list -- but we can support it.
+                places = [places]
+            place_names[nation] = places
+        resolver = place_class.resolver(_db, place_names)
+
         for nation, places in list(coverage.items()):
             try:
-                nation_obj = place_class.lookup_one_by_name(
-                    _db,
+                nation_obj = resolver.lookup_one_by_name(
                     nation,
                     place_type=Place.NATION,
                 )
@@ -206,13 +225,9 @@ class AuthenticationDocument:
                 else:
                     # This library covers a list of places within a
                     # nation.
-                    if isinstance(places, str):
-                        # This is invalid -- you're supposed to always
-                        # pass in a list -- but we can support it.
-                        places = [places]
-                    for place in places:
+                    for place in place_names[nation]:
                         try:
-                            place_obj = nation_obj.lookup_inside(place)
+                            place_obj = resolver.lookup_inside(nation_obj, place)
                             if place_obj:
                                 # We found it.
                                 place_objs.append(place_obj)
@@ -315,6 +330,8 @@ class AuthenticationDocument:
             problem = self.update_service_areas(library)
         if not problem:
             problem = self.update_collection_size(library)
+        if not problem:
+            library.update_search_document()
 
         return problem
 
@@ -361,6 +378,7 @@ class AuthenticationDocument:
     def set_service_areas(cls, library, service_area, focus_area):
         """Replace a library's ServiceAreas with specific new values."""
         service_areas = []
+        old_place_ids = [x.place_id for x in library.service_areas]
 
         # What service_area or focus_area looks like when
         # no input was specified.
@@ -403,6 +421,10 @@ class AuthenticationDocument:
         # which are not mentioned in the list we just gathered.
         library.service_areas = service_areas
 
+        # Keep the tables derived from service areas up to date,
+        # including for places the library no longer serves.
+        library.service_areas_changed(old_place_ids)
+
     @classmethod
     def _update_service_areas(cls, library, areas, type, service_areas):
         """Update a Library's ServiceAreas with a new set based on
@@ -466,11 +488,14 @@ class AuthenticationDocument:
                 )
             )
 
+        old_languages = {x.language for x in library.collections}
         new_collections = set()
         unknown_size = 0
         try:
             for language, size in list(sizes.items()):
-                summary = CollectionSummary.set(library, language, size)
+                summary = CollectionSummary.set(
+                    library, language, size, refresh_statistics=False
+                )
                 if summary.language is None:
                     unknown_size += summary.size
                 new_collections.add(summary)
@@ -478,10 +503,22 @@ class AuthenticationDocument:
                 # We found one or more collections in languages we
                 # didn't recognize. Set the total size of this collection
                 # as the size of a collection with unknown language.
-                new_collections.add(CollectionSummary.set(library, None, unknown_size))
+                new_collections.add(
+                    CollectionSummary.set(
+                        library, None, unknown_size, refresh_statistics=False
+                    )
+                )
         except ValueError as e:
             return INVALID_INTEGRATION_DOCUMENT.detailed(str(e))
 
         # Destroy any CollectionSummaries representing collections
         # no longer associated with this library.
         library.collections = list(new_collections)
+
+        # The per-language statistics may have changed, even for
+        # languages this library no longer has a collection in. They're
+        # refreshed once, now that every summary has been written.
+        CollectionSizeStatistics.refresh(
+            Session.object_session(library),
+            old_languages | {x.language for x in new_collections},
+        )
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""Measure the per-request cost of finding a client's location from
+its IP address.
+
+Compares the original approach (fetch the shared reader and look up
+every address) with GeoIPService, using a stream of addresses in
+which clients from the same network show up repeatedly, the way they
+do in real traffic.
+
+    python benchmarks/geoip.py [--requests N] [--networks N]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+package_dir = os.path.join(os.path.split(__file__)[0], "..")
+sys.path.append(os.path.abspath(package_dir))
+
+from geolite2 import geolite2  # noqa: E402
+
+from util.geoip import GeoIPService  # noqa: E402
+
+
+def addresses(requests, networks, seed=0):
+    """Generate a stream of public IPv4 addresses drawn from a limited
+    number of /24 networks, with a few private addresses mixed in.
+    """
+    rng = random.Random(seed)
+    prefixes = [
+        "%d.%d.%d" % (rng.randint(1, 223), rng.randint(0, 255), rng.randint(0, 255))
+        for i in range(networks)
+    ]
+    stream = []
+    for i in range(requests):
+        if rng.random() < 0.05:
+            stream.append("192.168.%d.%d" % (rng.randint(0, 255), rng.randint(1, 254)))
+        else:
+            stream.append("%s.%d" % (rng.choice(prefixes), rng.randint(1, 254)))
+    return stream
+
+
+def original(ip_address):
+    """The lookup as GeometryUtility.point_from_ip used to do it."""
+    reader = geolite2.reader()
+    if not ip_address:
+        return None
+    match = reader.get(ip_address)
+    if match is None:
+        return None
+    return tuple(match["location"][x] for x in ("latitude", "longitude"))
+
+
+def run(name, lookup, stream):
+    start = time.perf_counter()
+    for ip_address in stream:
+        lookup(ip_address)
+    elapsed = time.perf_counter() - start
+    print(
+        "%-12s %8.2f microseconds per request" % (name, elapsed / len(stream) * 1000000)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=200000)
+    parser.add_argument("--networks", type=int, default=2000)
+    args = parser.parse_args()
+
+    stream = addresses(args.requests, args.networks)
+
+    # Open the database ahead of time so neither approach pays for it.
+    geolite2.reader()
+    service = GeoIPService()
+    service.reader
+
+    run("original", original, stream)
+    run("GeoIPService", service.location, stream)
+    stats = service.stats()
+    print(
+        "cache hit rate %.1f%%, %d private addresses"
+        % (stats["hit_rate"] * 100, stats["private"])
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+"""Measure how long it takes to load places from a NDJSON file.
+
+Compares GeometryLoader, which loads one Place at a time, with
+BulkGeometryLoader, using a generated file shaped like the output of
+geojson-places-us: one nation, some states, and many postal codes,
+each with a polygon outline.
+
+This needs the database named in SIMPLIFIED_PRODUCTION_DATABASE.
+Everything is rolled back afterwards.
+
+    python benchmarks/load_places.py [--states N] [--postal-codes N] [--vertices N]
+        [--workers N]
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from io import StringIO
+
+package_dir = os.path.join(os.path.split(__file__)[0], "..")
+sys.path.append(os.path.abspath(package_dir))
+
+from geometry_loader import BulkGeometryLoader, GeometryLoader  # noqa: E402
+from model import production_session  # noqa: E402
+
+
+def polygon(longitude, latitude, radius, vertices):
+    """A GeoJSON polygon approximating a circle."""
+    ring = [
+        [
+            round(longitude + radius * math.cos(2 * math.pi * i / vertices), 6),
+            round(latitude + radius * math.sin(2 * math.pi * i / vertices), 6),
+        ]
+        for i in range(vertices)
+    ]
+    ring.append(ring[0])
+    return json.dumps(dict(type="Polygon", coordinates=[ring]))
+
+
+def document(states, postal_codes, vertices):
+    """Generate a NDJSON document."""
+    lines = []
+
+    def place(external_id, type, parent_id, name, geometry, abbreviated_name=None):
+        metadata = dict(
+            id=external_id,
+            type=type,
+            parent_id=parent_id,
+            name=name,
+            abbreviated_name=abbreviated_name,
+            aliases=[dict(name=name.upper(), language="eng")],
+        )
+        lines.append(json.dumps(metadata))
+        lines.append(geometry)
+
+    place("ZZ", "nation", None, "Benchmarkland", polygon(-100, 40, 20, vertices), "ZZ")
+    zipcode = 0
+    for state in range(states):
+        state_id = "S%02d" % state
+        longitude = -120 + (state % 10) * 4
+        latitude = 30 + (state // 10) * 4
+        place(
+            state_id,
+            "state",
+            "ZZ",
+            "State %d" % state,
+            polygon(longitude, latitude, 2, vertices),
+            state_id,
+        )
+        for i in range(postal_codes // states):
+            zipcode += 1
+            place(
+                "%05d" % zipcode,
+                "postal_code",
+                state_id,
+                "%05d" % zipcode,
+                polygon(
+                    longitude + (i % 30) * 0.1 - 1.5,
+                    latitude + (i // 30) * 0.1 - 1.5,
+                    0.05,
+                    vertices,
+                ),
+            )
+    return "\n".join(lines), len(lines) // 2
+
+
+def run(name, load, text, records):
+    _db = production_session()
+    try:
+        start = time.perf_counter()
+        load(_db, StringIO(text))
+        elapsed = time.perf_counter() - start
+    finally:
+        _db.rollback()
+        _db.close()
+    print("%-20s %8.1f sec %10.1f records/sec" % (name, elapsed, records / elapsed))
+
+
+def one_at_a_time(_db, fh):
+    for ignore in GeometryLoader(_db).load_ndjson(fh):
+        pass
+
+
+def bulk(workers):
+    def load(_db, fh):
+        BulkGeometryLoader(_db, workers=workers).load_ndjson(fh)
+
+    return load
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--states", type=int, default=50)
+    parser.add_argument("--postal-codes", type=int, default=5000)
+    parser.add_argument("--vertices", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument(
+        "--skip-original",
+        action="store_true",
+        help="Only time BulkGeometryLoader.",
+    )
+    args = parser.parse_args()
+
+    text, records = document(args.states, args.postal_codes, args.vertices)
+    print("%d records, %.1f MB" % (records, len(text) / 1024 / 1024))
+    if not args.skip_original:
+        run("GeometryLoader", one_at_a_time, text, records)
+    run("BulkGeometryLoader", bulk(1), text, records)
+    if args.workers > 1:
+        run("  %d workers" % args.workers, bulk(args.workers), text, records)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+"""Measure how long it takes to score libraries for a user.
+
+Compares Library.relevant(), which scores every library in one large
+SQL query, with RelevanceEngine, which scores them with NumPy, using
+generated libraries scattered across a grid of states. The two are
+checked against each other along the way.
+
+This needs NumPy and the database named in SIMPLIFIED_PRODUCTION_DATABASE.
+Everything is rolled back afterwards.
+
+    python benchmarks/relevance.py [--libraries N] [--lookups N]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+package_dir = os.path.join(os.path.split(__file__)[0], "..")
+sys.path.append(os.path.abspath(package_dir))
+
+from model import (  # noqa: E402
+    Audience,
+    CollectionSummary,
+    Library,
+    Place,
+    ServiceArea,
+    production_session,
+)
+from relevance import RelevanceEngine  # noqa: E402
+
+
+def square(longitude, latitude, size):
+    return "SRID=4326;POLYGON((%s))" % ", ".join(
+        "%f %f" % (longitude + x, latitude + y)
+        for x, y in [(0, 0), (size, 0), (size, size), (0, size), (0, 0)]
+    )
+
+
+def populate(_db, libraries, rng):
+    """Create libraries, each with a state-sized eligibility area and
+    a city-sized focus area.
+    """
+    public = Audience.lookup(_db, Audience.PUBLIC)
+    research = Audience.lookup(_db, Audience.RESEARCH)
+    states = []
+    for i in range(50):
+        longitude, latitude = -120 + (i % 10) * 5, 30 + (i // 10) * 4
+        state = Place(
+            type=Place.STATE,
+            external_id="BS%02d" % i,
+            external_name="Benchmark State %d" % i,
+            geometry=square(longitude, latitude, 4),
+        )
+        _db.add(state)
+        states.append((state, longitude, latitude))
+    for i in range(libraries):
+        state, longitude, latitude = rng.choice(states)
+        city = Place(
+            type=Place.CITY,
+            external_id="BC%05d" % i,
+            external_name="Benchmark City %d" % i,
+            parent=state,
+            geometry=square(
+                longitude + rng.uniform(0, 3.5), latitude + rng.uniform(0, 3.5), 0.2
+            ),
+        )
+        library = Library(
+            name="Benchmark Library %d" % i,
+            authentication_url="https://library%d.example.com/" % i,
+            opds_url="https://library%d.example.com/opds" % i,
+            library_stage=Library.PRODUCTION_STAGE,
+            registry_stage=Library.PRODUCTION_STAGE,
+        )
+        library.audiences = [public] if i % 10 else [public, research]
+        _db.add_all([city, library])
+        _db.add(ServiceArea(library=library, place=state, type=ServiceArea.ELIGIBILITY))
+        _db.add(ServiceArea(library=library, place=city, type=ServiceArea.FOCUS))
+        _db.flush()
+        CollectionSummary.set(library, "eng", rng.randint(0, 100000))
+    _db.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--libraries", type=int, default=1000)
+    parser.add_argument("--lookups", type=int, default=50)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    targets = [
+        (rng.uniform(30, 50), rng.uniform(-120, -70)) for i in range(args.lookups)
+    ]
+    _db = production_session()
+    try:
+        populate(_db, args.libraries, rng)
+
+        start = time.perf_counter()
+        expect = [Library.relevant(_db, target, "eng") for target in targets]
+        original = time.perf_counter() - start
+
+        start = time.perf_counter()
+        engine = RelevanceEngine.load(_db)
+        loaded = time.perf_counter() - start
+        actual = [engine.relevant(_db, target, "eng") for target in targets]
+        vectorized = time.perf_counter() - start - loaded
+
+        for e, a in zip(expect, actual):
+            assert set(e) == set(a)
+            for library, score in e.items():
+                assert abs(a[library] - score) <= 1e-9 * max(1, abs(score))
+    finally:
+        _db.rollback()
+        _db.close()
+
+    print("%d libraries, %d lookups" % (args.libraries, args.lookups))
+    print("Library.relevant  %8.1f ms/lookup" % (original * 1000 / args.lookups))
+    print(
+        "RelevanceEngine   %8.1f ms/lookup (plus %.1f ms to load)"
+        % (vectorized * 1000 / args.lookups, loaded * 1000)
+    )
+
+
+if __name__ == "__main__":
+    main()
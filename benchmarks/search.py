@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+"""Measure how long it takes to search for libraries by name.
+
+Loads a generated set of places shaped like the output of
+geojson-places-us (see load_places.py), adds libraries that serve
+them, and then times Library.search() with and without the trigram
+indexes, and with the in-memory name indexes. The modes are checked
+against each other along the way. Completing the first few letters of
+each query, as the typeahead endpoint does, is timed too.
+
+This needs the database named in SIMPLIFIED_PRODUCTION_DATABASE.
+Everything is rolled back afterwards.
+
+    python benchmarks/search.py [--states N] [--postal-codes N]
+        [--libraries N] [--lookups N]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from io import StringIO
+
+from sqlalchemy import text
+
+package_dir = os.path.join(os.path.split(__file__)[0], "..")
+sys.path.append(os.path.abspath(package_dir))
+
+from load_places import document  # noqa: E402
+
+from geometry_loader import BulkGeometryLoader  # noqa: E402
+from model import (  # noqa: E402
+    Completions,
+    Gazetteer,
+    Library,
+    LibraryAlias,
+    Place,
+    ServiceArea,
+    production_session,
+)
+
+WORDS = [
+    "Public",
+    "County",
+    "Regional",
+    "Memorial",
+    "Free",
+    "District",
+    "Township",
+    "Community",
+]
+
+
+def populate(_db, libraries, rng):
+    """Create libraries, each serving one of the postal codes."""
+    postal_codes = _db.query(Place).filter(Place.type == Place.POSTAL_CODE).all()
+    names = []
+    for i in range(libraries):
+        name = "%s %s Library %d" % (rng.choice(WORDS), rng.choice(WORDS), i)
+        library = Library(
+            name=name,
+            authentication_url="https://library%d.example.com/" % i,
+            opds_url="https://library%d.example.com/opds" % i,
+            library_stage=Library.PRODUCTION_STAGE,
+            registry_stage=Library.PRODUCTION_STAGE,
+        )
+        _db.add(library)
+        _db.add(LibraryAlias(library=library, name="L%d" % i, language=None))
+        _db.add(
+            ServiceArea(
+                library=library,
+                place=rng.choice(postal_codes),
+                type=ServiceArea.FOCUS,
+            )
+        )
+        names.append(name)
+    Library.refresh_search_documents(_db)
+    return names
+
+
+def misspell(name, rng):
+    """Change one character of a name."""
+    i = rng.randrange(len(name))
+    return name[:i] + rng.choice("abcdefghijklmnopqrstuvwxyz") + name[i + 1 :]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--states", type=int, default=50)
+    parser.add_argument("--postal-codes", type=int, default=40000)
+    parser.add_argument("--vertices", type=int, default=20)
+    parser.add_argument("--libraries", type=int, default=5000)
+    parser.add_argument("--lookups", type=int, default=50)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    ndjson, records = document(args.states, args.postal_codes, args.vertices)
+    _db = production_session()
+    try:
+        BulkGeometryLoader(_db).load_ndjson(StringIO(ndjson))
+        names = populate(_db, args.libraries, rng)
+        _db.execute(text("ANALYZE"))
+
+        queries = []
+        for i in range(args.lookups):
+            queries.append(
+                rng.choice(
+                    [
+                        rng.choice(names),
+                        misspell(rng.choice(names), rng),
+                        "State %d" % rng.randrange(args.states),
+                        "%05d" % rng.randint(1, args.postal_codes),
+                        rng.choice(WORDS),
+                    ]
+                )
+            )
+        target = (40, -100)
+
+        # Build the in-memory name indexes before timing anything.
+        Library.name_index(_db)
+        Gazetteer.current(_db).name_index
+
+        modes = [
+            ("Levenshtein only", False, False),
+            ("Trigram indexes", True, False),
+            ("Name index", False, True),
+        ]
+        timings = {}
+        results = {}
+        for name, trigrams, name_index in modes:
+            Library.TRIGRAM_SEARCH = trigrams
+            Library.NAME_INDEX_SEARCH = name_index
+            start = time.perf_counter()
+            results[name] = [
+                [(x.id, distance) for x, distance in Library.search(_db, target, q)]
+                for q in queries
+            ]
+            timings[name] = time.perf_counter() - start
+        for name, ignore, ignore in modes:
+            assert results[name] == results[modes[0][0]]
+
+        start = time.perf_counter()
+        completions = Completions.current(_db)
+        build = time.perf_counter() - start
+        prefixes = [q[:n] for q in queries for n in range(2, 6)]
+        start = time.perf_counter()
+        for prefix in prefixes:
+            completions.complete(prefix, target)
+        complete = time.perf_counter() - start
+    finally:
+        _db.rollback()
+        _db.close()
+
+    print(
+        "%d places, %d libraries, %d lookups" % (records, args.libraries, args.lookups)
+    )
+    for name, ignore, ignore in modes:
+        print("%-17s %8.1f ms/lookup" % (name, timings[name] * 1000 / args.lookups))
+    print(
+        "Typeahead         %8.1f ms/prefix (%.1f s to build)"
+        % (complete * 1000 / len(prefixes), build)
+    )
+
+
+if __name__ == "__main__":
+    main()
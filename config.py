@@ -73,6 +73,15 @@ class Configuration:
     # nation, we assume that they're talking about this nation.
     DEFAULT_NATION_ABBREVIATION = "default_nation_abbreviation"
 
+    # When the Places were last loaded. Processes that keep the
+    # Places in memory reload them when this changes.
+    PLACES_LAST_UPDATE = "places_last_update"
+
+    # When a library's name, aliases, description, stage or service
+    # areas last changed. Processes that cache search results throw
+    # them out when this changes.
+    LIBRARIES_LAST_UPDATE = "libraries_last_update"
+
     # For performance reasons, a registry may want to omit certain
     # pieces of information from large feeds. This sitewide setting
     # controls how big a feed must be to be considered 'large'.
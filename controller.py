@@ -1,7 +1,9 @@
+import hashlib
 import json
 import logging
 import os
 import time
+from collections import namedtuple
 from smtplib import SMTPException
 from urllib.parse import unquote
 
@@ -20,12 +22,17 @@ from config import CannotLoadConfiguration, CannotSendEmail, Configuration
 from emailer import Emailer
 from model import (
     Admin,
+    Completions,
     ConfigurationSetting,
+    Gazetteer,
     Hyperlink,
     Library,
     Place,
+    PlaceGeoJSON,
     Resource,
+    SearchCache,
     ServiceArea,
+    ServiceAreaTile,
     Validation,
     get_one,
     get_one_or_create,
@@ -39,15 +46,20 @@ from problem_details import (
     INVALID_CREDENTIALS,
     LIBRARY_NOT_FOUND,
     NO_AUTH_URL,
+    TILE_NOT_FOUND,
     UNABLE_TO_NOTIFY,
+    UNKNOWN_RESOLUTION,
 )
 from registrar import LibraryRegistrar
+from util import GeometryUtility, LazyLocation
 from util.app_server import ApplicationVersionController, catalog_response
+from util.cache import LRUCache
 from util.http import HTTP
 from util.problem_detail import ProblemDetail
 from util.string_helpers import base64, random_string
 
 OPENSEARCH_MEDIA_TYPE = "application/opensearchdescription+xml"
+MVT_MEDIA_TYPE = "application/vnd.mapbox-vector-tile"
 OPDS_CATALOG_REGISTRATION_MEDIA_TYPE = (
     "application/opds+json;profile=https://librarysimplified.org/rel/profile/directory"
 )
@@ -174,6 +186,9 @@ class LibraryRegistryController(BaseController):
    <Url type="application/atom+xml;profile=opds-catalog" template="%(url_template)s"/>
  </OpenSearchDescription>"""
 
+    # How long, in seconds, clients may cache typeahead suggestions.
+    TYPEAHEAD_MAX_AGE = 3600
+
     def __init__(self, app, emailer_class=Emailer):
         super().__init__(app)
         self.annotator = LibraryRegistryAnnotator(app)
@@ -189,6 +204,7 @@ class LibraryRegistryController(BaseController):
         self.emailer = emailer
 
     def nearby(self, location, live=True):
+        location = LazyLocation.value_of(location)
         qu = Library.nearby(self._db, location, production=live)
         qu = qu.limit(5)
         if live:
@@ -214,7 +230,8 @@ class LibraryRegistryController(BaseController):
             search_controller = "search_qa"
         if query:
             # Run the query and send the results.
-            results = Library.search(self._db, location, query, production=live)
+            location = LazyLocation.value_of(location)
+            results = SearchCache.search(self._db, location, query, production=live)
 
             this_url = self.app.url_for(search_controller, q=query)
             catalog = OPDSCatalog(
@@ -241,6 +258,33 @@ class LibraryRegistryController(BaseController):
             )
             return Response(body, 200, headers)
 
+    def typeahead(self, location, live=True):
+        """Suggest library and place names that start with what the
+        user has typed so far.
+        """
+        query = request.args.get("q", "")
+        location = LazyLocation.value_of(location)
+        completions = Completions.lookup(self._db, query, location, production=live)
+        document = dict(
+            completions=[dict(text=x.text, type=x.type) for x in completions]
+        )
+
+        # Names change rarely, so anyone may cache the response for a
+        # while -- unless it was ordered by a location guessed from the
+        # client's IP address, which isn't part of the URL.
+        if location and location != GeometryUtility.point_from_string(
+            request.args.get("_location")
+        ):
+            scope = "private"
+        else:
+            scope = "public"
+        headers = {
+            "Content-Type": "application/json",
+            "Cache-Control": "%s, no-transform, max-age=%d"
+            % (scope, self.TYPEAHEAD_MAX_AGE),
+        }
+        return Response(json.dumps(document), 200, headers)
+
     def libraries(self, live=True):
         # Return a specific set of information about all libraries in production;
         # this generates the library list in the admin interface.
@@ -311,6 +355,7 @@ class LibraryRegistryController(BaseController):
             joinedload("hyperlinks", "resource"),
             joinedload("hyperlinks", "resource", "validation"),
         )
+        location = LazyLocation.value_of(location)
         if location is None:
             # No location data is available. Use the alphabetical list as
             # the list of libraries.
@@ -528,6 +573,7 @@ class LibraryRegistryController(BaseController):
 
         library._library_stage = library_stage
         library.registry_stage = registry_stage
+        library.service_areas_changed()
         return Response(str(library.internal_urn), 200)
 
     def add_or_edit_pls_id(self):
@@ -910,45 +956,148 @@ class ValidationController(BaseController):
         return self.html_response(200, message)
 
 
+# The result of looking up a coverage document. `generation` is the
+# generation of the Gazetteer that was current at the time.
+CoverageLookup = namedtuple(
+    "CoverageLookup",
+    ["generation", "place_ids", "unknown", "ambiguous", "document", "etag"],
+)
+
+
 class CoverageController(BaseController):
     """Converts coverage area descriptions to GeoJSON documents
     so they can be visualized.
     """
 
-    def geojson_response(self, document):
+    # GeoJSON documents only change when places are reloaded, and
+    # clients can always revalidate them with the ETag.
+    MAX_AGE = 3600 * 24
+    TILE_MAX_AGE = 3600
+
+    # The same coverage documents tend to be looked up over and over,
+    # so the results are cached until the places are reloaded. A
+    # GeoJSON document for a nation at full resolution can take up
+    # megabytes, so the cache is also limited by the total size of
+    # the documents it holds.
+    CACHE_SIZE = 1000
+    CACHE_MAX_BYTES = 64 * 1024 * 1024
+    cache = LRUCache(
+        CACHE_SIZE, max_weight=CACHE_MAX_BYTES, weigh=lambda x: len(x.document)
+    )
+
+    def geojson_response(self, document, etag=None):
         if isinstance(document, dict):
             document = json.dumps(document)
         headers = {"Content-Type": "application/geo+json"}
-        return Response(document, 200, headers=headers)
+        response = Response(document, 200, headers=headers)
+        if etag:
+            response.set_etag(etag)
+            response.headers["Cache-Control"] = "public, no-transform, max-age=%d" % (
+                self.MAX_AGE
+            )
+            response.make_conditional(request)
+        return response
+
+    def resolution(self):
+        """Find the resolution at which the client wants to see
+        geometries.
+
+        :return: A key of PlaceGeoJSON.RESOLUTIONS, or a ProblemDetail.
+        """
+        resolution = request.args.get("resolution", PlaceGeoJSON.FULL)
+        if resolution not in PlaceGeoJSON.RESOLUTIONS:
+            return UNKNOWN_RESOLUTION.detailed(
+                _(
+                    "Resolution must be one of: %(resolutions)s",
+                    resolutions=", ".join(PlaceGeoJSON.RESOLUTIONS),
+                )
+            )
+        return resolution
 
     def lookup(self):
+        resolution = self.resolution()
+        if isinstance(resolution, ProblemDetail):
+            return resolution
         coverage = request.args.get("coverage")
         try:
             coverage = json.loads(coverage)
         except ValueError:
             pass
+        result = self.lookup_coverage(coverage, resolution)
+        return self.geojson_response(result.document, result.etag)
+
+    def lookup_coverage(self, coverage, resolution):
+        """Turn a coverage document into GeoJSON, using the cache if
+        possible.
+
+        :param coverage: A coverage document, as parsed JSON or a string.
+        :param resolution: A key of PlaceGeoJSON.RESOLUTIONS.
+        :return: A CoverageLookup.
+        """
+        # Equivalent coverage documents get the same key no matter how
+        # they were formatted.
+        key = (json.dumps(coverage, sort_keys=True), resolution)
+        generation = Gazetteer.current(self._db).generation
+        cached = self.cache.get(key)
+        if cached is not LRUCache.MISSING and cached.generation == generation:
+            return cached
+
         places, unknown, ambiguous = AuthenticationDocument.parse_coverage(
             self._db, coverage
         )
-        document = Place.to_geojson(self._db, *places)
+        document, etag = Place.geojson_document(self._db, places, resolution)
 
         # Extend the GeoJSON with extra information about parts of the
         # coverage document we found ambiguous or couldn't associate
         # with a Place.
-        if unknown:
-            document["unknown"] = unknown
-        if ambiguous:
-            document["ambiguous"] = ambiguous
-        return self.geojson_response(document)
+        if unknown or ambiguous:
+            extra = {}
+            if unknown:
+                extra["unknown"] = unknown
+            if ambiguous:
+                extra["ambiguous"] = ambiguous
+            document = json.loads(document)
+            document.update(extra)
+            document = json.dumps(document)
+            etag = hashlib.md5(
+                (etag + json.dumps(extra, sort_keys=True)).encode("utf8")
+            ).hexdigest()
+
+        result = CoverageLookup(
+            generation, [x.id for x in places], unknown, ambiguous, document, etag
+        )
+        self.cache.set(key, result)
+        return result
 
     def _geojson_for_service_area(self, service_type):
         """Serve a GeoJSON document describing some subset of the active
         library's service areas.
         """
+        resolution = self.resolution()
+        if isinstance(resolution, ProblemDetail):
+            return resolution
         areas = [
             x.place for x in request.library.service_areas if x.type == service_type
         ]
-        return self.geojson_response(Place.to_geojson(self._db, *areas))
+        document, etag = Place.geojson_document(self._db, areas, resolution)
+        return self.geojson_response(document, etag)
+
+    def tile(self, z, x, y, live=True):
+        """Serve a Mapbox vector tile showing the service areas of
+        the libraries in a feed.
+
+        :param live: If this is False, libraries in testing are also shown.
+        """
+        if not ServiceAreaTile.is_valid(z, x, y):
+            return TILE_NOT_FOUND
+        data = ServiceAreaTile.tile(self._db, z, x, y, production=live)
+        headers = {
+            "Content-Type": MVT_MEDIA_TYPE,
+            # Tiles change whenever a library's service area does,
+            # so they're not cached for as long as GeoJSON documents.
+            "Cache-Control": "public, no-transform, max-age=%d" % self.TILE_MAX_AGE,
+        }
+        return Response(data, 200, headers=headers)
 
     def eligibility_for_library(self):
         """Serve a GeoJSON document representing the eligibility area
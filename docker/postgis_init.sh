@@ -14,8 +14,10 @@ psql -v ON_ERROR_STOP=1 --username="$POSTGRES_USER" --dbname "$POSTGRES_DB" <<-E
     \c simplified_registry_dev
     CREATE EXTENSION fuzzystrmatch;
     CREATE EXTENSION postgis;
+    CREATE EXTENSION pg_trgm;
 
     \c simplified_registry_test
     CREATE EXTENSION fuzzystrmatch;
     CREATE EXTENSION postgis;
+    CREATE EXTENSION pg_trgm;
 EOSQL
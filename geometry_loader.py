@@ -1,17 +1,47 @@
+import hashlib
 import json
+import multiprocessing
+import time
+from io import StringIO
 
-from model import Place, PlaceAlias, get_one_or_create
+from sqlalchemy import text
+from sqlalchemy.orm import lazyload
+
+from model import Place, PlaceAlias, create, get_one_or_create
 from util import GeometryUtility
 
 
 class GeometryLoader:
     """Load Place objects from a NDJSON document like that generated by
     geojson-places-us.
+
+    Only the IDs of the places that have been loaded are kept around,
+    so that later records can refer to them as parents. If a
+    `batch_size` is given, the session is emptied after every batch
+    of records, so that memory use doesn't grow with the size of the
+    document.
+
+    The tables derived from Places are brought up to date once per
+    batch, and at the end of the document, rather than after every
+    record. If you call load() directly, call update_derived_tables()
+    when you're done.
     """
 
-    def __init__(self, _db):
+    def __init__(self, _db, batch_size=None):
+        """Constructor.
+
+        :param batch_size: Flush and expunge the session after loading
+            this many records. The Place objects returned by earlier
+            calls to load_ndjson() become detached when this happens.
+        """
         self._db = _db
-        self.places_by_external_id = dict()
+        self.batch_size = batch_size
+        self.place_ids_by_external_id = dict()
+        self.records = 0
+        self.new = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.changed_place_ids = []
 
     def load_ndjson(self, fh):
         while True:
@@ -21,9 +51,24 @@ class GeometryLoader:
                 break
             geometry = fh.readline().strip()
             yield self.load(metadata, geometry)
+            self.records += 1
+            if self.batch_size and not self.records % self.batch_size:
+                self.update_derived_tables()
+                self._db.expunge_all()
+        self.update_derived_tables()
+
+    def update_derived_tables(self):
+        """Bring everything derived from the Places changed since the
+        last call up to date.
+        """
+        self._db.flush()
+        if self.changed_place_ids:
+            Place.update_derived_tables(self._db, self.changed_place_ids)
+            self.changed_place_ids = []
 
     def load(self, metadata, geometry):
         metadata = json.loads(metadata)
+        hash = content_hash(metadata, geometry)
         external_id = metadata["id"]
         type = metadata["type"]
         parent_external_id = metadata["parent_id"]
@@ -32,21 +77,40 @@ class GeometryLoader:
         abbreviated_name = metadata.get("abbreviated_name", None)
 
         if parent_external_id:
-            parent = self.places_by_external_id[parent_external_id]
+            parent_id = self.place_ids_by_external_id[parent_external_id]
         else:
-            parent = None
+            parent_id = None
 
         # This gives us a Geometry object. Set its SRID so the database
         # knows it's using real-world latitude and longitude.
         geometry = GeometryUtility.from_geojson(geometry)
-        place, is_new = get_one_or_create(
-            self._db,
-            Place,
-            external_id=external_id,
-            type=type,
-            parent=parent,
-            create_method_kwargs=dict(geometry=geometry),
+        key = dict(external_id=external_id, type=type, parent_id=parent_id)
+
+        # Don't load the children of the place along with it. A
+        # nation's children are every state, with their geometries.
+        place = (
+            self._db.query(Place)
+            .options(lazyload(Place.children))
+            .filter_by(**key)
+            .one_or_none()
         )
+        is_new = place is None
+        if is_new:
+            place, is_new = create(
+                self._db, Place, create_method_kwargs=dict(geometry=geometry), **key
+            )
+        self.place_ids_by_external_id[external_id] = place.id
+
+        if not is_new and place.content_hash == hash:
+            # This record is exactly the same as the last time it was
+            # loaded. Leave the place (and everything derived from it)
+            # alone.
+            self.unchanged += 1
+            return place, is_new
+        if is_new:
+            self.new += 1
+        else:
+            self.updated += 1
 
         # Set these values, even the ones that were set in
         # create_method_kwargs, so that we can update any that have
@@ -54,6 +118,10 @@ class GeometryLoader:
         place.external_name = name
         place.abbreviated_name = abbreviated_name
         place.geometry = geometry
+        place.content_hash = hash
+
+        # Anything derived from the old geometry is now out of date.
+        self.changed_place_ids.append(place.id)
 
         # We only ever add aliases. If the database contains an alias
         # for this place that doesn't show up in the metadata, it
@@ -61,8 +129,409 @@ class GeometryLoader:
         for alias in aliases:
             name = alias["name"]
             language = alias["language"]
-            alias, is_new = get_one_or_create(
+            get_one_or_create(
                 self._db, PlaceAlias, place=place, name=name, language=language
             )
-        self.places_by_external_id[external_id] = place
         return place, is_new
+
+
+def content_hash(metadata, geometry):
+    """Hash a record from a NDJSON document, so that we can tell
+    whether it has changed since the last time it was loaded.
+
+    :param metadata: The record's metadata, as a dictionary.
+    :param geometry: The record's geometry, as a GeoJSON string.
+    """
+    hash = hashlib.sha256()
+    hash.update(json.dumps(metadata, sort_keys=True).encode("utf8"))
+    hash.update(b"\n")
+    hash.update(geometry.strip().encode("utf8"))
+    return hash.hexdigest()
+
+
+def parse_record(metadata, geometry):
+    """Turn a metadata/geometry line pair into a row for the staging
+    table used by BulkGeometryLoader.
+
+    This runs in worker processes, so it does all the parsing and
+    checking that doesn't need the database.
+
+    :return: A tuple (external_id, type, parent_external_id, name,
+        abbreviated_name, aliases, geometry, content_hash). `aliases`
+        is a JSON list and `geometry` is a GeoJSON string.
+    :raise ValueError: If the record is missing information or its
+        geometry isn't a GeoJSON object.
+    """
+    metadata = json.loads(metadata)
+    for key in ("id", "type", "name"):
+        if not metadata.get(key):
+            raise ValueError("Place record has no %s: %r" % (key, metadata))
+    try:
+        parsed_geometry = json.loads(geometry)
+    except ValueError:
+        parsed_geometry = None
+    if not isinstance(parsed_geometry, dict) or "type" not in parsed_geometry:
+        raise ValueError("Place %s has an invalid geometry." % metadata["id"])
+    aliases = [
+        dict(name=alias["name"], language=alias["language"])
+        for alias in metadata.get("aliases", [])
+    ]
+    return (
+        metadata["id"],
+        metadata["type"],
+        metadata.get("parent_id"),
+        metadata["name"],
+        metadata.get("abbreviated_name", None),
+        json.dumps(aliases),
+        geometry,
+        content_hash(metadata, geometry),
+    )
+
+
+class BulkGeometryLoader:
+    """Load Place objects from a NDJSON document with a handful of
+    set-based SQL statements, instead of one round trip per Place.
+
+    The records are streamed into a temporary staging table with
+    COPY. Places are then matched, inserted and updated one level of
+    the hierarchy at a time, so that every Place's parent is known
+    before the Place itself is written. The results are the same as
+    running GeometryLoader over the same document:
+
+    * A Place is identified by its external ID, type and parent.
+    * A record for an existing Place updates it in place, unless the
+      record hasn't changed since it was last loaded.
+    * Aliases are only ever added, never removed.
+    """
+
+    # The number of records sent to the database with each COPY.
+    BATCH_SIZE = 1000
+
+    STAGING_TABLE = "placestaging"
+
+    def __init__(self, _db, progress=None, workers=1):
+        """Constructor.
+
+        :param progress: A function that will be called with a
+            message after each batch of records is staged.
+        :param workers: The number of processes to use for parsing
+            records. While one batch of records is being sent to the
+            database, the workers parse the next one.
+        """
+        self._db = _db
+        self.progress = progress
+        self.workers = workers
+        self.records = 0
+        self.new = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.changed_place_ids = []
+        self.elapsed = 0
+
+    def execute(self, sql, **kwargs):
+        return self._db.execute(text(sql), kwargs)
+
+    @classmethod
+    def copy_value(cls, value):
+        """Escape a value for COPY's text format."""
+        if value is None:
+            return "\\N"
+        return (
+            str(value)
+            .replace("\\", "\\\\")
+            .replace("\t", "\\t")
+            .replace("\n", "\\n")
+            .replace("\r", "\\r")
+        )
+
+    def stage(self, rows):
+        """Send a batch of rows to the staging table."""
+        buffer = StringIO()
+        for row in rows:
+            self.records += 1
+            buffer.write(
+                "\t".join(self.copy_value(x) for x in (self.records,) + row) + "\n"
+            )
+        buffer.seek(0)
+        cursor = self._db.connection().connection.cursor()
+        try:
+            cursor.copy_expert(
+                "COPY %s (seq, external_id, type, parent_external_id, name, "
+                "abbreviated_name, aliases, geometry, content_hash) FROM STDIN"
+                % self.STAGING_TABLE,
+                buffer,
+            )
+        finally:
+            cursor.close()
+
+    def line_pairs(self, fh):
+        """Read batches of metadata/geometry line pairs."""
+        batch = []
+        while True:
+            metadata = fh.readline().strip()
+            if not metadata:
+                # End of file.
+                break
+            geometry = fh.readline().strip()
+            batch.append((metadata, geometry))
+            if len(batch) >= self.BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def batches(self, fh):
+        """Read batches of records and turn them into rows, in order."""
+        if self.workers <= 1:
+            for batch in self.line_pairs(fh):
+                yield [parse_record(*pair) for pair in batch]
+            return
+
+        # Keep the workers busy with the next batch while the current
+        # batch is being staged. Only two batches are in memory at once.
+        with multiprocessing.Pool(self.workers) as pool:
+            pending = None
+            for batch in self.line_pairs(fh):
+                chunksize = max(1, len(batch) // (self.workers * 4))
+                parsing = pool.starmap_async(parse_record, batch, chunksize)
+                if pending is not None:
+                    yield pending.get()
+                pending = parsing
+            if pending is not None:
+                yield pending.get()
+
+    def load_ndjson(self, fh):
+        """Load every record in a NDJSON document.
+
+        :return: A list of the IDs of every Place that was created or
+            changed.
+        """
+        start = time.time()
+        self._db.flush()
+        self.execute("DROP TABLE IF EXISTS %s" % self.STAGING_TABLE)
+        self.execute(
+            """CREATE TEMPORARY TABLE %s (
+                seq integer PRIMARY KEY,
+                external_id varchar,
+                type varchar,
+                parent_external_id varchar,
+                name varchar,
+                abbreviated_name varchar,
+                aliases jsonb,
+                geometry text,
+                content_hash varchar,
+                parent_seq integer,
+                depth integer,
+                parent_id integer,
+                place_id integer,
+                is_new boolean,
+                is_changed boolean
+            )"""
+            % self.STAGING_TABLE
+        )
+
+        for rows in self.batches(fh):
+            self.stage(rows)
+            self.report(start)
+
+        place_ids = self.upsert()
+        self.execute("DROP TABLE %s" % self.STAGING_TABLE)
+
+        # Anything derived from the old geometries is now out of date.
+        if place_ids:
+            Place.update_derived_tables(self._db, place_ids)
+
+        # The ORM doesn't know what just happened to these tables.
+        self._db.expire_all()
+        self.elapsed = time.time() - start
+        return place_ids
+
+    def report(self, start):
+        if not self.progress:
+            return
+        elapsed = time.time() - start
+        self.progress(
+            "Staged %d records (%.1f records/sec)"
+            % (self.records, self.records / max(elapsed, 0.001))
+        )
+
+    def upsert(self):
+        """Create and update Places and PlaceAliases from the staged
+        records.
+
+        :return: A list of the IDs of the Places that were created or
+            changed.
+        """
+        staging = self.STAGING_TABLE
+        self.execute("CREATE INDEX ON %s (external_id, seq)" % staging)
+        self.execute("ANALYZE %s" % staging)
+
+        # A record's parent is the most recent record before it with
+        # the parent's external ID.
+        self.execute(
+            """UPDATE {0} AS s SET parent_seq = (
+                SELECT max(p.seq) FROM {0} AS p
+                WHERE p.external_id = s.parent_external_id AND p.seq < s.seq
+            ) WHERE s.parent_external_id IS NOT NULL""".format(
+                staging
+            )
+        )
+        orphan = self.execute(
+            """SELECT external_id, parent_external_id FROM %s
+            WHERE parent_external_id IS NOT NULL AND parent_seq IS NULL
+            ORDER BY seq LIMIT 1"""
+            % staging
+        ).first()
+        if orphan:
+            raise ValueError(
+                "Place %s has a parent (%s) that doesn't appear before it."
+                % tuple(orphan)
+            )
+
+        # Work out how far down the hierarchy each record is.
+        self.execute(
+            """WITH RECURSIVE levels (seq, depth) AS (
+                SELECT seq, 0 FROM {0} WHERE parent_seq IS NULL
+                UNION ALL
+                SELECT s.seq, levels.depth + 1
+                FROM {0} AS s JOIN levels ON s.parent_seq = levels.seq
+            )
+            UPDATE {0} SET depth = levels.depth
+            FROM levels WHERE {0}.seq = levels.seq""".format(
+                staging
+            )
+        )
+        max_depth = self.execute("SELECT max(depth) FROM %s" % staging).scalar()
+        if max_depth is None:
+            # There were no records.
+            return []
+
+        for depth in range(max_depth + 1):
+            self.upsert_level(depth)
+
+        # We only ever add aliases. If the database contains an alias
+        # for a place that doesn't show up in the metadata, it may
+        # have been created manually. An unchanged record can't have
+        # any new aliases.
+        self.execute(
+            """INSERT INTO placealiases (place_id, name, language)
+            SELECT DISTINCT s.place_id, alias->>'name', alias->>'language'
+            FROM %s AS s CROSS JOIN LATERAL jsonb_array_elements(s.aliases) AS alias
+            WHERE s.is_changed AND NOT EXISTS (
+                SELECT 1 FROM placealiases AS a
+                WHERE a.place_id = s.place_id
+                AND a.name = alias->>'name'
+                AND a.language IS NOT DISTINCT FROM alias->>'language'
+            )"""
+            % staging
+        )
+
+        # A Place's last record decides whether it changed.
+        counts = self.execute(
+            """SELECT count(*) FILTER (WHERE is_new),
+                      count(*) FILTER (WHERE is_changed AND NOT is_new),
+                      count(*) FILTER (WHERE NOT is_changed)
+            FROM (
+                SELECT DISTINCT ON (place_id) is_new, is_changed FROM %s
+                ORDER BY place_id, seq DESC
+            ) AS latest"""
+            % staging
+        ).first()
+        self.new, self.updated, self.unchanged = counts
+        return [
+            x
+            for [x] in self.execute(
+                """SELECT DISTINCT place_id FROM %s WHERE is_changed
+                ORDER BY place_id"""
+                % staging
+            )
+        ]
+
+    def upsert_level(self, depth):
+        """Create and update the Places at one level of the hierarchy.
+        Every Place at the level above has already been written.
+        """
+        staging = self.STAGING_TABLE
+        self.execute(
+            """UPDATE {0} AS s SET parent_id = p.place_id
+            FROM {0} AS p WHERE s.parent_seq = p.seq AND s.depth = :depth""".format(
+                staging
+            ),
+            depth=depth,
+        )
+
+        # Find the Places that already exist.
+        self.execute(
+            """UPDATE {0} AS s SET place_id = existing.id, is_new = false
+            FROM (
+                SELECT r.seq, min(places.id) AS id
+                FROM {0} AS r JOIN places
+                    ON places.external_id = r.external_id
+                    AND places.type = r.type
+                    AND places.parent_id IS NOT DISTINCT FROM r.parent_id
+                WHERE r.depth = :depth
+                GROUP BY r.seq
+            ) AS existing
+            WHERE s.seq = existing.seq""".format(
+                staging
+            ),
+            depth=depth,
+        )
+
+        # Give each new Place an ID. If the same Place shows up more
+        # than once, every record for it gets the same ID.
+        self.execute(
+            """UPDATE {0} AS s SET place_id = new.id, is_new = true, is_changed = true
+            FROM (
+                SELECT external_id, type, parent_id,
+                       nextval(pg_get_serial_sequence('places', 'id')) AS id
+                FROM (
+                    SELECT DISTINCT external_id, type, parent_id FROM {0}
+                    WHERE depth = :depth AND place_id IS NULL
+                ) AS keys
+            ) AS new
+            WHERE s.depth = :depth AND s.place_id IS NULL
+            AND s.external_id = new.external_id
+            AND s.type = new.type
+            AND s.parent_id IS NOT DISTINCT FROM new.parent_id""".format(
+                staging
+            ),
+            depth=depth,
+        )
+
+        # Existing Places only need to be rewritten if their records
+        # have changed since they were last loaded.
+        self.execute(
+            """UPDATE {0} AS s
+            SET is_changed = places.content_hash IS DISTINCT FROM s.content_hash
+            FROM places
+            WHERE places.id = s.place_id AND s.depth = :depth AND NOT s.is_new""".format(
+                staging
+            ),
+            depth=depth,
+        )
+
+        # When there's more than one record for a Place, the last one
+        # wins.
+        latest = """SELECT DISTINCT ON (place_id) * FROM {0}
+            WHERE depth = :depth AND is_new = {1}
+            ORDER BY place_id, seq DESC"""
+        self.execute(
+            """INSERT INTO places (id, external_id, type, parent_id,
+                external_name, abbreviated_name, geometry, content_hash)
+            SELECT place_id, external_id, type, parent_id, name,
+                abbreviated_name, ST_SetSRID(ST_GeomFromGeoJSON(geometry), 4326),
+                content_hash
+            FROM (%s) AS s"""
+            % latest.format(staging, "true"),
+            depth=depth,
+        )
+        self.execute(
+            """UPDATE places SET external_name = s.name,
+                abbreviated_name = s.abbreviated_name,
+                geometry = ST_SetSRID(ST_GeomFromGeoJSON(s.geometry), 4326),
+                content_hash = s.content_hash
+            FROM (%s) AS s WHERE places.id = s.place_id AND s.is_changed"""
+            % latest.format(staging, "false"),
+            depth=depth,
+        )
@@ -1,43 +1,55 @@
 from __future__ import annotations
 
 import datetime
+import hashlib
+import heapq
+import itertools
 import json
 import logging
+import math
 import random
 import re
 import string
+import time
 import uuid
 import warnings
-from collections import Counter, defaultdict
+from collections import Counter, defaultdict, namedtuple
+from threading import Lock, Thread
 from typing import TYPE_CHECKING
 
-import uszipcode
 from flask_babel import lazy_gettext as _
 from flask_bcrypt import check_password_hash, generate_password_hash
 from geoalchemy2 import Geography, Geometry
 from psycopg2.extensions import adapt as sqlescape
 from sqlalchemy import (
+    BigInteger,
     Boolean,
     Column,
     DateTime,
     Enum,
+    Float,
     ForeignKey,
     Index,
     Integer,
+    LargeBinary,
     String,
     Table,
     Unicode,
     UniqueConstraint,
     create_engine,
+    event,
 )
 from sqlalchemy import exc as sa_exc
-from sqlalchemy import func
+from sqlalchemy import func, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine import Engine
 from sqlalchemy.exc import IntegrityError, MultipleResultsFound, NoResultFound
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import (
     aliased,
     backref,
     declarative_base,
+    lazyload,
     relationship,
     sessionmaker,
     validates,
@@ -48,22 +60,29 @@ from sqlalchemy.sql.expression import (
     and_,
     case,
     cast,
+    distinct,
     join,
+    literal,
     literal_column,
     or_,
     outerjoin,
     select,
+    union_all,
 )
 
 from config import Configuration
 from emailer import Emailer
 from util import GeometryUtility
+from util.cache import LRUCache
+from util.completion import PrefixIndex
+from util.fuzzy import DeletionIndex
 from util.language import LanguageCodes
+from util.postal_codes import CityPostalCodes
 from util.short_client_token import ShortClientTokenTool
 from util.string_helpers import random_string
 
 if TYPE_CHECKING:
-    from sqlalchemy.engine import Connection, Engine
+    from sqlalchemy.engine import Connection
 
 
 def production_session():
@@ -92,6 +111,18 @@ def generate_secret():
     return random_string(24)
 
 
+@event.listens_for(Session, "after_begin")
+def set_similarity_threshold(session, transaction, connection):
+    """Library.fuzzy_match() relies on pg_trgm's % operator using
+    Library.TRIGRAM_SIMILARITY_THRESHOLD. Set it at the start of every
+    transaction, so it holds no matter where the engine came from.
+    """
+    threshold = str(Library.TRIGRAM_SIMILARITY_THRESHOLD)
+    connection.execute(
+        select([func.set_config("pg_trgm.similarity_threshold", threshold, True)])
+    )
+
+
 class SessionManager:
 
     engine_for_url = {}
@@ -99,7 +130,8 @@ class SessionManager:
     @classmethod
     def engine(cls, url=None):
         url = url or Configuration.database_url()
-        return create_engine(url, echo=DEBUG)
+        engine = create_engine(url, echo=DEBUG)
+        return engine
 
     @classmethod
     def sessionmaker(cls, url=None):
@@ -118,6 +150,9 @@ class SessionManager:
 
         engine = cls.engine(url)
 
+        # The trigram indexes used to search for names need this.
+        with engine.begin() as connection:
+            connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
         Base.metadata.create_all(engine)
 
         cls.engine_for_url[url] = engine
@@ -263,6 +298,11 @@ class Library(Base):
     # Human-readable explanation of who the library serves.
     description = Column(Unicode)
 
+    # The library's name, aliases and description, prepared for
+    # full-text search. Call update_search_document() after changing
+    # any of them.
+    search_document = Column(postgresql.TSVECTOR)
+
     # An internally generated unique URN. This is used in controller
     # URLs to identify a library. A registry will always use the same
     # URN to identify a given library, even if the library's OPDS
@@ -631,6 +671,21 @@ class Library(Base):
                 library_field.in_((prod, test)), registry_field.in_((prod, test))
             )
 
+    # Constants that determine the weights of different components of
+    # the score given by relevant(). These may need to be adjusted when
+    # there are more libraries in the system to test with.
+    RELEVANCE_BASE_SCORE = 1
+    RELEVANCE_AUDIENCE_FACTOR = 1.01
+    RELEVANCE_COLLECTION_SIZE_FACTOR = 1000
+    RELEVANCE_FOCUS_AREA_DISTANCE_FACTOR = 0.005
+    RELEVANCE_ELIGIBILITY_AREA_DISTANCE_FACTOR = 0.1
+    RELEVANCE_FOCUS_AREA_SIZE_FACTOR = 0.00000001
+    RELEVANCE_SCORE_THRESHOLD = 0.00001
+
+    # The area of the Earth, in square meters. This is the size of a
+    # focus area that covers everywhere.
+    EVERYWHERE_AREA = 510000000000000
+
     @classmethod
     def relevant(cls, _db, target, language, audiences=None, production=True):
         """Find libraries that are most relevant for a user.
@@ -646,16 +701,15 @@ class Library(Base):
         :return A Counter mapping Library objects to scores.
         """
 
-        # Constants that determine the weights of different components of the score.
-        # These may need to be adjusted when there are more libraries in the system to
-        # test with.
-        base_score = 1
-        audience_factor = 1.01
-        collection_size_factor = 1000
-        focus_area_distance_factor = 0.005
-        eligibility_area_distance_factor = 0.1
-        focus_area_size_factor = 0.00000001
-        score_threshold = 0.00001
+        base_score = cls.RELEVANCE_BASE_SCORE
+        audience_factor = cls.RELEVANCE_AUDIENCE_FACTOR
+        collection_size_factor = cls.RELEVANCE_COLLECTION_SIZE_FACTOR
+        focus_area_distance_factor = cls.RELEVANCE_FOCUS_AREA_DISTANCE_FACTOR
+        eligibility_area_distance_factor = (
+            cls.RELEVANCE_ELIGIBILITY_AREA_DISTANCE_FACTOR
+        )
+        focus_area_size_factor = cls.RELEVANCE_FOCUS_AREA_SIZE_FACTOR
+        score_threshold = cls.RELEVANCE_SCORE_THRESHOLD
 
         # By default, only show libraries that are for the general public.
         audiences = audiences or [Audience.PUBLIC]
@@ -736,16 +790,11 @@ class Library(Base):
             return func.exp(exponent)
 
         # Get the maximum collection size for the user's language.
-        collections_by_size = (
-            _db.query(CollectionSummary)
-            .filter(CollectionSummary.language == language_code)
-            .order_by(CollectionSummary.size.desc())
-        )
-
-        if collections_by_size.count() == 0:
+        statistics = CollectionSizeStatistics.for_language(_db, language_code)
+        if statistics is None:
             max = 0
         else:
-            max = collections_by_size.first().size
+            max = statistics.max_size
 
         # Only take collection size into account in the ranking if there's at
         # least one library with a non-empty collection in the user's language.
@@ -828,7 +877,7 @@ class Library(Base):
                     [
                         (
                             focus_areas_subquery.c.type == Place.EVERYWHERE,
-                            literal_column(str(510000000000000)),
+                            literal_column(str(cls.EVERYWHERE_AREA)),
                         )
                     ],
                     else_=func.ST_Area(focus_areas_subquery.c.geometry),
@@ -893,8 +942,10 @@ class Library(Base):
         """Find libraries whose service areas include or are close to the
         given point.
 
-        :param target: The starting point. May be a Geometry object or
-         a 2-tuple (latitude, longitude).
+        :param target: The starting point. May be a Geometry object, a
+         2-tuple (latitude, longitude), or a Place representing a
+         postal code, in which case the answer is looked up in
+         PostalCodeLibrary.
         :param max_radius: How far out from the starting point to search
             for a library's service area, in kilometers.
         :param production: If True, only libraries that are ready for
@@ -904,6 +955,9 @@ class Library(Base):
         (library, distance from starting point). Distances are
         measured in meters.
         """
+        if isinstance(target, Place) and target.type == Place.POSTAL_CODE:
+            return cls.near_postal_code(_db, target, max_radius, production)
+
         # We start with a single point on the globe. Call this Point
         # A.
         if isinstance(target, tuple):
@@ -922,16 +976,31 @@ class Library(Base):
         # different parts of the world.)
         distance_to_other_point = func.ST_Distance(target, other_point)
 
-        # Find all Places that are no further away from A than that
-        # number of radians.
-        nearby = func.ST_DWithin(target, Place.geometry, distance_to_other_point)
+        # Find all served Places that are no further away from A than
+        # that number of radians. Only places that are part of some
+        # library's service area are considered, so we look in
+        # ServedPlace rather than Place. The distance check itself is
+        # run against the small pieces of each place's outline rather
+        # than the (possibly enormous) outline as a whole.
+        nearby = func.ST_DWithin(
+            target, PlaceSubdivision.geometry, distance_to_other_point
+        )
 
         # For each library served by such a place, calculate the
         # minimum distance between the library's service area and
-        # Point A in meters.
-        min_distance = func.min(func.ST_DistanceSphere(target, Place.geometry))
+        # Point A in meters. The distance to a place is the distance
+        # to the closest of its pieces.
+        min_distance = func.min(
+            func.ST_DistanceSphere(target, PlaceSubdivision.geometry)
+        )
 
-        qu = _db.query(Library).join(Library.service_areas).join(ServiceArea.place)
+        qu = (
+            _db.query(Library)
+            .join(Library.service_areas)
+            .join(ServedPlace, ServiceArea.place_id == ServedPlace.place_id)
+            .join(PlaceSubdivision, ServedPlace.place_id == PlaceSubdivision.place_id)
+        )
+        qu = qu.filter(ServedPlace.feed_restriction(production))
         qu = qu.filter(cls._feed_restriction(production))
         qu = qu.filter(nearby)
         qu = (
@@ -954,11 +1023,14 @@ class Library(Base):
 
         :param production: If True, only libraries that are ready for
             production are shown.
+
+        :return: A list of Libraries or, if there's a target, a list
+            of 2-tuples (library, distance in meters).
         """
         # We don't anticipate a lot of libraries or a lot of
         # localities with the same name, but we need to have _some_
         # kind of limit just to place an upper bound on how bad things
-        # can get. This will guarantee we never return more than 20
+        # can get. This will guarantee we never return more than 30
         # results.
         max_libraries = 10
 
@@ -974,44 +1046,65 @@ class Library(Base):
             here = None
 
         library_query, place_query, place_type = cls.query_parts(query)
-        # We start with libraries that match the name query.
+
+        # We start with libraries that match the name query. We tack
+        # on any additional libraries that match a place query. A lot
+        # of libraries list their locations only within their
+        # description, so it's worth checking the description for the
+        # search term.
+        strategies = [None, None, None]
         if library_query:
-            libraries_for_name = (
-                cls.search_by_library_name(_db, library_query, here, production)
-                .limit(max_libraries)
-                .all()
+            strategies[0] = cls.search_by_library_name(
+                _db, library_query, here, production
             )
-        else:
-            libraries_for_name = []
-
-        # We tack on any additional libraries that match a place query.
         if place_query:
-            libraries_for_location = (
-                cls.search_by_location_name(
-                    _db, place_query, place_type, here, production
-                )
-                .limit(max_libraries)
-                .all()
+            strategies[1] = cls.search_by_location_name(
+                _db, place_query, place_type, here, production
             )
-        else:
-            libraries_for_location = []
-
-        if libraries_for_name and libraries_for_location:
-            # Filter out any libraries that show up in both lists.
-            for_name = set(libraries_for_name)
-            libraries_for_location = [
-                x for x in libraries_for_location if x not in for_name
-            ]
+        strategies[2] = cls.search_within_description(_db, query, here, production)
 
-        # A lot of libraries list their locations only within their description, so it's worth
-        # checking the description for the search term.
-        libraries_for_description = (
-            cls.search_within_description(_db, query, here, production)
-            .limit(max_libraries)
-            .all()
+        # Each strategy contributes its best max_libraries results, in
+        # its own order, all in one statement.
+        branches = []
+        for kind, qu in enumerate(strategies):
+            if qu is None:
+                continue
+            found = qu.limit(max_libraries).subquery()
+            order = [found.c.id]
+            if here:
+                order.insert(0, found.c.distance)
+                distance = found.c.distance
+            else:
+                distance = cast(literal(None), Float)
+            if kind == 2:
+                tsquery = func.plainto_tsquery(cls.SEARCH_CONFIGURATION, query)
+                order.insert(0, func.ts_rank(found.c.search_document, tsquery).desc())
+            branches.append(
+                select(
+                    [
+                        found.c.id.label("library_id"),
+                        literal_column(str(kind)).label("kind"),
+                        func.row_number().over(order_by=order).label("position"),
+                        distance.label("distance"),
+                    ]
+                )
+            )
+        found = union_all(*branches).subquery()
+
+        # A library found more than one way shows up only once, where
+        # it was first found: by name, then by location, then by
+        # description.
+        best = (
+            select([found])
+            .distinct(found.c.library_id)
+            .order_by(found.c.library_id, found.c.kind, found.c.position)
+            .subquery()
         )
-
-        return libraries_for_name + libraries_for_location + libraries_for_description
+        qu = _db.query(Library).join(best, Library.id == best.c.library_id)
+        if here:
+            qu = qu.add_columns(best.c.distance)
+        qu = qu.order_by(best.c.kind, best.c.position)
+        return qu.all()
 
     @classmethod
     def search_by_library_name(cls, _db, name, here=None, production=True):
@@ -1022,13 +1115,38 @@ class Library(Base):
         :param production: If True, only libraries that are ready for
             production are shown.
         """
+        partial_matches = cls.partial_match(Library.name, name)
+        if cls.NAME_INDEX_SEARCH:
+            library_ids = cls.name_index(_db).matches(name)
+            return cls.create_query(
+                _db, here, production, Library.id.in_(library_ids), partial_matches
+            )
         name_matches = cls.fuzzy_match(Library.name, name)
         alias_matches = cls.fuzzy_match(LibraryAlias.name, name)
-        partial_matches = cls.partial_match(Library.name, name)
         return cls.create_query(
             _db, here, production, name_matches, alias_matches, partial_matches
         )
 
+    # The NameIndex of library names and aliases for this process,
+    # and the SearchCache generation it was built for.
+    _name_index = None
+    _name_index_generation = None
+
+    @classmethod
+    def name_index(cls, _db):
+        """Find the NameIndex of every library's name and aliases,
+        building it if the libraries have changed.
+        """
+        generation = SearchCache.generation(_db)
+        index = cls._name_index
+        if index is None or cls._name_index_generation != generation:
+            names = _db.query(Library.id, Library.name).all()
+            names += _db.query(LibraryAlias.library_id, LibraryAlias.name).all()
+            index = NameIndex(names)
+            cls._name_index = index
+            cls._name_index_generation = generation
+        return index
+
     @classmethod
     def search_by_location_name(cls, _db, query, type=None, here=None, production=True):
         """Find libraries whose service area overlaps a place with
@@ -1040,44 +1158,169 @@ class Library(Base):
         :param production: If True, only libraries that are ready for
             production are shown.
         """
+        if type == Place.POSTAL_CODE and cls.as_postal_code(query):
+            # We already know which libraries serve each postal code.
+            return cls.search_by_postal_code(_db, query, here, production)
+
         # For a library to match, the Place named by the query must
-        # intersect a Place served by that library.
+        # intersect a Place served by that library. We know ahead of
+        # time which places those are.
         named_place = aliased(Place)
         qu = (
             _db.query(Library)
-            .join(Library.service_areas)
-            .join(ServiceArea.place)
-            .join(named_place, func.ST_Intersects(Place.geometry, named_place.geometry))
-            .outerjoin(named_place.aliases)
+            .join(PlaceLibraryOverlap, Library.id == PlaceLibraryOverlap.library_id)
+            .join(named_place, PlaceLibraryOverlap.place_id == named_place.id)
         )
         qu = qu.filter(cls._feed_restriction(production))
-        name_match = cls.fuzzy_match(named_place.external_name, query)
-        alias_match = cls.fuzzy_match(PlaceAlias.name, query)
-        qu = qu.filter(or_(name_match, alias_match))
+        if cls.NAME_INDEX_SEARCH:
+            place_ids = Gazetteer.current(_db).name_index.matches(query)
+            qu = qu.filter(named_place.id.in_(place_ids))
+        else:
+            qu = qu.outerjoin(named_place.aliases)
+            name_match = cls.fuzzy_match(named_place.external_name, query)
+            alias_match = cls.fuzzy_match(PlaceAlias.name, query)
+            qu = qu.filter(or_(name_match, alias_match))
         if type:
             qu = qu.filter(named_place.type == type)
         if here:
-            min_distance = func.min(func.ST_DistanceSphere(here, named_place.geometry))
+            named_piece = aliased(PlaceSubdivision)
+            qu = qu.join(named_piece, named_piece.place_id == named_place.id)
+            min_distance = func.min(
+                func.ST_DistanceSphere(here, named_piece.geometry)
+            ).label("distance")
+            qu = qu.add_columns(min_distance)
+            qu = qu.group_by(Library.id)
+            qu = qu.order_by(min_distance.asc())
+        return qu
+
+    @classmethod
+    def search_by_postal_code(cls, _db, postal_code, here=None, production=True):
+        """Find libraries whose service area overlaps the postal code
+        with the given name.
+
+        This gives the same results as calling search_by_location_name
+        with type=Place.POSTAL_CODE, but it looks the answer up in
+        PostalCodeLibrary instead of comparing geometries.
+
+        :param postal_code: Name of the postal code to search for.
+        :param here: Order results by proximity to this location.
+        :param production: If True, only libraries that are ready for
+            production are shown.
+        """
+        named_place = aliased(Place)
+        qu = (
+            _db.query(Library)
+            .join(PostalCodeLibrary, Library.id == PostalCodeLibrary.library_id)
+            .join(named_place, PostalCodeLibrary.place_id == named_place.id)
+            .outerjoin(named_place.aliases)
+        )
+        qu = qu.filter(PostalCodeLibrary.serves == True)
+        qu = qu.filter(cls._feed_restriction(production))
+        qu = qu.filter(
+            or_(
+                named_place.external_name == postal_code,
+                PlaceAlias.name == postal_code,
+            )
+        )
+        if here:
+            named_piece = aliased(PlaceSubdivision)
+            qu = qu.join(named_piece, named_piece.place_id == named_place.id)
+            min_distance = func.min(
+                func.ST_DistanceSphere(here, named_piece.geometry)
+            ).label("distance")
             qu = qu.add_columns(min_distance)
             qu = qu.group_by(Library.id)
             qu = qu.order_by(min_distance.asc())
         return qu
 
+    @classmethod
+    def near_postal_code(cls, _db, postal_code, max_radius=150, production=True):
+        """Find libraries that serve, or are close to, a postal code.
+
+        :param postal_code: A Place representing a postal code.
+        :param max_radius: How far out from the postal code to search
+            for a library's service area, in kilometers. Libraries
+            further away than PostalCodeLibrary.NEARBY_RADIUS are never
+            found.
+        :param production: If True, only libraries that are ready for
+            production are shown.
+
+        :return: A database query that returns lists of 2-tuples
+        (library, distance from the postal code), starting with the
+        libraries that serve the postal code. Distances are measured
+        in meters.
+        """
+        qu = _db.query(Library).join(
+            PostalCodeLibrary, Library.id == PostalCodeLibrary.library_id
+        )
+        qu = qu.filter(PostalCodeLibrary.place_id == postal_code.id)
+        qu = qu.filter(PostalCodeLibrary.distance <= max_radius * 1000)
+        qu = qu.filter(cls._feed_restriction(production))
+        qu = qu.add_columns(PostalCodeLibrary.distance)
+        qu = qu.order_by(
+            PostalCodeLibrary.serves.desc(),
+            PostalCodeLibrary.distance.asc(),
+            Library.id,
+        )
+        return qu
+
+    # If this is set, name searches use the pg_trgm indexes on
+    # lower(name) to find candidates before checking the Levenshtein
+    # distance.
+    TRIGRAM_SEARCH = True
+
+    # If this is set, search_by_library_name() and
+    # search_by_location_name() find matching names with an in-memory
+    # NameIndex instead of asking the database to compare every name.
+    NAME_INDEX_SEARCH = True
+
+    # Names at least this long match a value within this Levenshtein
+    # distance. Shorter names must match exactly.
+    FUZZY_MATCH_MIN_LENGTH = 6
+    FUZZY_MATCH_MAX_DISTANCE = 2
+
+    # pg_trgm pads a word of n letters into n + 1 trigrams, and each
+    # edit changes at most three of them. So two words of six or more
+    # letters that are within Levenshtein distance 2 share at least
+    # n - 5 trigrams out of at most n + 7, and the worst case, two
+    # substitutions in a six-letter word ("denver" and "dinvar"), has
+    # a similarity of 1/13. The threshold is set just below that, so
+    # that for names made of ordinary words the trigram filter never
+    # rejects a match the Levenshtein rule would accept.
+    #
+    # Even this low, the filter is worth having. Against the 13,730
+    # distinct US city and state names in the GeoLite2 database, 300
+    # names with two random edits each let an average of 3.5% of the
+    # names through the filter, and none of the names within
+    # Levenshtein distance 2 were left out.
+    TRIGRAM_SIMILARITY_THRESHOLD = 0.07
+
     us_zip = re.compile("^[0-9]{5}$")
     us_zip_plus_4 = re.compile("^[0-9]{5}-[0-9]{4}$")
     running_whitespace = re.compile(r"\s+")
 
     @classmethod
-    def create_query(cls, _db, here=None, production=True, *args):
+    def create_query(cls, _db, here=None, production=True, *args, rank=None):
+        """Find libraries that match any of the given clauses.
+
+        :param rank: Order libraries by this value, highest first,
+            before ordering them by distance from `here`.
+        """
         qu = _db.query(Library).outerjoin(Library.aliases)
         if here:
-            qu = qu.outerjoin(Library.service_areas).outerjoin(ServiceArea.place)
+            qu = qu.outerjoin(Library.service_areas).outerjoin(
+                PlaceSubdivision, ServiceArea.place_id == PlaceSubdivision.place_id
+            )
         qu = qu.filter(or_(*args))
         qu = qu.filter(cls._feed_restriction(production))
+        if rank is not None:
+            qu = qu.order_by(rank.desc())
         if here:
             # Order by the minimum distance between one of the
             # library's service areas and the current location.
-            min_distance = func.min(func.ST_DistanceSphere(here, Place.geometry))
+            min_distance = func.min(
+                func.ST_DistanceSphere(here, PlaceSubdivision.geometry)
+            ).label("distance")
             qu = qu.add_columns(min_distance)
             qu = qu.group_by(Library.id)
             qu = qu.order_by(min_distance.asc())
@@ -1087,16 +1330,76 @@ class Library(Base):
     def search_within_description(cls, _db, query, here=None, production=True):
         """Find libraries whose descriptions include the search term.
 
+        A description matches if it contains the search term, or is
+        within a small Levenshtein distance of it. The matches are
+        ordered by how well Library.search_document, which also covers
+        names and aliases, matches the search term.
+
         :param query: The string to search for.
-        :param here: Order results by proximity to this location.
+        :param here: Order equally good matches by proximity to this
+            location.
         :param production: If True, only libraries that are ready for
             production are shown.
         """
         description_matches = cls.fuzzy_match(Library.description, query)
         partial_matches = cls.partial_match(Library.description, query)
+        tsquery = func.plainto_tsquery(cls.SEARCH_CONFIGURATION, query)
+        rank = func.ts_rank(Library.search_document, tsquery)
         return cls.create_query(
-            _db, here, production, description_matches, partial_matches
+            _db, here, production, description_matches, partial_matches, rank=rank
+        )
+
+    # The text search configuration used to build search documents
+    # and parse queries against them.
+    SEARCH_CONFIGURATION = "english"
+
+    @classmethod
+    def refresh_search_documents(cls, _db, library_ids=None):
+        """Bring Library.search_document up to date.
+
+        The name counts for the most, then the aliases, then the
+        description.
+
+        :param library_ids: Only update these libraries. By default,
+            every library is updated.
+        """
+        _db.flush()
+
+        def weighted(value, weight):
+            return func.setweight(
+                func.to_tsvector(cls.SEARCH_CONFIGURATION, func.coalesce(value, "")),
+                weight,
+            )
+
+        aliases = (
+            select([func.string_agg(LibraryAlias.name, " ")])
+            .where(LibraryAlias.library_id == Library.id)
+            .scalar_subquery()
         )
+        document = (
+            weighted(Library.name, "A")
+            .op("||")(weighted(aliases, "B"))
+            .op("||")(weighted(Library.description, "C"))
+        )
+        # This isn't a change to the library itself, so leave its
+        # timestamp alone.
+        qu = Library.__table__.update().values(
+            search_document=document, timestamp=Library.timestamp
+        )
+        if library_ids is not None:
+            library_ids = [x for x in library_ids if x is not None]
+            qu = qu.where(Library.id.in_(library_ids))
+        _db.execute(qu)
+
+    def update_search_document(self):
+        """Bring this library's search document up to date with its
+        name, aliases and description.
+        """
+        _db = Session.object_session(self)
+        _db.flush()
+        self.refresh_search_documents(_db, [self.id])
+        _db.expire(self, ["search_document"])
+        SearchCache.libraries_changed(_db)
 
     @classmethod
     def query_cleanup(cls, query):
@@ -1162,19 +1465,54 @@ class Library(Base):
         an exact (case-insensitive) match. Otherwise, we require a
         Levenshtein distance of less than two between the field value and
         the provided value.
+
+        If TRIGRAM_SEARCH is set, candidates are first narrowed down
+        with pg_trgm, which can use the trigram index on a name field.
         """
-        is_long = func.length(field) >= 6
-        close_enough = func.levenshtein(func.lower(field), value) <= 2
+        normalized = func.lower(field)
+        value = value.lower()
+        is_long = func.length(field) >= cls.FUZZY_MATCH_MIN_LENGTH
+        close_enough = (
+            func.levenshtein(normalized, value) <= cls.FUZZY_MATCH_MAX_DISTANCE
+        )
+        if cls.TRIGRAM_SEARCH:
+            close_enough = and_(normalized.op("%")(value), close_enough)
+            exact_match = normalized.ilike(value)
+        else:
+            exact_match = field.ilike(value)
         long_value_is_approximate_match = is_long & close_enough
-        exact_match = field.ilike(value)
         return or_(long_value_is_approximate_match, exact_match)
 
     @classmethod
     def partial_match(cls, field, value):
         """Create a SQL clause that attempts to match a partial value--e.g.
         just one word of a library's name--against the given field."""
+        if cls.TRIGRAM_SEARCH:
+            field = func.lower(field)
         return field.ilike(f"%{value}%")
 
+    def service_areas_changed(self, place_ids=()):
+        """Bring everything derived from this library's service areas
+        (and the stage that decides which feeds they show up in) up to
+        date.
+
+        :param place_ids: IDs of Places this library used to serve. These
+            are checked in addition to the Places it serves now.
+        """
+        _db = Session.object_session(self)
+        _db.flush()
+        old_place_ids = set(place_ids)
+        place_ids = {x.place_id for x in self.service_areas}
+        ServedPlace.refresh(_db, old_place_ids | place_ids)
+
+        # Only postal codes near a place the library started or
+        # stopped serving can be affected.
+        PostalCodeLibrary.refresh(
+            _db, library_ids=[self.id], served_place_ids=old_place_ids ^ place_ids
+        )
+        PlaceLibraryOverlap.refresh(_db, library_ids=[self.id])
+        SearchCache.libraries_changed(_db)
+
     def set_hyperlink(self, rel, *hrefs):
         """Make sure this library has a Hyperlink with the given `rel` that
         points to a Resource with one of the given `href`s.
@@ -1274,6 +1612,10 @@ class Place(Base):
     LIBRARY_SERVICE_AREA = "library_service_area"
     EVERYWHERE = "everywhere"
 
+    # The postal codes of US cities, which can stand in for cities
+    # that aren't in the database.
+    CITY_POSTAL_CODES = CityPostalCodes(f"{Configuration.DATADIR}/simple_db.sqlite")
+
     id = Column(Integer, primary_key=True)
 
     # The type of place.
@@ -1306,10 +1648,46 @@ class Place(Base):
     # calculations.
     geometry = Column(Geometry(srid=4326), nullable=True)
 
+    # A hash of the data source's record for this place, geometry
+    # included. If a record hasn't changed since the last time it was
+    # loaded, there's no need to rewrite the place.
+    content_hash = Column(Unicode)
+
     aliases = relationship("PlaceAlias", backref="place")
 
     service_areas = relationship("ServiceArea", backref="place")
 
+    @classmethod
+    def update_derived_tables(cls, _db, place_ids=None):
+        """Bring everything derived from the geometry of some Places up
+        to date. Call this whenever a Place's geometry changes.
+
+        :param place_ids: IDs of the Places that have changed. By
+            default, everything derived from every Place is rebuilt.
+        """
+        Gazetteer.invalidate()
+        PlaceSubdivision.refresh(_db, place_ids)
+        PlaceGeoJSON.refresh(_db, place_ids)
+        ServedPlace.refresh(_db, place_ids)
+        if place_ids is None:
+            PostalCodeLibrary.refresh(_db)
+            PlaceLibraryOverlap.refresh(_db)
+            return
+
+        # The relationships between these places and libraries may
+        # have changed. If one of them is part of a library's service
+        # area, that library's relationships with every place may
+        # have changed.
+        PostalCodeLibrary.refresh(_db, postal_code_ids=place_ids)
+        PlaceLibraryOverlap.refresh(_db, place_ids=place_ids)
+        library_ids = select([ServiceArea.library_id]).where(
+            ServiceArea.place_id.in_(place_ids)
+        )
+        library_ids = {x for [x] in _db.execute(library_ids)}
+        if library_ids:
+            PostalCodeLibrary.refresh(_db, library_ids=library_ids)
+            PlaceLibraryOverlap.refresh(_db, library_ids=library_ids)
+
     @classmethod
     def everywhere(cls, _db):
         """Return a special Place that represents everywhere.
@@ -1317,6 +1695,9 @@ class Place(Base):
         This place has no .geometry, so attempts to use it in
         geographic comparisons will fail.
         """
+        place = Gazetteer.place(_db, Gazetteer.current(_db).everywhere)
+        if place:
+            return place
         place, is_new = get_one_or_create(
             _db,
             Place,
@@ -1325,6 +1706,7 @@ class Place(Base):
                 external_id="Everywhere", external_name="Everywhere"
             ),
         )
+        Gazetteer.invalidate()
         return place
 
     @classmethod
@@ -1336,17 +1718,7 @@ class Place(Base):
 
         :return: The default nation, if one can be found. Otherwise, None.
         """
-        default_nation = None
-        abbreviation = ConfigurationSetting.sitewide(
-            _db, Configuration.DEFAULT_NATION_ABBREVIATION
-        ).value
-        if abbreviation:
-            default_nation = get_one(
-                _db, Place, type=Place.NATION, abbreviated_name=abbreviation
-            )
-            if not default_nation:
-                logging.error("Could not look up default nation %s", abbreviation)
-        return default_nation
+        return Gazetteer.place(_db, Gazetteer.current(_db).default_nation)
 
     @classmethod
     def larger_place_types(cls, type):
@@ -1391,59 +1763,62 @@ class Place(Base):
 
     @classmethod
     def lookup_by_name(cls, _db, name, place_type=None):
-        """Look up one or more Places by name."""
-        if not place_type:
-            name, place_type = cls.parse_name(name)
-        qu = (
-            _db.query(Place)
-            .outerjoin(PlaceAlias)
-            .filter(
-                or_(
-                    Place.external_name == name,
-                    Place.abbreviated_name == name,
-                    PlaceAlias.name == name,
-                )
-            )
-        )
-        if place_type:
-            qu = qu.filter(Place.type == place_type)
-        else:
-            # The place type "county" is excluded unless it was
-            # explicitly asked for (e.g. "Cook County"). This is to
-            # avoid ambiguity in the many cases when a state contains
-            # a county and a city with the same name. In all realistic
-            # cases, someone using "Foo" to talk about a library
-            # service area is referring to the city of Foo, not Foo
-            # County -- if they want Foo County they can say "Foo
-            # County".
-            qu = qu.filter(Place.type != Place.COUNTY)
-        return qu
+        """Look up one or more Places by name.
+
+        The names are matched by the Gazetteer; the query only needs
+        to find Places by ID.
+        """
+        entries = Gazetteer.current(_db).named(name, place_type)
+        return _db.query(Place).filter(Place.id.in_([x.id for x in entries]))
 
     @classmethod
     def lookup_one_by_name(cls, _db, name, place_type=None):
-        return cls.lookup_by_name(_db, name, place_type).one()
+        entry = Gazetteer.current(_db).lookup_one_by_name(name, place_type)
+        place = Gazetteer.place(_db, entry)
+        if not place:
+            raise NoResultFound("No place called %s." % name)
+        return place
 
     @classmethod
-    def to_geojson(cls, _db, *places):
+    def to_geojson(cls, _db, *places, resolution=None):
         """Convert one or more Place objects to a dictionary that will become
         a GeoJSON document when converted to JSON.
+
+        :param resolution: One of the keys of PlaceGeoJSON.RESOLUTIONS.
+            By default, geometries are represented at full resolution.
         """
-        geojson = select([func.ST_AsGeoJSON(Place.geometry)]).where(
-            Place.id.in_([x.id for x in places])
-        )
-        results = [x[0] for x in _db.execute(geojson)]
-        if len(results) == 1:
+        document, etag = cls.geojson_document(_db, places, resolution)
+        return json.loads(document)
+
+    @classmethod
+    def geojson_document(cls, _db, places, resolution=None):
+        """Build a GeoJSON document representing one or more Place objects
+        out of precomputed GeoJSON fragments.
+
+        :param resolution: One of the keys of PlaceGeoJSON.RESOLUTIONS.
+            By default, geometries are represented at full resolution.
+
+        :return: A 2-tuple (document, etag). `document` is a string;
+            `etag` changes whenever the document does.
+        """
+        resolution = resolution or PlaceGeoJSON.FULL
+        fragments = PlaceGeoJSON.fragments(_db, places, resolution)
+        if len(fragments) == 1:
             # There's only one item, and it is a valid
             # GeoJSON document on its own.
-            return json.loads(results[0])
-
-        # We have either more or less than one valid item.
-        # In either case, a GeometryCollection is appropriate.
-        body = {
-            "type": "GeometryCollection",
-            "geometries": [json.loads(x) for x in results],
-        }
-        return body
+            [(document, digest)] = fragments
+        else:
+            # We have either more or less than one valid item.
+            # In either case, a GeometryCollection is appropriate.
+            document = '{"type": "GeometryCollection", "geometries": [%s]}' % (
+                ", ".join(geojson for geojson, digest in fragments)
+            )
+        etag = hashlib.md5(
+            " ".join([resolution] + [digest for geojson, digest in fragments]).encode(
+                "utf8"
+            )
+        ).hexdigest()
+        return document, etag
 
     @classmethod
     def name_parts(cls, name):
@@ -1522,9 +1897,9 @@ class Place(Base):
         share a border. This method creates a more real-world notion
         of 'inside' that does not count a shared border.
         """
-        intersects = Place.geometry.intersects(self.geometry)
-        touches = func.ST_Touches(Place.geometry, self.geometry)
-        return qu.filter(intersects).filter(touches == False)
+        return qu.filter(
+            PlaceSubdivision.intersects(Place.id, self.id, not_counting_border=True)
+        )
 
     def lookup_inside(self, name, using_overlap=False, using_external_source=True):
 
@@ -1555,6 +1930,18 @@ class Place(Base):
         given name is 'inside' this Place.
 
         """
+        if not using_overlap or self.geometry is None:
+            # We're checking parentage, or this Place has no shape to
+            # check for overlap (e.g. it's 'everywhere', inside which
+            # the concept of 'inside' is not relevant). Either way,
+            # the Gazetteer has everything we need to know. It follows
+            # the same rules as the rest of this method.
+            _db = Session.object_session(self)
+            entry = Gazetteer.current(_db).lookup_inside(
+                self, name, using_external_source
+            )
+            return Gazetteer.place(_db, entry)
+
         parts = Place.name_parts(name)
         if len(parts) > 1:
             # We're trying to look up a scoped name such as "Boston,
@@ -1590,29 +1977,7 @@ class Place(Base):
         # place.
         exclude_types = Place.larger_place_types(self.type)
         qu = qu.filter(~Place.type.in_(exclude_types))
-
-        if self.type == self.EVERYWHERE:
-            # The concept of 'inside' is not relevant because every
-            # place is 'inside' EVERYWHERE. We are really trying to
-            # find one and only one place with a certain name.
-            pass
-        else:
-            if using_overlap and self.geometry is not None:
-                qu = self.overlaps_not_counting_border(qu)
-            else:
-                parent = aliased(Place)
-                grandparent = aliased(Place)
-                qu = qu.join(parent, Place.parent_id == parent.id)
-                qu = qu.outerjoin(grandparent, parent.parent_id == grandparent.id)
-
-                # For postal codes, but no other types of places, we
-                # allow the lookup to skip a level. This lets you look
-                # up "93203" within a state *or* within the nation.
-                postal_code_grandparent_match = and_(
-                    Place.type == Place.POSTAL_CODE,
-                    grandparent.id == self.id,
-                )
-                qu = qu.filter(or_(Place.parent == self, postal_code_grandparent_match))
+        qu = self.overlaps_not_counting_border(qu)
 
         places = qu.all()
         if len(places) == 0:
@@ -1648,31 +2013,37 @@ class Place(Base):
             # uszipcodes keeps track of places in terms of their state.
             return None
 
-        search = uszipcode.SearchEngine(
-            db_file_path=f"{Configuration.DATADIR}/simple_db.sqlite"
-        )
-        state = self.abbreviated_name
-        uszipcode_matches = []
-        if (
-            state in search.state_to_city_mapper
-            and name in search.state_to_city_mapper[state]
-        ):
-            # The given name is an exact match for one of the
-            # cities. Let's look up every ZIP code for that city.
-            # `returns=None` here means to not limit the number of results.
-            uszipcode_matches = search.by_city_and_state(name, state, returns=None)
-
         # Look up a Place object for each ZIP code and return the
         # first one we actually know about.
         #
         # Set using_external_source to False to eliminate the
         # possibility of wasted effort or (I don't think this can
         # happen) infinite recursion.
-        for match in uszipcode_matches:
-            place = self.lookup_inside(match.zipcode, using_external_source=False)
+        for zipcode in Place.postal_codes_for_city(self.abbreviated_name, name):
+            place = self.lookup_inside(zipcode, using_external_source=False)
             if place:
                 return place
 
+    @classmethod
+    def postal_codes_for_city(cls, state, name):
+        """Ask uszipcodes for the postal codes of a city.
+
+        :param state: The abbreviated name of a US state.
+        :param name: The name of a city in that state.
+        :return: A list of postal codes, possibly empty.
+        """
+        return cls.CITY_POSTAL_CODES.postal_codes(state, name)
+
+    @classmethod
+    def resolver(cls, _db, coverage):
+        """Create a PlaceResolver that can quickly look up the places
+        mentioned in `coverage`.
+
+        :param coverage: A dictionary mapping nation names to lists of
+            place names.
+        """
+        return PlaceResolver(_db, coverage)
+
     def served_by(self):
         """Find all Libraries with a ServiceArea whose Place overlaps
         this Place, not counting the border.
@@ -1683,8 +2054,11 @@ class Place(Base):
         state.
         """
         _db = Session.object_session(self)
-        qu = _db.query(Library).join(Library.service_areas).join(ServiceArea.place)
-        qu = self.overlaps_not_counting_border(qu)
+        qu = _db.query(Library).join(
+            PlaceLibraryOverlap, Library.id == PlaceLibraryOverlap.library_id
+        )
+        qu = qu.filter(PlaceLibraryOverlap.place_id == self.id)
+        qu = qu.filter(PlaceLibraryOverlap.overlap_type == PlaceLibraryOverlap.INTERIOR)
         return qu
 
     def __repr__(self):
@@ -1706,105 +2080,1725 @@ class Place(Base):
         return str(output)
 
 
-class PlaceAlias(Base):
-
-    """An alternate name for a place."""
+GazetteerEntry = namedtuple(
+    "GazetteerEntry", "id type external_name abbreviated_name parent_id"
+)
 
-    __tablename__ = "placealiases"
 
-    id = Column(Integer, primary_key=True)
-    place_id = Column(Integer, ForeignKey("places.id"), index=True)
-    name = Column(Unicode, index=True)
-    language = Column(Unicode(3), index=True)
+class NameIndex:
+    """An in-memory version of Library.fuzzy_match(), for a set of
+    names.
 
-    __table_args__ = (UniqueConstraint("place_id", "name", "language"),)
+    A name matches a value if they're the same apart from case, or if
+    the name is long enough and within a small Levenshtein distance of
+    the value. Finding those names takes microseconds, instead of a
+    scan of every name in the database.
+    """
 
+    def __init__(self, names):
+        """Constructor.
 
-class Audience(Base):
-    """A class of person served by a library."""
+        :param names: A list of (id, name) 2-tuples. The same id can
+            have several names.
+        """
+        self.exact = defaultdict(set)
+        self.approximate = DeletionIndex(Library.FUZZY_MATCH_MAX_DISTANCE)
+        for id, name in names:
+            if not name:
+                continue
+            normalized = name.lower()
+            self.exact[normalized].add(id)
+            if len(name) >= Library.FUZZY_MATCH_MIN_LENGTH:
+                self.approximate.add(normalized, id)
 
-    __tablename__ = "audiences"
+    def matches(self, value):
+        """Find the IDs with a name that matches `value`.
 
-    # The general public
-    PUBLIC = "public"
+        :return: A set of IDs.
+        """
+        value = value.lower()
+        ids = set(self.exact.get(value, ()))
+        ids.update(self.approximate.search(value))
+        return ids
+
+
+class Gazetteer:
+    """An in-memory index of the names, types and parentage of every
+    Place.
+
+    Place.lookup_by_name(), Place.lookup_inside(), Place.everywhere()
+    and Place.default_nation() consult the Gazetteer for this process
+    instead of querying the database every time. Names are matched
+    against Place.external_name, Place.abbreviated_name and
+    PlaceAlias.name exactly as the SQL versions of those lookups did.
+
+    The Gazetteer is rebuilt from scratch after Places change. Changes
+    made in this process take effect immediately; changes made by
+    other processes (e.g. LoadPlacesScript) are noticed within
+    CHECK_INTERVAL seconds.
+    """
 
-    # Pre-university students
-    EDUCATIONAL_PRIMARY = "educational-primary"
+    # How often, in seconds, to check whether another process has
+    # changed the Places.
+    CHECK_INTERVAL = 60
 
-    # University students
-    EDUCATIONAL_SECONDARY = "educational-secondary"
+    # The sitewide ConfigurationSettings that invalidate the Gazetteer
+    # when they change.
+    STAMP_KEYS = [
+        Configuration.PLACES_LAST_UPDATE,
+        Configuration.DEFAULT_NATION_ABBREVIATION,
+    ]
 
-    # Academics and researchers
-    RESEARCH = "research"
+    # The Gazetteer for this process, and the last time it was
+    # checked for staleness.
+    _current = None
+    _checked = None
+    _lock = Lock()
 
-    # People with print disabilities
-    PRINT_DISABILITY = "print-disability"
+    # Every Gazetteer built by this process gets a different number.
+    # Anything cached on the basis of one Gazetteer can note its
+    # generation, and be thrown out when a new Gazetteer replaces it.
+    _generations = itertools.count()
 
-    # A catch-all for other specialized audiences.
-    OTHER = "other"
+    def __init__(self, places, aliases, settings):
+        """Constructor.
 
-    KNOWN_AUDIENCES = [
-        PUBLIC,
-        EDUCATIONAL_PRIMARY,
-        EDUCATIONAL_SECONDARY,
-        RESEARCH,
-        PRINT_DISABILITY,
-        OTHER,
-    ]
+        :param places: A list of GazetteerEntry objects, one for each Place.
+        :param aliases: A list of (place_id, name) 2-tuples.
+        :param settings: A dictionary containing the values of the
+            ConfigurationSettings named in STAMP_KEYS.
+        """
+        self.settings = settings
+        self.generation = next(self._generations)
+        self._name_index = None
+        self._names = [(entry.id, entry.external_name) for entry in places]
+        self.entries = {}
+        self.ids_by_name = defaultdict(list)
+        self.everywhere = None
+        self.nations = defaultdict(list)
+        for entry in places:
+            self.entries[entry.id] = entry
+            names = {entry.external_name, entry.abbreviated_name}
+            for name in names:
+                if name:
+                    self.ids_by_name[name].append(entry.id)
+            if entry.type == Place.EVERYWHERE:
+                self.everywhere = entry
+            elif entry.type == Place.NATION and entry.abbreviated_name:
+                self.nations[entry.abbreviated_name].append(entry)
+        for place_id, name in aliases:
+            if name and place_id in self.entries:
+                self._names.append((place_id, name))
+                ids = self.ids_by_name[name]
+                if place_id not in ids:
+                    ids.append(place_id)
 
-    id = Column(Integer, primary_key=True)
-    name = Column(Unicode, index=True, unique=True)
+    @property
+    def name_index(self):
+        """A NameIndex of every Place's external name and aliases.
 
-    libraries = relationship(
-        "Library", secondary="libraries_audiences", back_populates="audiences"
-    )
+        This takes a while to build, so it's only built the first time
+        it's needed.
+        """
+        if self._name_index is None:
+            self._name_index = NameIndex(self._names)
+        return self._name_index
 
     @classmethod
-    def lookup(cls, _db, name):
-        if name not in cls.KNOWN_AUDIENCES:
-            raise ValueError(_("Unknown audience: %(name)s", name=name))
-        audience, is_new = get_one_or_create(_db, Audience, name=name)
-        return audience
-
+    def load(cls, _db):
+        """Build a Gazetteer from the database."""
+        places = [
+            GazetteerEntry(*row)
+            for row in _db.query(
+                Place.id,
+                Place.type,
+                Place.external_name,
+                Place.abbreviated_name,
+                Place.parent_id,
+            )
+        ]
+        aliases = _db.query(PlaceAlias.place_id, PlaceAlias.name).all()
+        return cls(places, aliases, cls.stamp(_db))
 
-class CollectionSummary(Base):
-    """A summary of a collection held by a library.
+    @classmethod
+    def stamp(cls, _db):
+        """Look up the settings that invalidate a Gazetteer."""
+        qu = _db.query(ConfigurationSetting.key, ConfigurationSetting._value).filter(
+            ConfigurationSetting.key.in_(cls.STAMP_KEYS),
+            ConfigurationSetting.library_id == None,
+            ConfigurationSetting.external_integration_id == None,
+        )
+        settings = dict.fromkeys(cls.STAMP_KEYS)
+        settings.update(qu)
+        return settings
 
-    We only need to know the language of the collection and
-    approximately how big it is.
-    """
+    @classmethod
+    def current(cls, _db):
+        """Find the Gazetteer for this process, building it if necessary."""
+        gazetteer = cls._current
+        now = time.monotonic()
+        if gazetteer is not None and now - cls._checked < cls.CHECK_INTERVAL:
+            return gazetteer
+        with cls._lock:
+            gazetteer = cls._current
+            if gazetteer is None or gazetteer.settings != cls.stamp(_db):
+                gazetteer = cls.load(_db)
+            cls._current = gazetteer
+            cls._checked = now
+        return gazetteer
 
-    __tablename__ = "collectionsummaries"
+    @classmethod
+    def invalidate(cls):
+        """Make sure the next lookup rebuilds the Gazetteer for this
+        process.
+        """
+        cls._current = None
 
-    id = Column(Integer, primary_key=True)
-    library_id = Column(Integer, ForeignKey("libraries.id"), index=True)
-    language = Column(Unicode)
-    size = Column(Integer)
+    @classmethod
+    def places_changed(cls, _db):
+        """Let every process know that its Gazetteer is out of date."""
+        setting = ConfigurationSetting.sitewide(_db, Configuration.PLACES_LAST_UPDATE)
+        setting.value = datetime.datetime.utcnow().isoformat()
+        cls.invalidate()
 
     @classmethod
-    def set(cls, library, language, size):
-        """Create or update a CollectionSummary for the given
-        library and language.
+    def place(cls, _db, entry):
+        """Find the Place for a GazetteerEntry, ideally without going to
+        the database.
 
-        :return: An up-to-date CollectionSummary.
+        :return: A Place, or None if `entry` is None or the Place is gone.
         """
-        _db = Session.object_session(library)
+        if entry is None:
+            return None
+        place = _db.get(Place, entry.id, options=[lazyload(Place.children)])
+        if place is None:
+            # This Gazetteer is out of date.
+            cls.invalidate()
+        return place
 
-        size = int(size)
-        if size < 0:
-            raise ValueError(_("Collection size cannot be negative."))
+    @property
+    def default_nation(self):
+        """Find the default nation for this library registry.
 
-        # This might return None, which is fine. We'll store it as a
-        # collection with an unknown language. This also covers the
-        # case where the library specifies its collection size but
-        # doesn't mention any languages.
-        language_code = LanguageCodes.string_to_alpha_3(language)
+        :return: A GazetteerEntry, or None.
+        """
+        abbreviation = self.settings.get(Configuration.DEFAULT_NATION_ABBREVIATION)
+        if not abbreviation:
+            return None
+        nations = self.nations.get(abbreviation, [])
+        if len(nations) > 1:
+            raise MultipleResultsFound(
+                "More than one nation abbreviated %s." % abbreviation
+            )
+        if not nations:
+            logging.error("Could not look up default nation %s", abbreviation)
+            return None
+        return nations[0]
 
-        summary, is_new = get_one_or_create(
-            _db, CollectionSummary, library=library, language=language_code
-        )
-        summary.size = size
-        return summary
+    def named(self, name, place_type=None):
+        """Find the places with a given name, following the rules of
+        Place.lookup_by_name().
+
+        :return: A list of GazetteerEntry objects.
+        """
+        if not place_type:
+            name, place_type = Place.parse_name(name)
+        entries = [self.entries[x] for x in self.ids_by_name.get(name, ())]
+        if place_type:
+            return [x for x in entries if x.type == place_type]
+        # Counties are excluded unless explicitly asked for.
+        return [x for x in entries if x.type != Place.COUNTY]
+
+    def lookup_one_by_name(self, name, place_type=None):
+        """Find exactly one place with the given name.
+
+        :return: A GazetteerEntry.
+        :raise NoResultFound: If there is no such place.
+        :raise MultipleResultsFound: If there's more than one.
+        """
+        entries = self.named(name, place_type)
+        if not entries:
+            raise NoResultFound("No place called %s." % name)
+        if len(entries) > 1:
+            raise MultipleResultsFound("More than one place called %s." % name)
+        return entries[0]
+
+    def is_inside(self, entry, container):
+        """Is `entry` 'inside' `container`, in the sense used by
+        Place.lookup_inside() when `using_overlap` is false?
+        """
+        if entry.type == container.type or entry.type in Place.larger_place_types(
+            container.type
+        ):
+            return False
+        if container.type == Place.EVERYWHERE:
+            return True
+        if entry.parent_id is None:
+            return False
+        if entry.parent_id == container.id:
+            return True
+        # Postal codes may skip a level.
+        parent = self.entries.get(entry.parent_id)
+        return (
+            entry.type == Place.POSTAL_CODE
+            and parent is not None
+            and parent.parent_id == container.id
+        )
+
+    def lookup_inside(self, container, name, using_external_source=True):
+        """Look up a named place that is 'inside' another place, following
+        the rules of Place.lookup_inside() when `using_overlap` is false.
+
+        :param container: A Place or GazetteerEntry.
+        :return: A GazetteerEntry, or None if no match could be found.
+        :raise MultipleResultsFound: If more than one place with the
+            given name is 'inside' `container`.
+        """
+        parts = Place.name_parts(name)
+        if len(parts) > 1:
+            look_in_here = container
+            for part in parts:
+                look_in_here = self.lookup_inside(look_in_here, part)
+                if not look_in_here:
+                    return None
+            return look_in_here
+
+        entries = [x for x in self.named(name) if self.is_inside(x, container)]
+        if len(entries) > 1:
+            raise MultipleResultsFound(
+                "More than one place called {} inside {}.".format(
+                    name, container.external_name
+                )
+            )
+        if entries:
+            return entries[0]
+        if not using_external_source or container.type != Place.STATE:
+            return None
+
+        # We may be able to find a representative postal code.
+        for postal_code in Place.postal_codes_for_city(
+            container.abbreviated_name, name
+        ):
+            entry = self.lookup_inside(
+                container, postal_code, using_external_source=False
+            )
+            if entry:
+                return entry
+        return None
+
+
+class SearchCache:
+    """Remembers the results of Library.search() for this process.
+
+    The same searches (postal codes, city names, common library names)
+    come in over and over. Results are cached by the cleaned-up query,
+    the cell of a coarse latitude/longitude grid that contains the
+    client, and whether the search is for production libraries only.
+    Every location in a cell is treated as the center of the cell, so
+    a search gives the same results whether or not it's cached.
+
+    Only library IDs and distances are cached; the Library objects are
+    loaded fresh for each search. The cache is thrown out when a
+    library's name, aliases, description, stage or service areas
+    change, or when the Places are reloaded. Changes made in this
+    process take effect immediately; changes made by other processes
+    are noticed within CHECK_INTERVAL seconds.
+    """
+
+    CACHE_SIZE = 5000
+
+    # How often, in seconds, to check whether another process has
+    # changed the libraries.
+    CHECK_INTERVAL = 60
+
+    # The size of a grid cell, in degrees. This is about a kilometer
+    # north to south, which is finer than most IP geolocation.
+    CELL_SIZE = 0.01
+
+    point = re.compile(r"^SRID=4326;POINT\(([-0-9.e]+) ([-0-9.e]+)\)$")
+
+    cache = LRUCache(CACHE_SIZE)
+
+    # Every time the libraries change, the cache moves on to a new
+    # generation, and entries from older generations stop being
+    # found.
+    _generations = itertools.count()
+    _generation = next(_generations)
+    _stamp = None
+    _checked = None
+    _lock = Lock()
+
+    @classmethod
+    def stamp(cls, _db):
+        """Look up the setting that invalidates the cache."""
+        qu = _db.query(ConfigurationSetting._value).filter(
+            ConfigurationSetting.key == Configuration.LIBRARIES_LAST_UPDATE,
+            ConfigurationSetting.library_id == None,
+            ConfigurationSetting.external_integration_id == None,
+        )
+        return qu.scalar()
+
+    @classmethod
+    def generation(cls, _db):
+        """Find the current generation of the cache, checking whether
+        another process has changed the libraries if it's been a
+        while.
+        """
+        now = time.monotonic()
+        if cls._checked is not None and now - cls._checked < cls.CHECK_INTERVAL:
+            return cls._generation
+        with cls._lock:
+            stamp = cls.stamp(_db)
+            if cls._checked is None or stamp != cls._stamp:
+                cls._generation = next(cls._generations)
+                cls._stamp = stamp
+            cls._checked = now
+        return cls._generation
+
+    @classmethod
+    def invalidate(cls):
+        """Make sure nothing currently in the cache is used again."""
+        cls._checked = None
+
+    @classmethod
+    def libraries_changed(cls, _db):
+        """Let every process know that its cached searches are out of
+        date.
+        """
+        setting = ConfigurationSetting.sitewide(
+            _db, Configuration.LIBRARIES_LAST_UPDATE
+        )
+        setting.value = datetime.datetime.utcnow().isoformat()
+        cls.invalidate()
+
+    @classmethod
+    def cell(cls, target):
+        """Find the center of the grid cell containing a location.
+
+        :param target: A 2-tuple (latitude, longitude), or a point as
+            created by GeometryUtility.point().
+        :return: A 2-tuple (latitude, longitude), or None if `target`
+            isn't a location this class understands.
+        """
+        if isinstance(target, tuple):
+            latitude, longitude = target
+        else:
+            match = cls.point.match(str(target))
+            if not match:
+                return None
+            longitude, latitude = match.groups()
+
+        def center(degrees):
+            return round(
+                (math.floor(float(degrees) / cls.CELL_SIZE) + 0.5) * cls.CELL_SIZE, 6
+            )
+
+        return center(latitude), center(longitude)
+
+    @classmethod
+    def search(cls, _db, target, query, production=True):
+        """Find libraries that match the given query, using the cache
+        if possible.
+
+        The arguments and return value are the same as for
+        Library.search(), except that `target` is moved to the center
+        of its grid cell.
+        """
+        if not query:
+            return []
+        query = Library.query_cleanup(query)
+        if target:
+            cell = cls.cell(target)
+            if cell is not None:
+                target = cell
+            else:
+                # This location can't be put in a cell, so cache it
+                # by its exact value.
+                cell = str(target)
+        else:
+            target = cell = None
+
+        generation = (Gazetteer.current(_db).generation, cls.generation(_db))
+        key = (generation, query, cell, production)
+        results = cls.cache.get(key)
+        if results is LRUCache.MISSING:
+            results = Library.search(_db, target, query, production)
+            if target:
+                results = [(library.id, distance) for library, distance in results]
+            else:
+                results = [(library.id, None) for library in results]
+            cls.cache.set(key, results)
+
+        libraries = {
+            library.id: library
+            for library in _db.query(Library).filter(
+                Library.id.in_([library_id for library_id, ignore in results])
+            )
+        }
+        if target:
+            return [
+                (libraries[library_id], distance)
+                for library_id, distance in results
+                if library_id in libraries
+            ]
+        return [libraries[x] for x, ignore in results if x in libraries]
+
+    @classmethod
+    def stats(cls):
+        """Summarize how well the cache is working."""
+        return cls.cache.stats()
+
+
+Completion = namedtuple("Completion", "text type in_production points")
+
+
+class Completions:
+    """Completes the names of libraries and places as a user types
+    them into a search box.
+
+    Every library name, library alias, place name and place alias is
+    kept in a PrefixIndex, so finding the names that start with what
+    the user has typed takes a couple of binary searches instead of a
+    database query. Place names are shown with the abbreviation of the
+    state they're in (e.g. "Springfield, IL"), since so many places
+    share a name, and can be completed with or without it.
+
+    If the user's location is known, names are ordered by the
+    distance to the center of the place or the nearest service area of
+    the library. Otherwise they're in alphabetical order.
+
+    Places and libraries are indexed separately. The place index is
+    only rebuilt when the Gazetteer moves on to a new generation; the
+    much smaller library index is rebuilt when the SearchCache does.
+    Once the indexes have been built, they're rebuilt in a background
+    thread, and the old ones are used until that's done. Results are
+    cached by prefix and SearchCache grid cell.
+    """
+
+    # The type given to completions of library names and aliases.
+    LIBRARY = "library"
+
+    # The types of Place whose names are completed. There are too many
+    # postal codes for completion to be useful, and searching for a
+    # postal code works anyway.
+    PLACE_TYPES = [Place.NATION, Place.STATE, Place.COUNTY, Place.CITY]
+
+    # Completions aren't offered until the user has typed this many
+    # characters.
+    MIN_PREFIX_LENGTH = 2
+
+    # No more than this many names from each index, in alphabetical
+    # order, are considered for ordering by distance.
+    MAX_CANDIDATES = 1000
+
+    # The default number of completions to return.
+    LIMIT = 10
+
+    CACHE_SIZE = 5000
+    cache = LRUCache(CACHE_SIZE)
+
+    # The Completions for this process, and whether newer ones are
+    # being built.
+    _current = None
+    _rebuilding = False
+    _lock = Lock()
+
+    def __init__(self, places, libraries, generation=None):
+        """Constructor.
+
+        :param places: A PrefixIndex of Completion objects for places.
+        :param libraries: A PrefixIndex of Completion objects for
+            libraries.
+        :param generation: The Gazetteer and SearchCache generations
+            the indexes were built for.
+        """
+        self.places = places
+        self.libraries = libraries
+        self.generation = generation
+
+    @classmethod
+    def normalize(cls, text):
+        """Put a name or a prefix in the form used by the index."""
+        return " ".join(text.lower().split())
+
+    @classmethod
+    def index(cls, completions):
+        """Build a PrefixIndex of Completion objects."""
+        return PrefixIndex([(cls.normalize(x.text), x) for x in completions])
+
+    @classmethod
+    def bounds(cls):
+        """The columns of a place's bounding box."""
+        return [
+            func.ST_XMin(Place.geometry),
+            func.ST_XMax(Place.geometry),
+            func.ST_YMin(Place.geometry),
+            func.ST_YMax(Place.geometry),
+        ]
+
+    @classmethod
+    def center(cls, xmin, xmax, ymin, ymax):
+        """Find the center of a bounding box.
+
+        The center of a place's bounding box is much cheaper to find
+        than its centroid, and close enough for ordering.
+
+        :return: A 2-tuple (latitude, longitude), or None.
+        """
+        if xmin is None:
+            return None
+        return ((ymin + ymax) / 2, (xmin + xmax) / 2)
+
+    @classmethod
+    def load_places(cls, _db, gazetteer):
+        """Index the name of every place that can be completed.
+
+        :return: A PrefixIndex.
+        """
+        # Places are labeled with the state they're in.
+        places = {}
+        qu = select([Place.id] + cls.bounds()).where(Place.type.in_(cls.PLACE_TYPES))
+        for place_id, *box in _db.execute(qu):
+            entry = gazetteer.entries.get(place_id)
+            if entry is None:
+                continue
+            state = entry
+            while state is not None and state.type != Place.STATE:
+                state = gazetteer.entries.get(state.parent_id)
+            suffix = None
+            if state is not entry and state is not None and state.abbreviated_name:
+                suffix = state.abbreviated_name
+            point = cls.center(*box)
+            places[place_id] = (entry.type, suffix, [point] if point else [])
+
+        names = [(x, gazetteer.entries[x].external_name) for x in places]
+        names += (
+            _db.query(PlaceAlias.place_id, PlaceAlias.name)
+            .join(Place, PlaceAlias.place_id == Place.id)
+            .filter(Place.type.in_(cls.PLACE_TYPES))
+        )
+        completions = []
+        for place_id, name in names:
+            if not name or place_id not in places:
+                continue
+            type, suffix, points = places[place_id]
+            if suffix:
+                name = "%s, %s" % (name, suffix)
+            completions.append(Completion(name, type, True, points))
+        return cls.index(completions)
+
+    @classmethod
+    def load_libraries(cls, _db):
+        """Index the name and aliases of every library that shows up in
+        a feed.
+
+        :return: A PrefixIndex.
+        """
+        # Libraries are located at their service areas.
+        points = defaultdict(list)
+        qu = select([ServiceArea.library_id] + cls.bounds()).select_from(
+            ServiceArea.__table__.join(Place.__table__)
+        )
+        for library_id, *box in _db.execute(qu):
+            point = cls.center(*box)
+            if point:
+                points[library_id].append(point)
+
+        prod = Library.PRODUCTION_STAGE
+        in_production = {}
+        for library_id, library_stage, registry_stage in _db.query(
+            Library.id, Library._library_stage, Library.registry_stage
+        ).filter(Library._feed_restriction(False)):
+            in_production[library_id] = library_stage == prod and registry_stage == prod
+
+        names = _db.query(Library.id, Library.name).all()
+        names += _db.query(LibraryAlias.library_id, LibraryAlias.name).all()
+        completions = []
+        for library_id, name in names:
+            if name and library_id in in_production:
+                completions.append(
+                    Completion(
+                        name, cls.LIBRARY, in_production[library_id], points[library_id]
+                    )
+                )
+        return cls.index(completions)
+
+    @classmethod
+    def load(cls, _db, gazetteer, generation, old=None):
+        """Build Completions for the given generations.
+
+        :param old: Older Completions. If either of their indexes is
+            still up to date, it's reused.
+        """
+        places_generation, libraries_generation = generation
+        if old is not None and old.generation[0] == places_generation:
+            places = old.places
+        else:
+            places = cls.load_places(_db, gazetteer)
+        if old is not None and old.generation[1] == libraries_generation:
+            libraries = old.libraries
+        else:
+            libraries = cls.load_libraries(_db)
+        return cls(places, libraries, generation)
+
+    @classmethod
+    def engine(cls, _db):
+        """Find the Engine a background thread can use to open its own
+        session, or None if there isn't one.
+        """
+        bind = _db.get_bind()
+        # A session tied to a single connection can't share it with
+        # another thread.
+        if isinstance(bind, Engine):
+            return bind
+        return None
+
+    @classmethod
+    def current(cls, _db):
+        """Find the Completions for this process.
+
+        The first time this is called, the Completions are built
+        right away. After that, if the libraries or places have
+        changed, the current Completions are returned while newer
+        ones are built in the background.
+        """
+        gazetteer = Gazetteer.current(_db)
+        generation = (gazetteer.generation, SearchCache.generation(_db))
+        completions = cls._current
+        if completions is not None and completions.generation == generation:
+            return completions
+
+        with cls._lock:
+            completions = cls._current
+            if completions is None:
+                completions = cls.load(_db, gazetteer, generation)
+                cls._current = completions
+                return completions
+            if cls._rebuilding or completions.generation == generation:
+                return completions
+            engine = cls.engine(_db)
+            if engine is None:
+                completions = cls.load(_db, gazetteer, generation, completions)
+                cls._current = completions
+                return completions
+            cls._rebuilding = True
+
+        def rebuild():
+            session = Session(bind=engine)
+            try:
+                cls._current = cls.load(session, gazetteer, generation, completions)
+            except Exception:
+                logging.exception("Could not rebuild the typeahead completions.")
+            finally:
+                session.close()
+                cls._rebuilding = False
+
+        Thread(target=rebuild, name="completions", daemon=True).start()
+        return completions
+
+    def complete(self, prefix, target=None, production=True, limit=None):
+        """Find the names that start with the given prefix.
+
+        :param target: Order names by proximity to this location, a
+            2-tuple (latitude, longitude).
+        :param production: If True, only libraries that are ready for
+            production are named.
+        :param limit: Return no more than this many names.
+        :return: A list of Completion objects, no two with the same
+            text and type.
+        """
+        limit = limit or self.LIMIT
+        prefix = self.normalize(prefix)
+        if len(prefix) < self.MIN_PREFIX_LENGTH:
+            return []
+        candidates = [
+            completion
+            for key, completion in heapq.merge(
+                self.places.items(prefix, self.MAX_CANDIDATES),
+                self.libraries.items(prefix, self.MAX_CANDIDATES),
+                key=lambda x: x[0],
+            )
+        ]
+        if production:
+            candidates = [x for x in candidates if x.in_production]
+        if target:
+
+            def distance(completion):
+                return min(
+                    (GeometryUtility.distance(target, x) for x in completion.points),
+                    default=math.inf,
+                )
+
+            # Sorting is stable, so names the same distance away stay
+            # in alphabetical order.
+            candidates = sorted(candidates, key=distance)
+
+        results = []
+        seen = set()
+        for completion in candidates:
+            key = (completion.text, completion.type)
+            if key in seen:
+                continue
+            seen.add(key)
+            results.append(completion)
+            if len(results) >= limit:
+                break
+        return results
+
+    @classmethod
+    def lookup(cls, _db, prefix, target=None, production=True, limit=None):
+        """Complete a prefix, using the cache if possible.
+
+        The arguments and return value are the same as for complete(),
+        except that `target` may be anything SearchCache.cell()
+        understands, and is moved to the center of its grid cell.
+        """
+        completions = cls.current(_db)
+        prefix = cls.normalize(prefix or "")
+        cell = SearchCache.cell(target) if target else None
+        key = (completions.generation, prefix, cell, production, limit)
+        results = cls.cache.get(key)
+        if results is LRUCache.MISSING:
+            results = completions.complete(prefix, cell, production, limit)
+            cls.cache.set(key, results)
+        return results
+
+    @classmethod
+    def stats(cls):
+        """Summarize how well the cache is working."""
+        return cls.cache.stats()
+
+
+class PlaceResolver:
+    """Look up a batch of place names with a constant number of queries.
+
+    Looking up the places in a coverage object one at a time with
+    Place.lookup_inside() takes a database round trip per name. A
+    PlaceResolver resolves every name with the Gazetteer, then loads
+    all of the resulting Places in a single query.
+    """
+
+    def __init__(self, _db, coverage):
+        """Constructor.
+
+        :param coverage: A dictionary mapping nation names to lists of
+            place names, e.g. {"US": ["Boston, MA", "Kings County, NY"]}.
+        """
+        self._db = _db
+        self.gazetteer = Gazetteer.current(_db)
+
+        ids = set()
+        for nation, places in coverage.items():
+            try:
+                nation_entry = self.gazetteer.lookup_one_by_name(
+                    nation, place_type=Place.NATION
+                )
+            except (NoResultFound, MultipleResultsFound):
+                continue
+            ids.add(nation_entry.id)
+            for place in places:
+                try:
+                    entry = self.gazetteer.lookup_inside(nation_entry, place)
+                except MultipleResultsFound:
+                    continue
+                if entry:
+                    ids.add(entry.id)
+
+        # Place objects, keyed by ID.
+        self.places = {}
+        if ids:
+            qu = (
+                _db.query(Place)
+                .filter(Place.id.in_(ids))
+                .options(lazyload(Place.children))
+            )
+            self.places = {place.id: place for place in qu}
+
+    def place(self, entry):
+        """Find the Place for a GazetteerEntry."""
+        if entry is None:
+            return None
+        if entry.id in self.places:
+            return self.places[entry.id]
+        return Gazetteer.place(self._db, entry)
+
+    def lookup_one_by_name(self, name, place_type=None):
+        """Find exactly one Place with the given name.
+
+        :raise NoResultFound: If there is no such Place.
+        :raise MultipleResultsFound: If there's more than one.
+        """
+        return self.place(self.gazetteer.lookup_one_by_name(name, place_type))
+
+    def lookup_inside(self, container, name):
+        """Look up a named Place that is 'inside' another Place.
+
+        :return: A Place object, or None if no match could be found.
+        :raise MultipleResultsFound: If more than one Place with the
+            given name is 'inside' `container`.
+        """
+        return self.place(self.gazetteer.lookup_inside(container, name))
+
+
+class PlaceAlias(Base):
+
+    """An alternate name for a place."""
+
+    __tablename__ = "placealiases"
+
+    id = Column(Integer, primary_key=True)
+    place_id = Column(Integer, ForeignKey("places.id"), index=True)
+    name = Column(Unicode, index=True)
+    language = Column(Unicode(3), index=True)
+
+    __table_args__ = (UniqueConstraint("place_id", "name", "language"),)
+
+
+def trigram_index(name, field):
+    """A GIN index on the lowercase version of a text field, for
+    Library.fuzzy_match() and Library.partial_match().
+    """
+    normalized = func.lower(field).label("normalized")
+    return Index(
+        name,
+        normalized,
+        postgresql_using="gin",
+        postgresql_ops={"normalized": "gin_trgm_ops"},
+    )
+
+
+trigram_index("ix_libraries_name_trgm", Library.name)
+trigram_index("ix_libraries_description_trgm", Library.description)
+trigram_index("ix_libraryalias_name_trgm", LibraryAlias.name)
+trigram_index("ix_places_external_name_trgm", Place.external_name)
+trigram_index("ix_placealiases_name_trgm", PlaceAlias.name)
+
+Index(
+    "ix_libraries_search_document",
+    Library.search_document,
+    postgresql_using="gin",
+)
+
+
+class PlaceSubdivision(Base):
+    """A small piece of a Place's geometry.
+
+    Nations and states have enormous, detailed outlines. A spatial
+    index can't rule them out of a search, because their bounding
+    boxes cover so much of the map, and an exact test against one of
+    them has to walk every vertex. ST_Subdivide cuts each outline
+    into pieces that have tight bounding boxes and a limited number
+    of vertices. Spatial predicates are run against the pieces and
+    aggregated back to the Places they came from.
+
+    These records are derived from Place; use
+    PlaceSubdivision.refresh() to bring them up to date.
+    """
+
+    __tablename__ = "placesubdivisions"
+
+    # No piece will have more vertices than this.
+    MAX_VERTICES = 256
+
+    id = Column(Integer, primary_key=True)
+    place_id = Column(Integer, ForeignKey("places.id"), index=True, nullable=False)
+    geometry = Column(Geometry(srid=4326), nullable=False)
+
+    @classmethod
+    def intersects(cls, place_id, other_place_id, not_counting_border=False):
+        """Create a SQLAlchemy clause that is true if two Places intersect.
+
+        :param place_id: ID of one Place, or a column containing one.
+        :param other_place_id: ID of the other Place, or a column
+            containing one.
+        :param not_counting_border: If this is True, Places that only
+            share a border are not considered to intersect. (See
+            Place.overlaps_not_counting_border.)
+        """
+        piece = aliased(cls)
+        other_piece = aliased(cls)
+        clause = func.ST_Intersects(piece.geometry, other_piece.geometry)
+        if not_counting_border:
+            # Two places share more than a border if any of their
+            # pieces share more than a border.
+            touches = func.ST_Touches(piece.geometry, other_piece.geometry)
+            clause = and_(clause, touches == False)
+        return (
+            select([literal_column("1")])
+            .where(
+                and_(
+                    piece.place_id == place_id,
+                    other_piece.place_id == other_place_id,
+                    clause,
+                )
+            )
+            .exists()
+        )
+
+    @classmethod
+    def refresh(cls, _db, place_ids=None):
+        """Rebuild the PlaceSubdivision records for some or all Places.
+
+        :param place_ids: Only rebuild the records for these Places. By
+            default, every record is rebuilt.
+        """
+        if place_ids is not None:
+            place_ids = [x for x in place_ids if x is not None]
+            if not place_ids:
+                return
+        _db.flush()
+
+        pieces = select(
+            [
+                Place.id,
+                func.ST_Subdivide(Place.geometry, cls.MAX_VERTICES),
+            ]
+        ).where(Place.geometry != None)
+        delete = cls.__table__.delete()
+        if place_ids is not None:
+            pieces = pieces.where(Place.id.in_(place_ids))
+            delete = delete.where(cls.place_id.in_(place_ids))
+        insert = cls.__table__.insert().from_select(["place_id", "geometry"], pieces)
+        _db.execute(delete)
+        _db.execute(insert)
+
+
+class PlaceGeoJSON(Base):
+    """A Place's geometry as GeoJSON text, at one of several resolutions.
+
+    Generating GeoJSON for a nation or a state at full resolution is
+    expensive and produces a very large document. These fragments are
+    generated ahead of time, at several levels of simplification, so
+    they can be served directly.
+
+    These records are derived from Place; use PlaceGeoJSON.refresh()
+    to bring them up to date.
+    """
+
+    __tablename__ = "placegeojson"
+
+    FULL = "full"
+    HIGH = "high"
+    MEDIUM = "medium"
+    LOW = "low"
+
+    # For each resolution: the tolerance, in degrees, used to simplify
+    # the geometry, and the number of decimal places to keep in each
+    # coordinate. None means to use the original geometry, or the
+    # PostGIS default number of decimal places. At the equator,
+    # 0.0001 degrees is about 11 meters.
+    RESOLUTIONS = {
+        FULL: (None, None),
+        HIGH: (0.0001, 6),
+        MEDIUM: (0.001, 5),
+        LOW: (0.01, 4),
+    }
+
+    place_id = Column(Integer, ForeignKey("places.id"), primary_key=True)
+    resolution = Column(Unicode(16), primary_key=True)
+    geojson = Column(Unicode, nullable=False)
+
+    # An MD5 digest of `geojson`.
+    digest = Column(Unicode(32), nullable=False)
+
+    @classmethod
+    def geojson_expression(cls, geometry, resolution):
+        """Create a SQL expression that turns a geometry into GeoJSON
+        text at the given resolution.
+        """
+        tolerance, decimal_places = cls.RESOLUTIONS[resolution]
+        if tolerance is not None:
+            geometry = func.ST_SimplifyPreserveTopology(geometry, tolerance)
+        if decimal_places is None:
+            return func.ST_AsGeoJSON(geometry)
+        return func.ST_AsGeoJSON(geometry, decimal_places)
+
+    @classmethod
+    def refresh(cls, _db, place_ids=None):
+        """Rebuild the PlaceGeoJSON records for some or all Places.
+
+        :param place_ids: Only rebuild the records for these Places. By
+            default, every record is rebuilt.
+        """
+        if place_ids is not None:
+            place_ids = [x for x in place_ids if x is not None]
+            if not place_ids:
+                return
+        _db.flush()
+
+        delete = cls.__table__.delete()
+        if place_ids is not None:
+            delete = delete.where(cls.place_id.in_(place_ids))
+        _db.execute(delete)
+
+        for resolution in cls.RESOLUTIONS:
+            geojson = cls.geojson_expression(Place.geometry, resolution)
+            fragments = select(
+                [Place.id, literal(resolution), geojson, func.md5(geojson)]
+            ).where(Place.geometry != None)
+            if place_ids is not None:
+                fragments = fragments.where(Place.id.in_(place_ids))
+            insert = cls.__table__.insert().from_select(
+                ["place_id", "resolution", "geojson", "digest"], fragments
+            )
+            _db.execute(insert)
+
+    @classmethod
+    def fragments(cls, _db, places, resolution):
+        """Find GeoJSON text for some Places at the given resolution.
+
+        :return: A list of 2-tuples (geojson, digest), in the same
+            order as `places`. Places with no geometry are left out.
+        """
+        place_ids = list(dict.fromkeys(x.id for x in places))
+        qu = select([cls.place_id, cls.geojson, cls.digest]).where(
+            and_(cls.place_id.in_(place_ids), cls.resolution == resolution)
+        )
+        found = {
+            place_id: (geojson, digest) for place_id, geojson, digest in _db.execute(qu)
+        }
+
+        missing = [x for x in place_ids if x not in found]
+        if missing:
+            # These Places haven't been processed yet. Generate their
+            # GeoJSON on the spot.
+            geojson = cls.geojson_expression(Place.geometry, resolution)
+            qu = select([Place.id, geojson, func.md5(geojson)]).where(
+                and_(Place.id.in_(missing), Place.geometry != None)
+            )
+            for place_id, geojson, digest in _db.execute(qu):
+                found[place_id] = (geojson, digest)
+        return [found[x] for x in place_ids if x in found]
+
+
+class ServedPlace(Base):
+    """A Place that is part of at least one Library's ServiceArea.
+
+    Only a small fraction of the Places in the database (every postal
+    code, city and county we know about) are actually served by a
+    library. This table holds a compact copy of the ones that are,
+    along with their geometry and a spatial index of their own, so
+    that geographic searches for libraries never have to look at
+    the rest.
+
+    These records are derived from ServiceArea, Library and Place;
+    use ServedPlace.refresh() to bring them up to date.
+    """
+
+    __tablename__ = "servedplaces"
+
+    place_id = Column(Integer, ForeignKey("places.id"), primary_key=True)
+
+    # A copy of Place.geometry.
+    geometry = Column(Geometry(srid=4326), nullable=True)
+
+    # Is this place served by at least one library that shows up in
+    # the production feed?
+    in_production_feed = Column(Boolean, index=True, nullable=False, default=False)
+
+    # Is this place served by at least one library that shows up in
+    # the testing (QA) feed?
+    in_testing_feed = Column(Boolean, index=True, nullable=False, default=False)
+
+    @classmethod
+    def feed_restriction(cls, production):
+        """Create a SQLAlchemy restriction that only finds served places
+        that show up in the given feed.
+
+        This is a cheap way of narrowing down a search before applying
+        Library._feed_restriction, which has the final say.
+        """
+        if production:
+            return cls.in_production_feed == True
+        return cls.in_testing_feed == True
+
+    @classmethod
+    def refresh(cls, _db, place_ids=None):
+        """Rebuild the ServedPlace records for some or all Places.
+
+        :param place_ids: Only rebuild the records for these Places. By
+            default, every record is rebuilt.
+        """
+        if place_ids is not None:
+            place_ids = [x for x in place_ids if x is not None]
+            if not place_ids:
+                return
+        _db.flush()
+
+        # Figure out which feeds each served place shows up in. A
+        # place that is only served by cancelled libraries doesn't
+        # show up anywhere, so it doesn't get a record.
+        in_production_feed = func.bool_or(Library._feed_restriction(True))
+        in_testing_feed = func.bool_or(Library._feed_restriction(False))
+        served = (
+            select(
+                [
+                    ServiceArea.place_id.label("place_id"),
+                    in_production_feed.label("in_production_feed"),
+                    in_testing_feed.label("in_testing_feed"),
+                ]
+            )
+            .select_from(
+                join(ServiceArea, Library, ServiceArea.library_id == Library.id)
+            )
+            .group_by(ServiceArea.place_id)
+            .having(in_testing_feed)
+        )
+        delete = cls.__table__.delete()
+        if place_ids is not None:
+            served = served.where(ServiceArea.place_id.in_(place_ids))
+            delete = delete.where(cls.place_id.in_(place_ids))
+        served = served.alias("served")
+
+        insert = cls.__table__.insert().from_select(
+            ["place_id", "geometry", "in_production_feed", "in_testing_feed"],
+            select(
+                [
+                    served.c.place_id,
+                    Place.geometry,
+                    served.c.in_production_feed,
+                    served.c.in_testing_feed,
+                ]
+            ).select_from(join(served, Place, served.c.place_id == Place.id)),
+        )
+        # Map tiles are drawn from these records, so the cached tiles
+        # that show these places, where they were and where they are
+        # now, are out of date.
+        if place_ids is None or len(place_ids) > ServiceAreaTile.MAX_INVALIDATED_PLACES:
+            bounds = None
+        else:
+            bounds = []
+            for geometry, ids in (
+                (cls.geometry, cls.place_id),
+                (Place.geometry, Place.id),
+            ):
+                qu = select(
+                    [
+                        func.ST_XMin(geometry),
+                        func.ST_YMin(geometry),
+                        func.ST_XMax(geometry),
+                        func.ST_YMax(geometry),
+                    ]
+                ).where(and_(ids.in_(place_ids), geometry != None))
+                bounds.extend(tuple(box) for box in _db.execute(qu))
+
+        _db.execute(delete)
+        _db.execute(insert)
+        ServiceAreaTile.clear(_db, bounds)
+
+
+class PostalCodeLibrary(Base):
+    """A Library that serves, or is close to, a postal code.
+
+    Searching for a library by postal code is very common. Rather
+    than comparing the postal code's geometry against every Place a
+    library serves on every search, the answer is worked out ahead of
+    time for every postal code.
+
+    These records are derived from Place, PlaceSubdivision and
+    ServiceArea; use PostalCodeLibrary.refresh() to bring them up to
+    date. They don't take a library's stage into account, so they
+    don't need to change when the stage does.
+    """
+
+    __tablename__ = "postalcodelibraries"
+
+    # A library is considered close to a postal code if one of its
+    # service areas is no further than this many kilometers away.
+    NEARBY_RADIUS = 150
+
+    # Before measuring the distance between two geometries in meters,
+    # we look for geometries that are no further apart than this many
+    # degrees. This is generous: at 60 degrees north, NEARBY_RADIUS is
+    # about 2.7 degrees of longitude.
+    NEARBY_DEGREES = 3
+
+    place_id = Column(Integer, ForeignKey("places.id"), primary_key=True)
+    library_id = Column(
+        Integer, ForeignKey("libraries.id"), primary_key=True, index=True
+    )
+
+    # Does one of the library's service areas intersect the postal code?
+    serves = Column(Boolean, nullable=False)
+
+    # The distance, in meters, between the postal code and the
+    # nearest of the library's service areas.
+    distance = Column(Float, nullable=False)
+
+    @classmethod
+    def refresh(
+        cls, _db, library_ids=None, postal_code_ids=None, served_place_ids=None
+    ):
+        """Rebuild some or all of the PostalCodeLibrary records.
+
+        :param library_ids: Only rebuild the records for these Libraries.
+        :param postal_code_ids: Only rebuild the records for the postal
+            codes with these IDs. IDs of other kinds of Places are
+            ignored.
+        :param served_place_ids: Only rebuild the records for postal
+            codes near these Places, such as places that were just
+            added to or removed from a service area.
+        """
+        restrictions = []
+        delete = cls.__table__.delete()
+        postal_code = aliased(Place)
+        for ids, record_field, source_field in (
+            (library_ids, cls.library_id, ServiceArea.library_id),
+            (postal_code_ids, cls.place_id, postal_code.id),
+        ):
+            if ids is None:
+                continue
+            ids = [x for x in ids if x is not None]
+            if not ids:
+                return
+            delete = delete.where(record_field.in_(ids))
+            restrictions.append(source_field.in_(ids))
+        if served_place_ids is not None:
+            served_place_ids = [x for x in served_place_ids if x is not None]
+            if not served_place_ids:
+                return
+            # A record can only depend on a served place if the postal
+            # code has a piece within NEARBY_DEGREES of it.
+            changed_piece = aliased(PlaceSubdivision)
+            nearby_piece = aliased(PlaceSubdivision)
+            nearby_ids = (
+                select([nearby_piece.place_id])
+                .select_from(
+                    join(
+                        nearby_piece,
+                        changed_piece,
+                        func.ST_DWithin(
+                            nearby_piece.geometry,
+                            changed_piece.geometry,
+                            cls.NEARBY_DEGREES,
+                        ),
+                    )
+                )
+                .where(changed_piece.place_id.in_(served_place_ids))
+            )
+            delete = delete.where(cls.place_id.in_(nearby_ids))
+            restrictions.append(postal_code.id.in_(nearby_ids))
+        _db.flush()
+
+        # Compare the pieces of each postal code with the pieces of
+        # each served place that's nearby.
+        postal_code_piece = aliased(PlaceSubdivision)
+        served_piece = aliased(PlaceSubdivision)
+        intersects = func.ST_Intersects(
+            postal_code_piece.geometry, served_piece.geometry
+        )
+        distance = case(
+            [(intersects, literal_column("0"))],
+            else_=func.ST_DistanceSphere(
+                postal_code_piece.geometry, served_piece.geometry
+            ),
+        )
+        min_distance = func.min(distance)
+        pairs = (
+            select(
+                [
+                    postal_code.id,
+                    ServiceArea.library_id,
+                    func.bool_or(intersects),
+                    min_distance,
+                ]
+            )
+            .select_from(
+                join(
+                    postal_code,
+                    postal_code_piece,
+                    postal_code.id == postal_code_piece.place_id,
+                )
+                .join(
+                    served_piece,
+                    func.ST_DWithin(
+                        postal_code_piece.geometry,
+                        served_piece.geometry,
+                        cls.NEARBY_DEGREES,
+                    ),
+                )
+                .join(ServiceArea, ServiceArea.place_id == served_piece.place_id)
+            )
+            .where(and_(postal_code.type == Place.POSTAL_CODE, *restrictions))
+            .group_by(postal_code.id, ServiceArea.library_id)
+            .having(min_distance <= cls.NEARBY_RADIUS * 1000)
+        )
+        insert = cls.__table__.insert().from_select(
+            ["place_id", "library_id", "serves", "distance"], pairs
+        )
+        _db.execute(delete)
+        _db.execute(insert)
+
+
+class PlaceLibraryOverlap(Base):
+    """Records that a Place overlaps one of a Library's service areas.
+
+    Whether a library serves a place changes only when places are
+    reloaded or when the library's service areas change, so there's
+    no need to compare geometries every time someone asks.
+
+    These records are derived from PlaceSubdivision and ServiceArea;
+    use PlaceLibraryOverlap.refresh() to bring them up to date.
+    """
+
+    __tablename__ = "placelibraryoverlaps"
+
+    # The place has points inside one of the library's service areas.
+    INTERIOR = "interior"
+
+    # The place touches one of the library's service areas, but
+    # only along a border.
+    BORDER = "border"
+
+    overlap_type_enum = Enum(INTERIOR, BORDER, name="overlap_type")
+
+    place_id = Column(Integer, ForeignKey("places.id"), primary_key=True)
+    library_id = Column(
+        Integer, ForeignKey("libraries.id"), primary_key=True, index=True
+    )
+    overlap_type = Column(overlap_type_enum, index=True, nullable=False)
+
+    @classmethod
+    def refresh(cls, _db, place_ids=None, library_ids=None):
+        """Rebuild some or all of the PlaceLibraryOverlap records.
+
+        :param place_ids: Only rebuild the records for these Places.
+        :param library_ids: Only rebuild the records for these Libraries.
+        """
+        piece = aliased(PlaceSubdivision)
+        served_piece = aliased(PlaceSubdivision)
+        restrictions = []
+        delete = cls.__table__.delete()
+        for ids, record_field, source_field in (
+            (place_ids, cls.place_id, piece.place_id),
+            (library_ids, cls.library_id, ServiceArea.library_id),
+        ):
+            if ids is None:
+                continue
+            ids = [x for x in ids if x is not None]
+            if not ids:
+                return
+            delete = delete.where(record_field.in_(ids))
+            restrictions.append(source_field.in_(ids))
+        _db.flush()
+
+        # Two places share more than a border if any of their pieces
+        # share more than a border.
+        touches = func.ST_Touches(piece.geometry, served_piece.geometry)
+        overlap_type = case(
+            [(func.bool_or(touches == False), literal(cls.INTERIOR))],
+            else_=literal(cls.BORDER),
+        )
+        pairs = (
+            select(
+                [
+                    piece.place_id,
+                    ServiceArea.library_id,
+                    cast(overlap_type, cls.overlap_type_enum),
+                ]
+            )
+            .select_from(
+                join(
+                    piece,
+                    served_piece,
+                    func.ST_Intersects(piece.geometry, served_piece.geometry),
+                ).join(ServiceArea, ServiceArea.place_id == served_piece.place_id)
+            )
+            .group_by(piece.place_id, ServiceArea.library_id)
+        )
+        for restriction in restrictions:
+            pairs = pairs.where(restriction)
+        insert = cls.__table__.insert().from_select(
+            ["place_id", "library_id", "overlap_type"], pairs
+        )
+        _db.execute(delete)
+        _db.execute(insert)
+
+
+class ServiceAreaTile(Base):
+    """A cached Mapbox vector tile showing the service areas of the
+    libraries in one of the feeds.
+
+    Tiles are drawn from ServedPlace. Only tiles that show something,
+    at zoom levels up to MAX_CACHED_ZOOM, are cached, and a cached
+    tile is only used for MAX_AGE. When ServedPlace records change,
+    the tiles that cover them are thrown away. A tile drawn from the
+    old records while that happens may still be cached, but it will
+    be no older than the tiles clients are allowed to keep anyway.
+    """
+
+    __tablename__ = "serviceareatiles"
+
+    # The name of the layer within each tile.
+    LAYER = "service_areas"
+
+    # Don't draw tiles more detailed than this.
+    MAX_ZOOM = 22
+
+    # Don't cache tiles more detailed than this. There are 4**z tiles
+    # at zoom level z, so caching detailed tiles would let clients
+    # fill the table with tiles that will never be asked for again.
+    MAX_CACHED_ZOOM = 12
+
+    # How long a cached tile is good for.
+    MAX_AGE = datetime.timedelta(hours=1)
+
+    # If more places than this change at once, throw away every
+    # cached tile rather than working out which ones cover them.
+    MAX_INVALIDATED_PLACES = 100
+
+    # Web Mercator doesn't reach the poles.
+    MAX_LATITUDE = 85.0511
+
+    production = Column(Boolean, primary_key=True)
+    z = Column(Integer, primary_key=True)
+    x = Column(Integer, primary_key=True)
+    y = Column(Integer, primary_key=True)
+    data = Column(LargeBinary, nullable=False)
+    created = Column(
+        DateTime,
+        index=True,
+        nullable=False,
+        default=lambda: datetime.datetime.utcnow(),
+    )
+
+    @classmethod
+    def is_valid(cls, z, x, y):
+        """Does the given tile exist?"""
+        if z < 0 or z > cls.MAX_ZOOM:
+            return False
+        return 0 <= x < 2**z and 0 <= y < 2**z
+
+    @classmethod
+    def tile(cls, _db, z, x, y, production=True):
+        """Find or draw a vector tile.
+
+        :param production: If True, only libraries that are ready for
+            production are shown.
+
+        :return: The tile, as a bytestring.
+        """
+        now = datetime.datetime.utcnow()
+        cutoff = now - cls.MAX_AGE
+        key = and_(cls.production == production, cls.z == z, cls.x == x, cls.y == y)
+        cached = _db.execute(
+            select([cls.data]).where(and_(key, cls.created > cutoff))
+        ).scalar()
+        if cached is not None:
+            return bytes(cached)
+
+        data = cls.draw(_db, z, x, y, production)
+        if not data or z > cls.MAX_CACHED_ZOOM:
+            return data
+
+        # Make room by throwing out tiles that are too old to use.
+        _db.execute(cls.__table__.delete().where(cls.created <= cutoff))
+
+        # Another request may have drawn the same tile in the
+        # meantime. If so, the tiles are identical, and it doesn't
+        # matter which one we keep.
+        insert = postgresql.insert(cls.__table__).values(
+            production=production, z=z, x=x, y=y, data=data, created=now
+        )
+        insert = insert.on_conflict_do_update(
+            index_elements=[cls.production, cls.z, cls.x, cls.y],
+            set_=dict(data=insert.excluded.data, created=insert.excluded.created),
+        )
+        _db.execute(insert)
+        return data
+
+    @classmethod
+    def draw(cls, _db, z, x, y, production=True):
+        """Draw a vector tile showing the service areas of the libraries
+        in a feed. Each feature carries the library's ID and stages, and
+        the type of service area.
+
+        :return: The tile, as a bytestring.
+        """
+        # Tiles are laid out in Web Mercator, but places are stored
+        # as latitude and longitude.
+        envelope = func.ST_TileEnvelope(z, x, y)
+        geometry = func.ST_AsMVTGeom(
+            func.ST_Transform(ServedPlace.geometry, 3857), envelope
+        )
+        features = (
+            select(
+                [
+                    Library.id.label("library_id"),
+                    Library.library_stage.label("library_stage"),
+                    Library.registry_stage.label("registry_stage"),
+                    ServiceArea.type.label("area_type"),
+                    geometry.label("geometry"),
+                ]
+            )
+            .select_from(
+                join(Library, ServiceArea, Library.id == ServiceArea.library_id).join(
+                    ServedPlace, ServiceArea.place_id == ServedPlace.place_id
+                )
+            )
+            .where(
+                and_(
+                    ServedPlace.feed_restriction(production),
+                    Library._feed_restriction(production),
+                    ServedPlace.geometry.intersects(func.ST_Transform(envelope, 4326)),
+                )
+            )
+            .alias("features")
+        )
+        tile = select(
+            [func.ST_AsMVT(literal_column("features"), cls.LAYER, 4096, "geometry")]
+        ).select_from(features)
+        return bytes(_db.execute(tile).scalar() or b"")
+
+    @classmethod
+    def tile_range(cls, z, bounds):
+        """Find the tiles at a zoom level that cover a bounding box.
+
+        :param bounds: A 4-tuple (min longitude, min latitude, max
+            longitude, max latitude).
+        :return: A 4-tuple (min x, min y, max x, max y).
+        """
+        n = 2**z
+
+        def x_for(longitude):
+            return int((longitude + 180) / 360 * n)
+
+        def y_for(latitude):
+            latitude = max(-cls.MAX_LATITUDE, min(cls.MAX_LATITUDE, latitude))
+            radians = math.radians(latitude)
+            mercator = math.log(math.tan(radians) + 1 / math.cos(radians))
+            return int((1 - mercator / math.pi) / 2 * n)
+
+        def clamp(i):
+            return max(0, min(n - 1, i))
+
+        xmin, ymin, xmax, ymax = bounds
+        # Tile rows are numbered from north to south.
+        return (
+            clamp(x_for(xmin)),
+            clamp(y_for(ymax)),
+            clamp(x_for(xmax)),
+            clamp(y_for(ymin)),
+        )
+
+    @classmethod
+    def clear(cls, _db, bounds=None):
+        """Throw away cached tiles.
+
+        :param bounds: Only throw away the tiles that cover these
+            bounding boxes, a list of 4-tuples (min longitude, min
+            latitude, max longitude, max latitude). By default, every
+            tile is thrown away.
+        """
+        delete = cls.__table__.delete()
+        if bounds is not None:
+            if not bounds:
+                return
+            covering = []
+            for z in range(cls.MAX_CACHED_ZOOM + 1):
+                for box in bounds:
+                    xmin, ymin, xmax, ymax = cls.tile_range(z, box)
+                    covering.append(
+                        and_(
+                            cls.z == z,
+                            cls.x.between(xmin, xmax),
+                            cls.y.between(ymin, ymax),
+                        )
+                    )
+            delete = delete.where(or_(*covering))
+        _db.execute(delete)
+
+
+class Audience(Base):
+    """A class of person served by a library."""
+
+    __tablename__ = "audiences"
+
+    # The general public
+    PUBLIC = "public"
+
+    # Pre-university students
+    EDUCATIONAL_PRIMARY = "educational-primary"
+
+    # University students
+    EDUCATIONAL_SECONDARY = "educational-secondary"
+
+    # Academics and researchers
+    RESEARCH = "research"
+
+    # People with print disabilities
+    PRINT_DISABILITY = "print-disability"
+
+    # A catch-all for other specialized audiences.
+    OTHER = "other"
+
+    KNOWN_AUDIENCES = [
+        PUBLIC,
+        EDUCATIONAL_PRIMARY,
+        EDUCATIONAL_SECONDARY,
+        RESEARCH,
+        PRINT_DISABILITY,
+        OTHER,
+    ]
+
+    id = Column(Integer, primary_key=True)
+    name = Column(Unicode, index=True, unique=True)
+
+    libraries = relationship(
+        "Library", secondary="libraries_audiences", back_populates="audiences"
+    )
+
+    @classmethod
+    def lookup(cls, _db, name):
+        if name not in cls.KNOWN_AUDIENCES:
+            raise ValueError(_("Unknown audience: %(name)s", name=name))
+        audience, is_new = get_one_or_create(_db, Audience, name=name)
+        return audience
+
+
+class CollectionSummary(Base):
+    """A summary of a collection held by a library.
+
+    We only need to know the language of the collection and
+    approximately how big it is.
+    """
+
+    __tablename__ = "collectionsummaries"
+
+    id = Column(Integer, primary_key=True)
+    library_id = Column(Integer, ForeignKey("libraries.id"), index=True)
+    language = Column(Unicode)
+    size = Column(Integer)
+
+    @classmethod
+    def set(cls, library, language, size, refresh_statistics=True):
+        """Create or update a CollectionSummary for the given
+        library and language.
+
+        :param refresh_statistics: If this is False, the caller is
+            setting several summaries at once and will refresh the
+            CollectionSizeStatistics itself once it's done.
+        :return: An up-to-date CollectionSummary.
+        """
+        _db = Session.object_session(library)
+
+        size = int(size)
+        if size < 0:
+            raise ValueError(_("Collection size cannot be negative."))
+
+        # This might return None, which is fine. We'll store it as a
+        # collection with an unknown language. This also covers the
+        # case where the library specifies its collection size but
+        # doesn't mention any languages.
+        language_code = LanguageCodes.string_to_alpha_3(language)
+
+        summary, is_new = get_one_or_create(
+            _db, CollectionSummary, library=library, language=language_code
+        )
+        summary.size = size
+        if refresh_statistics:
+            CollectionSizeStatistics.refresh(_db, [language_code])
+        return summary
 
 
 Index(
@@ -1814,6 +3808,91 @@ Index(
 )
 
 
+class CollectionSizeStatistics(Base):
+    """Aggregate statistics about the collections held by libraries in
+    one language.
+
+    These records are derived from CollectionSummary; use
+    CollectionSizeStatistics.refresh() to bring them up to date.
+    Collections in an unknown language aren't counted.
+    """
+
+    __tablename__ = "collectionsizestatistics"
+
+    language = Column(Unicode, primary_key=True)
+
+    # The size of the largest collection in this language, including
+    # collections that no longer belong to a library.
+    max_size = Column(Integer, nullable=False)
+
+    # The total size of every collection in this language.
+    total_size = Column(BigInteger, nullable=False)
+
+    # The number of libraries with a collection in this language.
+    libraries = Column(Integer, nullable=False)
+
+    @classmethod
+    def refresh(cls, _db, languages=None):
+        """Rebuild the statistics for some or all languages.
+
+        :param languages: Only rebuild the statistics for these
+            languages (as ISO-639-2 codes). By default, every record is
+            rebuilt.
+        """
+        if languages is not None:
+            languages = [x for x in languages if x is not None]
+            if not languages:
+                return
+        _db.flush()
+
+        # Library.relevant() has always compared collection sizes
+        # against the largest CollectionSummary in the language, even
+        # one that no longer belongs to a library, so max_size counts
+        # those too. The other statistics only count collections that
+        # belong to a library.
+        size = func.coalesce(CollectionSummary.size, 0)
+        belongs = CollectionSummary.library_id != None
+        summaries = (
+            select(
+                [
+                    CollectionSummary.language,
+                    func.max(size),
+                    func.coalesce(func.sum(size).filter(belongs), 0),
+                    func.count(distinct(CollectionSummary.library_id)),
+                ]
+            )
+            .where(CollectionSummary.language != None)
+            .group_by(CollectionSummary.language)
+        )
+        delete = cls.__table__.delete()
+        if languages is not None:
+            summaries = summaries.where(CollectionSummary.language.in_(languages))
+            delete = delete.where(cls.language.in_(languages))
+        insert = cls.__table__.insert().from_select(
+            ["language", "max_size", "total_size", "libraries"], summaries
+        )
+        _db.execute(delete)
+        _db.execute(insert)
+
+    @classmethod
+    def for_language(cls, _db, language_code):
+        """Find the statistics for one language.
+
+        :return: A CollectionSizeStatistics, or None if no library has
+            a collection in the language.
+        """
+        if language_code is None:
+            return None
+        # refresh() works below the ORM, so don't trust a copy that's
+        # already in the session.
+        return (
+            _db.query(cls)
+            .filter(cls.language == language_code)
+            .populate_existing()
+            .one_or_none()
+        )
+
+
 class Hyperlink(Base):
     """A link between a Library and a Resource.
 
@@ -2583,6 +4662,8 @@ class ConfigurationSetting(Base):
     @value.setter
     def value(self, new_value):
         self._value = new_value
+        if self.key in Gazetteer.STAMP_KEYS:
+            Gazetteer.invalidate()
 
     def setdefault(self, default=None):
         """If no value is set, set it to `default`.
@@ -79,3 +79,15 @@ UNABLE_TO_NOTIFY = pd(
     500,
     title=lgt("Registry server unable to send notification emails."),
 )
+
+UNKNOWN_RESOLUTION = pd(
+    "http://librarysimplified.org/terms/problem/unknown-resolution",
+    400,
+    title=lgt("Unknown resolution"),
+)
+
+TILE_NOT_FOUND = pd(
+    "http://librarysimplified.org/terms/problem/tile-not-found",
+    404,
+    title=lgt("There is no such map tile."),
+)
@@ -198,6 +198,7 @@ class LibraryRegistrar:
 
         auth_url = auth_response.url
 
+        old_library_stage = library.library_stage
         try:
             library.library_stage = library_stage
         except ValueError:
@@ -262,6 +263,13 @@ class LibraryRegistrar:
             )
             return problem
 
+        # A new stage changes the feeds the library's service areas
+        # show up in. The tables derived from them may already have
+        # been refreshed along with the service areas, but not if the
+        # document left the library's coverage alone.
+        if library.library_stage != old_library_stage:
+            library.service_areas_changed()
+
         return auth_document, hyperlinks_to_create
 
     def _make_request(
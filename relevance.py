@@ -0,0 +1,312 @@
+"""Score every library's relevance to a user at once, in memory."""
+from collections import Counter
+
+import numpy as np
+from sqlalchemy import func, select
+
+from model import (
+    Audience,
+    CollectionSummary,
+    Library,
+    Place,
+    ServiceArea,
+    libraries_audiences,
+)
+from util import GeometryUtility
+from util.language import LanguageCodes
+
+
+class RelevanceEngine:
+    """An alternative to Library.relevant() that gives the same scores.
+
+    Library.relevant() does all of its work in one large SQL query,
+    with correlated subqueries for every library. This class reads
+    everything a score depends on -- library stages, audiences,
+    collection sizes and the sizes of service areas -- into NumPy
+    arrays once, and then scores every library with a handful of
+    vectorized operations.
+
+    The only thing that can't be done in memory is measuring the
+    distance from the user to a service area, which needs PostGIS. It
+    takes one query, by primary key, for the service areas of the
+    libraries that could possibly score above the threshold.
+
+    An engine reflects the database at the time it was loaded. Load a
+    new one when libraries or their service areas change.
+    """
+
+    def __init__(self, library_ids, stages, audiences, summaries, service_areas):
+        """Constructor.
+
+        :param library_ids: A list of library IDs.
+        :param stages: A list of (library_stage, registry_stage) 2-tuples,
+            one for each library.
+        :param audiences: A list of (library_id, audience name) 2-tuples.
+        :param summaries: A list of (library_id, language, size)
+            3-tuples, one for each CollectionSummary. A summary that no
+            longer belongs to a library has no library_id; like
+            Library.relevant(), it only counts towards the largest
+            collection in its language.
+        :param service_areas: A list of (library_id, service area type,
+            place_id, place type, place area) 5-tuples.
+        """
+        self.library_ids = np.array(library_ids, dtype=np.int64)
+        index = {library_id: i for i, library_id in enumerate(library_ids)}
+        self.size = len(library_ids)
+
+        prod, test = Library.PRODUCTION_STAGE, Library.TESTING_STAGE
+        self.in_production = np.array(
+            [x == prod and y == prod for x, y in stages], dtype=bool
+        )
+        self.in_testing = np.array(
+            [x in (prod, test) and y in (prod, test) for x, y in stages],
+            dtype=bool,
+        )
+
+        # One column for each audience.
+        self.audience_names = sorted({name for ignore, name in audiences})
+        self.audiences = np.zeros((self.size, len(self.audience_names)), dtype=bool)
+        columns = {name: i for i, name in enumerate(self.audience_names)}
+        for library_id, name in audiences:
+            self.audiences[index[library_id], columns[name]] = True
+
+        # The largest collection in each language.
+        self.max_sizes = {}
+        for ignore, language, size in summaries:
+            if size is not None and size > self.max_sizes.get(language, 0):
+                self.max_sizes[language] = size
+
+        # One row for each collection summary that belongs to a library.
+        summaries = [x for x in summaries if x[0] is not None]
+        self.summary_library = np.array(
+            [index[x] for x, ignore, ignore in summaries], dtype=np.int64
+        )
+        self.summary_language = np.array(
+            [language for ignore, language, ignore in summaries], dtype=object
+        )
+        self.summary_size = np.array(
+            [np.nan if size is None else size for ignore, ignore, size in summaries],
+            dtype=float,
+        )
+        self.has_summary = np.zeros(self.size, dtype=bool)
+        self.has_summary[self.summary_library] = True
+
+        # One row for each service area.
+        self.area_library = np.array(
+            [index[x[0]] for x in service_areas], dtype=np.int64
+        )
+        self.area_is_focus = np.array(
+            [x[1] == ServiceArea.FOCUS for x in service_areas], dtype=bool
+        )
+        self.area_is_eligibility = np.array(
+            [x[1] == ServiceArea.ELIGIBILITY for x in service_areas], dtype=bool
+        )
+        self.area_place_id = np.array([x[2] for x in service_areas], dtype=np.int64)
+        self.area_everywhere = np.array(
+            [x[3] == Place.EVERYWHERE for x in service_areas], dtype=bool
+        )
+        self.area_size = np.array(
+            [np.nan if x[4] is None else x[4] for x in service_areas], dtype=float
+        )
+        self.area_size[self.area_everywhere] = Library.EVERYWHERE_AREA
+
+        self.eligibility_areas = np.bincount(
+            self.area_library[self.area_is_eligibility], minlength=self.size
+        )
+        self.focus_areas = np.bincount(
+            self.area_library[self.area_is_focus], minlength=self.size
+        )
+
+    @classmethod
+    def load(cls, _db):
+        """Read everything needed to score libraries from the database."""
+        libraries = _db.execute(
+            select([Library.id, Library.library_stage, Library.registry_stage])
+        ).fetchall()
+        audiences = _db.execute(
+            select([libraries_audiences.c.library_id, Audience.name]).select_from(
+                libraries_audiences.join(Audience)
+            )
+        ).fetchall()
+        summaries = _db.execute(
+            select(
+                [
+                    CollectionSummary.library_id,
+                    CollectionSummary.language,
+                    CollectionSummary.size,
+                ]
+            )
+        ).fetchall()
+        service_areas = _db.execute(
+            select(
+                [
+                    ServiceArea.library_id,
+                    ServiceArea.type,
+                    Place.id,
+                    Place.type,
+                    func.ST_Area(Place.geometry),
+                ]
+            ).select_from(ServiceArea.__table__.join(Place.__table__))
+        ).fetchall()
+        return cls(
+            [x.id for x in libraries],
+            [(x.library_stage, x.registry_stage) for x in libraries],
+            audiences,
+            summaries,
+            service_areas,
+        )
+
+    @classmethod
+    def exponential_decrease(cls, value):
+        """The same decay function that Library.relevant() uses."""
+        return np.exp(np.clip(-1 * value, -500, 500))
+
+    @classmethod
+    def group_min(cls, groups, values, size):
+        """Find the smallest value in each group, ignoring NaN the way
+        SQL's min() ignores NULL.
+        """
+        result = np.full(size, np.nan)
+        np.fmin.at(result, groups, values)
+        return result
+
+    @classmethod
+    def group_sum(cls, groups, values, size):
+        """Add up the values in each group, ignoring NaN the way SQL's
+        sum() ignores NULL.
+        """
+        present = ~np.isnan(values)
+        total = np.bincount(groups[present], values[present], minlength=size)
+        count = np.bincount(groups[present], minlength=size)
+        return np.where(count > 0, total, np.nan)
+
+    def relevant(self, _db, target, language, audiences=None, production=True):
+        """Find libraries that are most relevant for a user.
+
+        The arguments and return value are the same as for
+        Library.relevant().
+        """
+        score_threshold = Library.RELEVANCE_SCORE_THRESHOLD
+        decrease = self.exponential_decrease
+        audiences = audiences or [Audience.PUBLIC]
+        if isinstance(target, tuple):
+            target = GeometryUtility.point(*target)
+        language_code = LanguageCodes.string_to_alpha_3(language)
+
+        # A library needs at least one eligibility area and one focus
+        # area to be scored at all.
+        if production:
+            candidate = self.in_production.copy()
+        else:
+            candidate = self.in_testing.copy()
+        candidate &= (self.eligibility_areas > 0) & (self.focus_areas > 0)
+
+        # Score each library based on its audiences.
+        def has_audience(names):
+            columns = [i for i, name in enumerate(self.audience_names) if name in names]
+            return self.audiences[:, columns].any(axis=1)
+
+        non_public = [x for x in audiences if x != Audience.PUBLIC]
+        score = np.where(
+            has_audience(non_public),
+            Library.RELEVANCE_BASE_SCORE * Library.RELEVANCE_AUDIENCE_FACTOR,
+            np.where(has_audience([Audience.PUBLIC]), Library.RELEVANCE_BASE_SCORE, 0),
+        ).astype(float)
+
+        # Decrease the score based on the sum of the sizes of the
+        # library's focus areas, in km^2. Like Library.relevant(), this
+        # counts each focus area once for every eligibility area.
+        focus_area_size = (
+            self.group_sum(
+                self.area_library[self.area_is_focus],
+                self.area_size[self.area_is_focus],
+                self.size,
+            )
+            * self.eligibility_areas
+            / 1000000
+        )
+        score *= decrease(
+            1.0 * Library.RELEVANCE_FOCUS_AREA_SIZE_FACTOR * focus_area_size
+        )
+
+        # A library is scored once for each of its collections in the
+        # user's language. A library with no collection information at
+        # all is scored as if it had one book.
+        matching = (self.summary_language == language_code) | (
+            self.summary_language == None  # noqa: E711
+        )
+        unknown = np.flatnonzero(~self.has_summary)
+        rows = np.concatenate([self.summary_library[matching], unknown])
+        estimated_size = np.concatenate(
+            [self.summary_size[matching], np.ones(len(unknown))]
+        )
+        keep = candidate[rows]
+        rows, estimated_size = rows[keep], estimated_size[keep]
+        row_score = score[rows]
+
+        max_size = self.max_sizes.get(language_code, 0)
+        if max_size > 0:
+            row_score *= 1 - decrease(
+                1.0
+                * Library.RELEVANCE_COLLECTION_SIZE_FACTOR
+                * estimated_size
+                / max_size
+            )
+
+        # The distance factors are never more than 1, so any library
+        # that's already below the threshold can be left out.
+        keep = row_score > score_threshold
+        rows, row_score = rows[keep], row_score[keep]
+        if not len(rows):
+            return Counter()
+
+        # Measure the distance from the target to every service area
+        # of the remaining libraries, in km. The distance to
+        # 'everywhere' is 0.
+        areas = np.flatnonzero(np.isin(self.area_library, rows))
+        everywhere = self.area_everywhere[areas]
+        area_place_ids = self.area_place_id[areas]
+        place_ids = np.unique(area_place_ids[~everywhere])
+        place_distances = np.full(len(place_ids) + 1, np.nan)
+        if len(place_ids):
+            qu = select(
+                [Place.id, func.ST_DistanceSphere(target, Place.geometry)]
+            ).where(Place.id.in_(place_ids.tolist()))
+            for place_id, meters in _db.execute(qu):
+                if meters is not None:
+                    place_distances[np.searchsorted(place_ids, place_id)] = meters
+        distance = np.where(
+            everywhere, 0.0, place_distances[np.searchsorted(place_ids, area_place_ids)]
+        )
+        distance /= 1000
+
+        for is_type, factor in (
+            (
+                self.area_is_eligibility,
+                Library.RELEVANCE_ELIGIBILITY_AREA_DISTANCE_FACTOR,
+            ),
+            (self.area_is_focus, Library.RELEVANCE_FOCUS_AREA_DISTANCE_FACTOR),
+        ):
+            of_type = is_type[areas]
+            min_distance = self.group_min(
+                self.area_library[areas][of_type], distance[of_type], self.size
+            )
+            row_score *= decrease(1.0 * factor * min_distance[rows])
+
+        # If a library was scored more than once, Library.relevant()
+        # keeps its lowest score above the threshold.
+        keep = row_score > score_threshold
+        library_score = self.group_min(rows[keep], row_score[keep], self.size)
+        scored = np.flatnonzero(~np.isnan(library_score))
+        library_ids_and_scores = {
+            int(self.library_ids[i]): float(library_score[i]) for i in scored
+        }
+
+        # Look up the Library objects and return them with the scores.
+        libraries = _db.query(Library).filter(
+            Library.id.in_(list(library_ids_and_scores.keys()))
+        )
+        c = Counter()
+        for library in libraries:
+            c[library] = library_ids_and_scores[library.id]
+        return c
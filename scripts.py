@@ -2,6 +2,7 @@ import argparse
 import json
 import logging
 import os
+import resource
 import sys
 
 import db_migration
@@ -10,10 +11,11 @@ from alembic.util import CommandError
 from authentication_document import AuthenticationDocument
 from config import Configuration
 from emailer import Emailer, EmailTemplate
-from geometry_loader import GeometryLoader
+from geometry_loader import BulkGeometryLoader, GeometryLoader
 from model import (
     ConfigurationSetting,
     ExternalIntegration,
+    Gazetteer,
     Library,
     LibraryAlias,
     Place,
@@ -122,6 +124,24 @@ class LibraryScript(Script):
 
 
 class LoadPlacesScript(Script):
+    # Commit, and empty the session, after loading this many places.
+    BATCH_SIZE = 1000
+
+    @classmethod
+    def arg_parser(cls):
+        parser = super().arg_parser()
+        parser.add_argument(
+            "--bulk",
+            help="Load all the places at once with set-based SQL. Much faster for large files.",
+            action="store_true",
+        )
+        parser.add_argument(
+            "--workers",
+            help="Number of processes to use for parsing records in bulk mode. Defaults to the number of CPUs.",
+            type=int,
+        )
+        return parser
+
     @classmethod
     def parse_command_line(cls, _db=None, cmd_args=None, stdin=sys.stdin):
         parser = cls.arg_parser()
@@ -131,17 +151,63 @@ class LoadPlacesScript(Script):
 
     def run(self, cmd_args=None, stdin=sys.stdin):
         parsed, stdin = self.parse_command_line(self._db, cmd_args, stdin)
-        loader = GeometryLoader(self._db)
+        if parsed.bulk:
+            self.load_in_bulk(stdin, parsed.workers or os.cpu_count())
+        else:
+            self.load_one_at_a_time(stdin)
+        Gazetteer.places_changed(self._db)
+        self._db.commit()
+
+        # ru_maxrss is measured in kilobytes on Linux.
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        print("Peak memory usage: %.1f MiB" % (peak / 1024))
+
+    def load_one_at_a_time(self, stdin):
+        loader = GeometryLoader(self._db, batch_size=self.BATCH_SIZE)
         a = 0
+        unchanged = 0
         for place, is_new in loader.load_ndjson(stdin):
             if is_new:
                 what = "NEW"
+            elif loader.unchanged > unchanged:
+                what = "---"
+                unchanged = loader.unchanged
             else:
                 what = "UPD"
             print(what, place)
             a += 1
-            if not a % 1000:
+            if not a % self.BATCH_SIZE:
                 self._db.commit()
+        print(
+            "%d new places, %d updated, %d unchanged."
+            % (loader.new, loader.updated, loader.unchanged)
+        )
+
+    def load_in_bulk(self, stdin, workers=1):
+        loader = BulkGeometryLoader(self._db, progress=print, workers=workers)
+        loader.load_ndjson(stdin)
+        print(
+            "Loaded %d records in %.1f sec (%.1f records/sec): %d new places, %d updated, %d unchanged."
+            % (
+                loader.records,
+                loader.elapsed,
+                loader.records / max(loader.elapsed, 0.001),
+                loader.new,
+                loader.updated,
+                loader.unchanged,
+            )
+        )
+
+
+class RebuildPlaceIndexesScript(Script):
+    """Rebuild everything derived from the Places and the libraries'
+    service areas from scratch. Useful after a full reload of the
+    places.
+    """
+
+    def run(self, cmd_args=None):
+        self.parse_command_line(self._db, cmd_args)
+        Place.update_derived_tables(self._db)
         self._db.commit()
 
 
@@ -239,10 +305,12 @@ class AddLibraryScript(Script):
                 get_one_or_create(
                     self._db, LibraryAlias, library=library, name=alias, language="eng"
                 )
+        library.update_search_document()
         if places:
             for place_external_id in places:
                 place = get_one(self._db, Place, external_id=place_external_id)
                 get_one_or_create(self._db, ServiceArea, library=library, place=place)
+            library.service_areas_changed()
         self._db.commit()
 
 
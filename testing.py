@@ -605,3 +605,21 @@ class MockPlace:
     @classmethod
     def everywhere(cls, _db):
         return cls.EVERYWHERE
+
+    @classmethod
+    def resolver(cls, _db, coverage):
+        return MockPlaceResolver(_db, cls)
+
+
+class MockPlaceResolver:
+    """Passes PlaceResolver lookups through to MockPlace."""
+
+    def __init__(self, _db, place_class):
+        self._db = _db
+        self.place_class = place_class
+
+    def lookup_one_by_name(self, name, place_type=None):
+        return self.place_class.lookup_one_by_name(self._db, name, place_type)
+
+    def lookup_inside(self, container, name):
+        return container.lookup_inside(name)
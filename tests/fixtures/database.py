@@ -18,10 +18,12 @@ from model import (
     Audience,
     Base,
     ExternalIntegration,
+    Gazetteer,
     Hyperlink,
     Library,
     Place,
     PlaceAlias,
+    SearchCache,
     ServiceArea,
     SessionManager,
     get_one_or_create,
@@ -119,6 +121,10 @@ class DatabaseTransactionFixture:
         # Create a new connection to the database.
         session = Session(database.connection)
         transaction = database.connection.begin_nested()
+        # Places and libraries created by earlier tests have been
+        # rolled back.
+        Gazetteer.invalidate()
+        SearchCache.invalidate()
         return DatabaseTransactionFixture(database, session, transaction)
 
     def close(self):
@@ -246,6 +252,8 @@ class DatabaseTransactionFixture:
         ]
         library.library_stage = library_stage
         library.registry_stage = registry_stage
+        library.service_areas_changed()
+        library.update_search_document()
         if has_email:
             library.set_hyperlink(
                 Hyperlink.INTEGRATION_CONTACT_REL, "mailto:" + name + "@library.org"
@@ -289,6 +297,7 @@ class DatabaseTransactionFixture:
             parent=parent,
         )
         place.geometry = geometry
+        Place.update_derived_tables(self.session, [place.id])
         self.session.commit()
         return place
 
@@ -11,6 +11,7 @@ from app_helpers import (
 )
 from model import Admin
 from problem_details import LIBRARY_NOT_FOUND
+from util import LazyLocation
 
 from .fixtures.controller import ControllerSetupFixture
 
@@ -55,6 +56,17 @@ class TestAppHelpers:
                     == "Called with location SRID=4326;POINT(10.0 -10.0)"
                 )
 
+            # The location isn't guessed unless the route function
+            # needs it.
+            @uses_location
+            def uninterested_route_function(_location):
+                return "Called"
+
+            resolved = LazyLocation.resolved
+            with fixture.app.test_request_context("/?_location=-10,10"):
+                assert uninterested_route_function() == "Called"
+            assert LazyLocation.resolved == resolved
+
     def test_compressible(self, controller_setup_fixture: ControllerSetupFixture):
         with controller_setup_fixture.setup() as fixture:
             # Prepare a value and a gzipped version of the value.
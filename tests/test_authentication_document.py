@@ -1,7 +1,8 @@
 from collections import defaultdict
+from unittest import mock
 
 from authentication_document import AuthenticationDocument
-from model import Audience, Place, ServiceArea
+from model import Audience, CollectionSizeStatistics, Place, ServiceArea
 from problem_details import INVALID_INTEGRATION_DOCUMENT
 from testing import MockPlace
 from tests.fixtures.database import DatabaseTransactionFixture
@@ -684,10 +685,37 @@ class TestUpdateCollectionSize:
         assert english.language == "eng"
         assert english.size == 200
 
+        # The statistics for each language were kept up to date.
+        eng = CollectionSizeStatistics.for_language(db.session, "eng")
+        assert (eng.max_size, eng.total_size, eng.libraries) == (200, 300, 2)
+
         self.update(None, db)
         # Now both collections have been removed.
         assert self.library.collections == []
 
+    def test_statistics(self, db: DatabaseTransactionFixture):
+        library = db.library()
+
+        # The statistics are refreshed once, for every language
+        # involved, after all the summaries are written.
+        with mock.patch.object(
+            CollectionSizeStatistics, "refresh", wraps=CollectionSizeStatistics.refresh
+        ) as refresh:
+            AuthenticationDocument._update_collection_size(
+                library, dict(eng=100, jpn=5)
+            )
+        [call] = refresh.call_args_list
+        assert call.args[1] == {"eng", "jpn"}
+        jpn = CollectionSizeStatistics.for_language(db.session, "jpn")
+        assert jpn.max_size == 5
+
+        # When a library stops mentioning a language, the statistics
+        # for that language are updated.
+        AuthenticationDocument._update_collection_size(library, dict(eng=100))
+        assert CollectionSizeStatistics.for_language(db.session, "jpn") is None
+        eng = CollectionSizeStatistics.for_language(db.session, "eng")
+        assert (eng.max_size, eng.total_size, eng.libraries) == (100, 100, 1)
+
     def test_single_collection(self, db: DatabaseTransactionFixture):
         self.library = db.library()
 
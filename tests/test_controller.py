@@ -4,6 +4,7 @@ import json
 import random
 from contextlib import contextmanager
 from smtplib import SMTPException
+from unittest import mock
 from urllib.parse import unquote
 
 import flask
@@ -16,6 +17,7 @@ from werkzeug.datastructures import ImmutableMultiDict, MultiDict
 from authentication_document import AuthenticationDocument
 from config import Configuration
 from controller import (
+    MVT_MEDIA_TYPE,
     AdobeVendorIDController,
     BaseController,
     CoverageController,
@@ -28,10 +30,13 @@ from model import (
     ConfigurationSetting,
     DelegatedPatronIdentifier,
     ExternalIntegration,
+    Gazetteer,
     Hyperlink,
     Library,
     Place,
+    PlaceGeoJSON,
     ServiceArea,
+    ServiceAreaTile,
     Validation,
     create,
     get_one,
@@ -46,8 +51,10 @@ from problem_details import (
     INVALID_INTEGRATION_DOCUMENT,
     LIBRARY_NOT_FOUND,
     NO_AUTH_URL,
+    TILE_NOT_FOUND,
     TIMEOUT,
     UNABLE_TO_NOTIFY,
+    UNKNOWN_RESOLUTION,
 )
 from testing import DummyHTTPClient
 from tests.fixtures.controller import (
@@ -58,6 +65,7 @@ from tests.fixtures.controller import (
 )
 from tests.fixtures.database import DatabaseTransactionFixture
 from util import GeometryUtility
+from util.cache import LRUCache
 from util.file_storage import LibraryLogoStore
 from util.http import RequestTimedOut
 from util.problem_detail import ProblemDetail
@@ -1170,6 +1178,62 @@ class TestLibraryRegistryController:
             [catalog] = catalog["catalogs"]
             assert catalog["metadata"]["title"] == "Kansas State Library"
 
+    def test_typeahead(
+        self, registry_controller_fixture: LibraryRegistryControllerFixture
+    ):
+        fixture = registry_controller_fixture
+
+        with fixture.app.test_request_context("/?q=manh"):
+            response = fixture.controller.typeahead(fixture.manhattan)
+            assert response.status == "200 OK"
+            assert response.headers["Content-Type"] == "application/json"
+            # The nearest place comes first.
+            assert json.loads(response.data) == dict(
+                completions=[
+                    dict(text="Manhattan, NY", type=Place.CITY),
+                    dict(text="Manhattan, KS", type=Place.CITY),
+                ]
+            )
+            # The results depend on a location guessed from the
+            # client's IP address, so only the client can cache them.
+            assert response.headers["Cache-Control"] == (
+                "private, no-transform, max-age=%d"
+                % fixture.controller.TYPEAHEAD_MAX_AGE
+            )
+
+        # If the location is part of the URL, or there's no location,
+        # anyone can cache the results.
+        with fixture.app.test_request_context("/?q=kan&_location=40.8056,-73.9169"):
+            response = fixture.controller.typeahead(fixture.manhattan)
+            assert json.loads(response.data) == dict(
+                completions=[
+                    dict(text="Kansas", type=Place.STATE),
+                    dict(text="Kansas State Library", type="library"),
+                ]
+            )
+            assert response.headers["Cache-Control"].startswith("public")
+        with fixture.app.test_request_context("/?q=kan"):
+            response = fixture.controller.typeahead(None)
+            assert response.headers["Cache-Control"].startswith("public")
+
+        # Nothing is suggested until the client has typed enough.
+        with fixture.app.test_request_context("/?q=k"):
+            response = fixture.controller.typeahead(None)
+            assert json.loads(response.data) == dict(completions=[])
+
+    def test_typeahead_qa(
+        self, registry_controller_fixture: LibraryRegistryControllerFixture
+    ):
+        fixture = registry_controller_fixture
+        fixture.db.kansas_state_library.registry_stage = Library.TESTING_STAGE
+        fixture.db.kansas_state_library.service_areas_changed()
+
+        for live, expect in ((True, []), (False, ["Kansas State Library"])):
+            with fixture.app.test_request_context("/?q=kansas s"):
+                response = fixture.controller.typeahead(None, live=live)
+                completions = json.loads(response.data)["completions"]
+                assert [x["text"] for x in completions] == expect
+
     def test_library(
         self, registry_controller_fixture: LibraryRegistryControllerFixture
     ):
@@ -1619,6 +1683,7 @@ class TestLibraryRegistryController:
         # .parent.
         fixture.db.new_york_city.parent = fixture.db.crude_us
         fixture.db.manhattan_ks.parent = fixture.db.crude_us
+        Gazetteer.invalidate()
 
         with fixture.app.test_request_context("/", method="POST"):
             flask.request.form = fixture.form
@@ -2079,6 +2144,9 @@ class TestLibraryRegistryController:
             assert library != None
             assert library.name == "A Library"
             assert library.description == "New and improved"
+            assert Library.search_within_description(
+                fixture.db.session, "improved", production=False
+            ).all() == [library]
             assert library.web_url is None
             assert library.logo_url.endswith(LibraryLogoStore.logo_path(library, "png"))
             # The library's library_stage has been updated to reflect
@@ -2419,8 +2487,84 @@ class TestCoverageController:
             # Creating two states with the same name is the simplest way
             # to create an ambiguity problem.
             massachussets.external_name = "Kansas"
+            Gazetteer.invalidate()
             self.parse_to(fixture, "Kansas", [], ambiguous={"US": ["Kansas"]})
 
+    def test_lookup_cache(self, controller_setup_fixture: ControllerSetupFixture):
+        with controller_setup_fixture.setup() as fixture:
+            self.controller = CoverageController(fixture.library_registry)
+            kansas = fixture.db.kansas_state
+            hits = self.controller.cache.hits
+
+            def lookup(coverage):
+                with fixture.app.test_request_context(
+                    "/", query_string=dict(coverage=coverage)
+                ):
+                    return self.controller.lookup()
+
+            # The first lookup of a coverage document does the work.
+            response = lookup('{"US": ["Kansas", "Utah"]}')
+            geojson = json.loads(response.data)
+            assert geojson.pop("unknown") == {"US": ["Utah"]}
+            assert geojson == Place.to_geojson(fixture.db.session, kansas)
+            etag = response.headers["ETag"]
+            assert "max-age" in response.headers["Cache-Control"]
+            assert self.controller.cache.hits == hits
+
+            # An equivalent document, formatted differently, is served
+            # from the cache.
+            response = lookup('{"US":["Kansas","Utah"]}')
+            assert response.headers["ETag"] == etag
+            assert self.controller.cache.hits == hits + 1
+            cached = self.controller.lookup_coverage(
+                {"US": ["Kansas", "Utah"]}, PlaceGeoJSON.FULL
+            )
+            assert self.controller.cache.hits == hits + 2
+            assert response.get_etag() == (cached.etag, False)
+            assert cached.place_ids == [kansas.id]
+            assert cached.unknown == {"US": ["Utah"]}
+
+            # A different document gets a different ETag.
+            response = lookup('{"US": "Kansas"}')
+            assert response.headers["ETag"] != etag
+
+            # The client can revalidate its copy with the ETag.
+            with fixture.app.test_request_context(
+                "/",
+                query_string=dict(coverage='{"US": ["Kansas", "Utah"]}'),
+                headers={"If-None-Match": etag},
+            ):
+                response = self.controller.lookup()
+            assert response.status_code == 304
+
+            # Once the places change, the cached results are no
+            # longer used.
+            fixture.db.place(
+                external_id="49",
+                external_name="Utah",
+                type=Place.STATE,
+                abbreviated_name="UT",
+                parent=fixture.db.crude_us,
+            )
+            response = lookup('{"US": ["Kansas", "Utah"]}')
+            geojson = json.loads(response.data)
+            assert "unknown" not in geojson
+            assert response.headers["ETag"] != etag
+
+            # The cache holds no more than CACHE_MAX_BYTES of GeoJSON,
+            # so a document bigger than that is never cached.
+            assert self.controller.cache.max_weight == self.controller.CACHE_MAX_BYTES
+            size = len(response.data)
+            with mock.patch.object(
+                self.controller,
+                "cache",
+                LRUCache(10, size - 1, lambda x: len(x.document)),
+            ):
+                lookup('{"US": ["Kansas", "Utah"]}')
+                lookup('{"US": ["Kansas", "Utah"]}')
+                assert self.controller.cache.stats()["hits"] == 0
+                assert len(self.controller.cache) == 0
+
     def test_library_eligibility_and_focus(
         self, controller_setup_fixture: ControllerSetupFixture
     ):
@@ -2476,3 +2620,103 @@ class TestCoverageController:
                 assert eligibility == Place.to_geojson(
                     fixture.db.session, fixture.db.new_york_state
                 )
+
+    def test_resolution_and_caching(
+        self, controller_setup_fixture: ControllerSetupFixture
+    ):
+        with controller_setup_fixture.setup() as fixture:
+            self.controller = CoverageController(fixture.library_registry)
+            nypl = fixture.db.library("NYPL", eligibility_areas=[fixture.db.crude_us])
+            us = fixture.db.crude_us
+
+            def eligibility(url="/", **kwargs):
+                with fixture.app.test_request_context(url, **kwargs):
+                    flask.request.library = nypl
+                    return self.controller.eligibility_for_library()
+
+            # By default, geometries are served at full resolution,
+            # along with headers that let the client cache them.
+            response = eligibility()
+            assert response.status_code == 200
+            assert json.loads(response.data) == Place.to_geojson(fixture.db.session, us)
+            etag = response.headers["ETag"]
+            assert "max-age=%d" % self.controller.MAX_AGE in (
+                response.headers["Cache-Control"]
+            )
+
+            # A client that already has the document doesn't get it again.
+            response = eligibility(headers={"If-None-Match": etag})
+            assert response.status_code == 304
+
+            # A lower resolution can be requested, and it has its own ETag.
+            response = eligibility("/?resolution=low")
+            assert response.status_code == 200
+            assert json.loads(response.data) == Place.to_geojson(
+                fixture.db.session, us, resolution=PlaceGeoJSON.LOW
+            )
+            assert response.headers["ETag"] != etag
+
+            # An unknown resolution is an error.
+            problem = eligibility("/?resolution=blurry")
+            assert problem.uri == UNKNOWN_RESOLUTION.uri
+            assert "full, high, medium, low" in str(problem.detail)
+
+            # The same goes for coverage lookups.
+            ConfigurationSetting.sitewide(
+                fixture.db.session, Configuration.DEFAULT_NATION_ABBREVIATION
+            ).value = "US"
+            kansas = fixture.db.kansas_state
+            with fixture.app.test_request_context(
+                "/?coverage=Kansas&resolution=medium"
+            ):
+                response = self.controller.lookup()
+            assert json.loads(response.data) == Place.to_geojson(
+                fixture.db.session, kansas, resolution=PlaceGeoJSON.MEDIUM
+            )
+            kansas_etag = response.headers["ETag"]
+
+            # Even if part of the coverage couldn't be understood, the
+            # response can be cached. The parts that weren't understood
+            # are part of the document, so it gets a different ETag.
+            with fixture.app.test_request_context(
+                "/?coverage=%s" % json.dumps(["KS", "UT"])
+            ):
+                response = self.controller.lookup()
+            assert json.loads(response.data)["unknown"] == {"US": ["UT"]}
+            assert response.headers["ETag"] not in (None, kansas_etag)
+            assert "max-age=%d" % self.controller.MAX_AGE in (
+                response.headers["Cache-Control"]
+            )
+
+    def test_tile(self, controller_setup_fixture: ControllerSetupFixture):
+        with controller_setup_fixture.setup() as fixture:
+            self.controller = CoverageController(fixture.library_registry)
+            fixture.db.library("NYPL", eligibility_areas=[fixture.db.new_york_state])
+            fixture.db.library(
+                "CT",
+                focus_areas=[fixture.db.connecticut_state],
+                registry_stage=Library.TESTING_STAGE,
+            )
+
+            with fixture.app.test_request_context("/"):
+                response = self.controller.tile(0, 0, 0)
+            assert response.status_code == 200
+            assert response.headers["Content-Type"] == MVT_MEDIA_TYPE
+            assert "max-age=%d" % self.controller.TILE_MAX_AGE in (
+                response.headers["Cache-Control"]
+            )
+            assert response.data == ServiceAreaTile.tile(
+                fixture.db.session, 0, 0, 0, True
+            )
+
+            # The QA version of the tile shows libraries in testing.
+            with fixture.app.test_request_context("/"):
+                response = self.controller.tile(0, 0, 0, live=False)
+            assert response.data == ServiceAreaTile.tile(
+                fixture.db.session, 0, 0, 0, False
+            )
+
+            # Asking for a tile that doesn't exist is an error.
+            with fixture.app.test_request_context("/"):
+                problem = self.controller.tile(1, 2, 0)
+            assert problem == TILE_NOT_FOUND
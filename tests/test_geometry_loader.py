@@ -1,10 +1,17 @@
+import json
 from io import StringIO
+from unittest import mock
 
 import pytest
 from sqlalchemy import func
 
-from geometry_loader import GeometryLoader
-from model import Place, PlaceAlias, get_one_or_create
+from geometry_loader import (
+    BulkGeometryLoader,
+    GeometryLoader,
+    content_hash,
+    parse_record,
+)
+from model import Place, PlaceAlias, PlaceGeoJSON, get_one_or_create
 
 from .fixtures.database import DatabaseTransactionFixture
 
@@ -72,6 +79,29 @@ class TestGeometryLoader:
         distance_qu = db.session.query().add_columns(distance_func)
         [[distance]] = distance_qu.all()
         assert int(distance / 1000) == 2637
+        assert (loader.new, loader.updated, loader.unchanged) == (2, 1, 0)
+
+        # If we load exactly the same record again, the Place is left
+        # alone.
+        new_york_2.external_name = "Modified"
+        new_york_3, is_new = loader.load(metadata, geography)
+        assert is_new is False
+        assert new_york_3 == new_york
+        assert new_york_3.external_name == "Modified"
+        assert (loader.new, loader.updated, loader.unchanged) == (2, 1, 1)
+
+    def test_content_hash(self):
+        metadata = {"id": "NY", "name": "New York", "aliases": []}
+        geometry = '{"type": "Point", "coordinates": [-75, 43]}'
+        hash = content_hash(metadata, geometry)
+
+        # The order of the metadata doesn't matter.
+        reordered = dict(reversed(list(metadata.items())))
+        assert content_hash(reordered, geometry + "\n") == hash
+
+        # But any change to the metadata or the geometry does.
+        assert content_hash(dict(metadata, name="NY"), geometry) != hash
+        assert content_hash(metadata, geometry.replace("43", "44")) != hash
 
     def test_load_ndjson(self, geometry_loader_fixture: GeometryLoaderFixture):
         db, loader = geometry_loader_fixture.db, geometry_loader_fixture.loader
@@ -137,3 +167,197 @@ class TestGeometryLoader:
         [[distance]] = db.session.query().add_columns(distance_func).all()
         print(distance)
         assert int(distance / 1000) == 276
+
+    def test_load_ndjson_in_batches(self, db: DatabaseTransactionFixture):
+        test_ndjson = """{"parent_id": null, "name": "United States", "aliases": [], "type": "nation", "abbreviated_name": "US", "id": "US"}
+{"type": "Point", "coordinates": [-159.459551, 54.948652]}
+{"parent_id": "US", "name": "Alabama", "aliases": [], "type": "state", "abbreviated_name": "AL", "id": "01"}
+{"type": "Point", "coordinates": [-88.053375, 30.506987]}
+{"parent_id": "01", "name": "Montgomery", "aliases": [], "type": "city", "abbreviated_name": null, "id": "0151000"}
+{"type": "Point", "coordinates": [-86.034128, 32.302979]}"""
+        loader = GeometryLoader(db.session, batch_size=2)
+        loaded = []
+        with mock.patch.object(
+            Place, "update_derived_tables", wraps=Place.update_derived_tables
+        ) as update_derived_tables:
+            for place, is_new in loader.load_ndjson(StringIO(test_ndjson)):
+                loaded.append(place)
+
+        # The loader only remembers the IDs of the places it loaded.
+        us, alabama, montgomery = loaded
+        assert loader.place_ids_by_external_id == {
+            "US": us.id,
+            "01": alabama.id,
+            "0151000": montgomery.id,
+        }
+
+        # The first batch was expunged from the session; the rest of
+        # the document hasn't filled up a batch yet.
+        assert us not in db.session
+        assert alabama not in db.session
+        assert montgomery in db.session
+
+        # Parents were found by ID, even after their Place objects
+        # were expunged.
+        assert montgomery.parent_id == alabama.id
+        alabama = db.session.query(Place).filter(Place.id == alabama.id).one()
+        assert alabama.parent.id == us.id
+
+        # The derived tables were brought up to date once for each
+        # batch, and once at the end of the document.
+        assert [x.args[1] for x in update_derived_tables.call_args_list] == [
+            [us.id, alabama.id],
+            [montgomery.id],
+        ]
+        documents = db.session.query(PlaceGeoJSON).filter(
+            PlaceGeoJSON.place_id.in_([alabama.id, montgomery.id])
+        )
+        assert {x.place_id for x in documents} == {alabama.id, montgomery.id}
+
+
+class TestBulkGeometryLoader:
+    def test_load_ndjson(self, db: DatabaseTransactionFixture):
+        # Create a preexisting Place with an alias.
+        old_us, is_new = get_one_or_create(
+            db.session,
+            Place,
+            parent=None,
+            external_name="United States",
+            external_id="US",
+            type="nation",
+            geometry="SRID=4326;POINT(-75 43)",
+        )
+        get_one_or_create(
+            db.session, PlaceAlias, name="USA", language="eng", place=old_us
+        )
+
+        # Alabama shows up twice. The second record wins.
+        test_ndjson = """{"parent_id": null, "name": "United States", "aliases": [{"name" : "The Good Old U. S. of A.", "language": "eng"}, {"name" : "USA", "language": "eng"}], "type": "nation", "abbreviated_name": "US", "id": "US"}
+{"type": "Point", "coordinates": [-159.459551, 54.948652]}
+{"parent_id": "US", "name": "Alabama", "aliases": [], "type": "state", "abbreviated_name": "AL", "id": "01"}
+{"type": "Point", "coordinates": [-88.053375, 30.506987]}
+{"parent_id": "01", "name": "Montgomery", "aliases": [{"name": "Montgomery\\tCity", "language": null}], "type": "city", "abbreviated_name": null, "id": "0151000"}
+{"type": "Point", "coordinates": [-86.034128, 32.302979]}
+{"parent_id": "US", "name": "Alabama", "aliases": [], "type": "state", "abbreviated_name": "ALA", "id": "01"}
+{"type": "Point", "coordinates": [-88.053375, 30.506987]}"""
+        messages = []
+        loader = BulkGeometryLoader(db.session, progress=messages.append)
+        loader.BATCH_SIZE = 2
+        place_ids = loader.load_ndjson(StringIO(test_ndjson))
+
+        # The records were sent to the database in two batches.
+        assert len(messages) == 2
+        assert messages[-1].startswith("Staged 4 records")
+        assert loader.records == 4
+        assert loader.new == 2
+        assert loader.updated == 1
+
+        us = db.session.query(Place).filter(Place.external_id == "US").one()
+        alabama = db.session.query(Place).filter(Place.external_id == "01").one()
+        montgomery = (
+            db.session.query(Place).filter(Place.external_id == "0151000").one()
+        )
+        assert sorted(place_ids) == sorted([us.id, alabama.id, montgomery.id])
+
+        # The existing place was updated in place, and the
+        # relationships between places were maintained.
+        assert us == old_us
+        assert us.abbreviated_name == "US"
+        assert us.parent is None
+        assert alabama.parent == us
+        assert alabama.abbreviated_name == "ALA"
+        assert montgomery.parent == alabama
+
+        # The preexisting alias was preserved, and a new alias added.
+        assert sorted(x.name for x in us.aliases) == [
+            "The Good Old U. S. of A.",
+            "USA",
+        ]
+        [alias] = montgomery.aliases
+        assert alias.name == "Montgomery\tCity"
+        assert alias.language is None
+
+        # The geometries were loaded.
+        distance_func = func.ST_DistanceSphere(montgomery.geometry, alabama.geometry)
+        [[distance]] = db.session.query().add_columns(distance_func).all()
+        assert int(distance / 1000) == 276
+
+        # Derived records were brought up to date.
+        assert (
+            db.session.query(PlaceGeoJSON)
+            .filter(PlaceGeoJSON.place_id == alabama.id)
+            .count()
+            > 0
+        )
+
+        # Loading the same document again doesn't touch any of the
+        # places.
+        loader = BulkGeometryLoader(db.session)
+        assert loader.load_ndjson(StringIO(test_ndjson)) == []
+        assert (loader.new, loader.updated, loader.unchanged) == (0, 0, 3)
+        assert db.session.query(Place).count() == 3
+
+        # If one record changes, only that place is rewritten.
+        changed = test_ndjson.replace("[-86.034128, 32.302979]", "[-86.3, 32.36]")
+        loader = BulkGeometryLoader(db.session)
+        assert loader.load_ndjson(StringIO(changed)) == [montgomery.id]
+        assert (loader.new, loader.updated, loader.unchanged) == (0, 1, 2)
+        db.session.refresh(montgomery)
+        distance_func = func.ST_DistanceSphere(montgomery.geometry, alabama.geometry)
+        [[new_distance]] = db.session.query().add_columns(distance_func).all()
+        assert new_distance != distance
+
+    def test_unknown_parent(self, db: DatabaseTransactionFixture):
+        test_ndjson = """{"parent_id": "01", "name": "Montgomery", "aliases": [], "type": "city", "abbreviated_name": null, "id": "0151000"}
+{"type": "Point", "coordinates": [-86.034128, 32.302979]}"""
+        loader = BulkGeometryLoader(db.session)
+        with pytest.raises(ValueError) as excinfo:
+            loader.load_ndjson(StringIO(test_ndjson))
+        assert "Place 0151000 has a parent (01) that doesn't appear before it." in str(
+            excinfo.value
+        )
+
+    def test_parse_record(self):
+        metadata = '{"parent_id": "US", "name": "Alabama", "aliases": [{"name": "Bama", "language": "eng", "extra": 1}], "type": "state", "abbreviated_name": "AL", "id": "01"}'
+        geometry = '{"type": "Point", "coordinates": [-88.053375, 30.506987]}'
+        assert parse_record(metadata, geometry) == (
+            "01",
+            "state",
+            "US",
+            "Alabama",
+            "AL",
+            '[{"name": "Bama", "language": "eng"}]',
+            geometry,
+            content_hash(json.loads(metadata), geometry),
+        )
+
+        # Records with missing information or unusable geometries are
+        # rejected.
+        with pytest.raises(ValueError) as excinfo:
+            parse_record('{"id": "01", "type": "state"}', geometry)
+        assert "Place record has no name" in str(excinfo.value)
+        for bad_geometry in ("", "[]", '{"coordinates": []}', "{not json"):
+            with pytest.raises(ValueError) as excinfo:
+                parse_record(metadata, bad_geometry)
+            assert "Place 01 has an invalid geometry." in str(excinfo.value)
+
+    def test_batches(self):
+        lines = []
+        for i in range(25):
+            lines.append(
+                '{"parent_id": null, "name": "Place %d", "type": "city", "id": "%d"}'
+                % (i, i)
+            )
+            lines.append('{"type": "Point", "coordinates": [%d, 0]}' % i)
+        text = "\n".join(lines)
+
+        # Records are parsed in batches, in order, whether or not
+        # worker processes are used.
+        for workers in (1, 3):
+            loader = BulkGeometryLoader(None, workers=workers)
+            loader.BATCH_SIZE = 10
+            batches = list(loader.batches(StringIO(text)))
+            assert [len(x) for x in batches] == [10, 10, 5]
+            assert [row[0] for batch in batches for row in batch] == [
+                str(i) for i in range(25)
+            ]
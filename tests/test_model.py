@@ -1,13 +1,16 @@
 import datetime
+import hashlib
 import json
 import random
 from unittest import mock
 
 import psycopg2
 import pytest
-from sqlalchemy import func
+from sqlalchemy import func, text
+from sqlalchemy.engine import Engine
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm.exc import MultipleResultsFound
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import MultipleResultsFound, NoResultFound
 
 from alembic.command import ensure_version
 from alembic.config import Config
@@ -17,16 +20,30 @@ from emailer import Emailer
 from model import (
     Admin,
     Audience,
+    CollectionSizeStatistics,
     CollectionSummary,
+    Completions,
     ConfigurationSetting,
     DelegatedPatronIdentifier,
     ExternalIntegration,
+    Gazetteer,
+    GazetteerEntry,
     Hyperlink,
     Library,
     LibraryAlias,
     LibraryType,
+    NameIndex,
     Place,
     PlaceAlias,
+    PlaceGeoJSON,
+    PlaceLibraryOverlap,
+    PlaceResolver,
+    PlaceSubdivision,
+    PostalCodeLibrary,
+    SearchCache,
+    ServedPlace,
+    ServiceArea,
+    ServiceAreaTile,
     Validation,
     create,
     get_one_or_create,
@@ -163,6 +180,38 @@ class TestPlace:
         for check in [db.zip_10018_geojson, db.zip_11212_geojson]:
             assert json.loads(check) in geojson["geometries"]
 
+        # At lower resolutions, the geometries are simplified.
+        us = db.crude_us
+        full = Place.to_geojson(db.session, us)
+        low = Place.to_geojson(db.session, us, resolution=PlaceGeoJSON.LOW)
+        assert full["type"] == low["type"]
+        assert len(json.dumps(low)) < len(json.dumps(full))
+
+    def test_geojson_document(self, db: DatabaseTransactionFixture):
+        zip1 = db.zip_10018
+        zip2 = db.zip_11212
+
+        # geojson_document() builds the same document as to_geojson(),
+        # without parsing it.
+        document, etag = Place.geojson_document(db.session, [zip1, zip2])
+        assert json.loads(document) == Place.to_geojson(db.session, zip1, zip2)
+
+        # The ETag depends on the places and on the resolution.
+        assert etag == Place.geojson_document(db.session, [zip1, zip2])[1]
+        assert etag != Place.geojson_document(db.session, [zip1])[1]
+        assert (
+            etag
+            != Place.geojson_document(
+                db.session, [zip1, zip2], resolution=PlaceGeoJSON.MEDIUM
+            )[1]
+        )
+
+        # A place whose GeoJSON hasn't been precomputed is still
+        # represented in the document.
+        db.session.query(PlaceGeoJSON).filter(PlaceGeoJSON.place_id == zip1.id).delete()
+        document2, etag2 = Place.geojson_document(db.session, [zip1, zip2])
+        assert (document2, etag2) == (document, etag)
+
     def test_overlaps_not_counting_border(self, db: DatabaseTransactionFixture):
         """Test that overlaps_not_counting_border does not count places
         that share a border as intersecting, the way the PostGIS
@@ -865,6 +914,19 @@ class TestLibrary:
         assert lib3 == unknown
         # Empty isn't included because we're sure it has no books in English.
 
+        # Sizes are compared against the largest collection in the
+        # language, even one that no longer belongs to a library.
+        gone = db.library("Gone Library")
+        orphan = CollectionSummary.set(gone, "eng", 1000000)
+        gone.collections.remove(orphan)
+        CollectionSizeStatistics.refresh(db.session, ["eng"])
+        statistics = CollectionSizeStatistics.for_language(db.session, "eng")
+        assert (statistics.max_size, statistics.libraries) == (1000000, 3)
+        scores = Library.relevant(db.session, (40.65, -73.94), "eng")
+        assert [x for x, score in scores.most_common()] == [large, small, unknown]
+        assert scores[small] < s2
+        assert scores[unknown] < s3
+
     def test_relevant_eligibility_area(self, db: DatabaseTransactionFixture):
         # Create two libraries. One serves New York City, and one serves
         # the entire state of Connecticut. They have the same focus area
@@ -1393,6 +1455,73 @@ class TestLibrary:
             == 1
         )
 
+    def test_search_by_postal_code(self, db: DatabaseTransactionFixture):
+        nypl = db.nypl
+        zip_11212 = db.zip_11212
+
+        def m(postal_code, **kwargs):
+            return Library.search_by_postal_code(db.session, postal_code, **kwargs)
+
+        # NYPL serves 11212 directly, and also serves New York City,
+        # which 10018 is inside.
+        db.zip_10018
+        assert m("11212").all() == [nypl]
+        assert m("10018").all() == [nypl]
+        assert m("12601").all() == []
+
+        # With a location, the distance to the postal code is also
+        # returned.
+        [(library, distance)] = m("11212", here=GeometryUtility.point(43, -70))
+        assert library == nypl
+        assert distance > 0
+
+        # This is what a location search for a postal code uses.
+        with mock.patch.object(Library, "search_by_postal_code") as search:
+            Library.search_by_location_name(db.session, "11212", Place.POSTAL_CODE)
+        search.assert_called_once_with(db.session, "11212", None, True)
+
+        # It gives the same results as comparing geometries would.
+        nypl.registry_stage = Library.TESTING_STAGE
+        for production in (True, False):
+            by_geometry = Library.search_by_location_name(
+                db.session, "11212", production=production
+            )
+            assert set(m("11212", production=production)) == set(by_geometry)
+
+    def test_near_postal_code(self, db: DatabaseTransactionFixture):
+        nypl = db.nypl
+        ct = db.connecticut_state_library
+        db.kansas_state_library
+        zip_10018 = db.zip_10018
+        zip_12601 = db.zip_12601
+
+        # Libraries that serve a postal code come first, then
+        # libraries that are nearby, ordered by distance.
+        [(first, d1), (second, d2)] = Library.near_postal_code(db.session, zip_10018)
+        assert (first, d1) == (nypl, 0)
+        assert second == ct
+        assert d2 > 0
+
+        [(first, d1), (second, d2)] = Library.near_postal_code(db.session, zip_12601)
+        assert 0 < d1 < d2
+
+        # This is what nearby() uses when it's given a postal code.
+        assert (
+            Library.nearby(db.session, zip_10018).all()
+            == Library.near_postal_code(db.session, zip_10018).all()
+        )
+        assert Library.nearby(db.session, zip_10018, max_radius=1).all() == [(nypl, 0)]
+
+        # By default, only libraries in production are found.
+        ct.registry_stage = Library.TESTING_STAGE
+        assert [x for x, d in Library.near_postal_code(db.session, zip_10018)] == [nypl]
+        assert [
+            x
+            for x, d in Library.near_postal_code(
+                db.session, zip_10018, production=False
+            )
+        ] == [nypl, ct]
+
     def test_search_within_description(self, db: DatabaseTransactionFixture):
         """Test searching for a phrase within a library's description."""
         library = db.library(
@@ -1404,6 +1533,85 @@ class TestLibrary:
         )
         assert results == [library]
 
+        def search(query):
+            return list(Library.search_within_description(db.session, query))
+
+        # Part of a word is enough.
+        assert search("purp") == [library]
+        assert search("TESTING PURP") == [library]
+
+        # But the words have to appear in the description as typed.
+        assert search("purpose of a test") == []
+        assert search("testing porposes") == []
+
+        # A description that's close to the whole search term also
+        # matches, typos and all.
+        brooklyn = db.library(name="Another Library", description="Brooklyn")
+        assert search("brook") == [brooklyn]
+        assert search("Brooklin") == [brooklyn]
+        assert search("Bruklen") == []
+
+        # Names are searched elsewhere; they don't make a description
+        # match.
+        assert search("another library") == []
+
+    def test_search_within_description_ranking(self, db: DatabaseTransactionFixture):
+        # Libraries whose descriptions match are ordered by their
+        # search documents, where a match in a library's name or alias
+        # counts for more than a match in its description.
+        in_description = db.library(
+            name="Library One",
+            description="Serving the people of Springfield.",
+            focus_areas=[db.boston_ma],
+        )
+        in_alias = db.library(
+            name="Library Two",
+            description="Serving the people of Springfield.",
+            focus_areas=[db.new_york_city],
+        )
+        get_one_or_create(
+            db.session,
+            LibraryAlias,
+            name="Springfield Branch",
+            language=None,
+            library=in_alias,
+        )
+        in_alias.update_search_document()
+        in_name = db.library(
+            name="Springfield Public Library",
+            description="Serving the people of Springfield.",
+            focus_areas=[db.kansas_state],
+        )
+
+        def search(here=None):
+            return list(
+                Library.search_within_description(db.session, "springfield", here)
+            )
+
+        assert search() == [in_name, in_alias, in_description]
+
+        # When a location is given, it only breaks ties between
+        # equally good matches.
+        assert [x[0] for x in search(GeometryUtility.point(40.7, -73.9))] == [
+            in_name,
+            in_alias,
+            in_description,
+        ]
+        for library in (in_description, in_alias):
+            library.name = "Another Library"
+            library.aliases = []
+            library.update_search_document()
+        assert [x[0] for x in search(GeometryUtility.point(40.7, -73.9))] == [
+            in_name,
+            in_alias,
+            in_description,
+        ]
+        assert [x[0] for x in search(GeometryUtility.point(42.3, -71.1))] == [
+            in_name,
+            in_description,
+            in_alias,
+        ]
+
     def test_search(self, db: DatabaseTransactionFixture):
         """Test the overall search method."""
 
@@ -1464,6 +1672,946 @@ class TestLibrary:
         [(result, distance)] = Library.search(db.session, (0, 0), "Kansas")
         assert result == library
 
+    def test_search_matches_separate_searches(self, db: DatabaseTransactionFixture):
+        # Library.search() runs one statement, but it finds the same
+        # libraries, in the same order, as running the name, location
+        # and description searches one at a time and combining them.
+        def separate_searches(target, query):
+            here = GeometryUtility.point(*target)
+            library_query, place_query, place_type = Library.query_parts(query)
+            searches = []
+            if library_query:
+                searches.append(
+                    Library.search_by_library_name(db.session, library_query, here)
+                )
+            if place_query:
+                searches.append(
+                    Library.search_by_location_name(
+                        db.session, place_query, place_type, here
+                    )
+                )
+            searches.append(Library.search_within_description(db.session, query, here))
+            combined = []
+            for qu in searches:
+                # Libraries that are equally good matches come out in
+                # order of ID.
+                for library, distance in qu.order_by(Library.id).limit(10):
+                    if library not in [x for x, ignore in combined]:
+                        combined.append((library, distance))
+            return combined
+
+        brooklyn = db.library(
+            name="Brooklyn Public Library",
+            description="Serving Brooklyn and the rest of New York.",
+            focus_areas=[db.new_york_city, db.zip_11212],
+        )
+        get_one_or_create(
+            db.session, LibraryAlias, name="BPL", language=None, library=brooklyn
+        )
+        boston = db.library(
+            name="Boston Public Library",
+            description="Serving Boston, Massachusetts.",
+            focus_areas=[db.boston_ma],
+        )
+        get_one_or_create(
+            db.session, LibraryAlias, name="BPL", language=None, library=boston
+        )
+        db.library(
+            name="New York State Library",
+            description="Serving the state of New York.",
+            focus_areas=[db.new_york_state],
+        )
+        db.library(
+            name="Kansas",
+            description="Serving Manhattan and the rest of Kansas.",
+            focus_areas=[db.kansas_state],
+        )
+        nypl = db.nypl  # noqa: F841
+        kansas_state_library = db.kansas_state_library  # noqa: F841
+        manhattan_ks = db.manhattan_ks  # noqa: F841
+
+        for target in [(40.7, -73.9), (42.3, -71.1), (39.1, -94.6)]:
+            for query in [
+                "bpl",
+                "public library",
+                "new york",
+                "new york, ny",
+                "kansas",
+                "manhattan",
+                "boston, ma",
+                "11212",
+                "serving",
+            ]:
+                expect = separate_searches(target, query)
+                actual = Library.search(db.session, target, query)
+                assert [(x.name, int(d)) for x, d in actual] == [
+                    (x.name, int(d)) for x, d in expect
+                ]
+
+    def test_similarity_threshold(self, db: DatabaseTransactionFixture):
+        # Every session sets the threshold the trigram filter in
+        # fuzzy_match() relies on, even on a connection that was set
+        # up with pg_trgm's default.
+        connection = db.session.connection()
+        connection.execute(text("SET pg_trgm.similarity_threshold = 0.3"))
+        session = Session(bind=connection)
+        threshold = session.execute(text("SHOW pg_trgm.similarity_threshold"))
+        assert float(threshold.scalar()) == Library.TRIGRAM_SIMILARITY_THRESHOLD
+        session.close()
+
+    def test_indexed_search_matches_levenshtein_search(
+        self, db: DatabaseTransactionFixture, monkeypatch
+    ):
+        # Searching with the help of the trigram indexes, or of the
+        # in-memory name indexes, finds exactly what searching with
+        # only Levenshtein distance finds.
+        brooklyn = db.library(
+            name="Brooklyn Public Library",
+            focus_areas=[db.new_york_city, db.zip_11212],
+        )
+        get_one_or_create(
+            db.session, LibraryAlias, name="Bklynlib", language=None, library=brooklyn
+        )
+        brooklyn.update_search_document()
+        db.library(name="Now Work", focus_areas=[db.kansas_state])
+        db.library(name="Boston Public Library", focus_areas=[db.boston_ma])
+        db.library(name="Denver", focus_areas=[db.kansas_state])
+        nypl = db.nypl  # noqa: F841
+        manhattan_ks = db.manhattan_ks  # noqa: F841
+
+        queries = [
+            "brooklyn public library",
+            "broklyn public library",
+            "BROOKLYN PUBLIC LIBRARIES",
+            "zklynlib",
+            "boston",
+            "new york",
+            "NEW YORM",
+            "now wrk",
+            # Two substitutions in a six-letter name leave only one
+            # trigram in common.
+            "dinvar",
+            "kansas",
+            "kanzas",
+            "manhattan",
+            "nypl",
+            "opl",
+            "11212",
+        ]
+
+        def search_all(trigrams, name_index):
+            monkeypatch.setattr(Library, "TRIGRAM_SEARCH", trigrams)
+            monkeypatch.setattr(Library, "NAME_INDEX_SEARCH", name_index)
+            return [
+                [
+                    (library.name, int(distance))
+                    for library, distance in Library.search(
+                        db.session, (40.7, -73.9), query
+                    )
+                ]
+                for query in queries
+            ]
+
+        expect = search_all(False, False)
+        assert expect[queries.index("dinvar")][0][0] == "Denver"
+        assert search_all(True, False) == expect
+        assert search_all(False, True) == expect
+
+
+class TestCompletions:
+    def test_complete(self, db: DatabaseTransactionFixture):
+        nypl = db.nypl  # noqa: F841
+        manhattan_ks = db.manhattan_ks
+        db.library(
+            "Manhattan Public Library",
+            eligibility_areas=[manhattan_ks],
+            focus_areas=[manhattan_ks],
+        )
+        db.library(
+            "Manhasset Library",
+            eligibility_areas=[db.new_york_state],
+            focus_areas=[db.new_york_state],
+            library_stage=Library.TESTING_STAGE,
+        )
+        db.library("Mannheim Library", registry_stage=Library.CANCELLED_STAGE)
+
+        def complete(prefix, target=None, production=True):
+            return [
+                (x.text, x.type)
+                for x in Completions.lookup(db.session, prefix, target, production)
+            ]
+
+        # With no location, names are in alphabetical order. Places
+        # are labeled with their state.
+        city, library = Place.CITY, Completions.LIBRARY
+        assert complete("man") == [
+            ("Manhattan Public Library", library),
+            ("Manhattan, KS", city),
+            ("Manhattan, NY", city),
+        ]
+
+        # Libraries in testing are only suggested for QA, and
+        # cancelled libraries are never suggested.
+        assert complete("manh", production=False) == [
+            ("Manhasset Library", library),
+            ("Manhattan Public Library", library),
+            ("Manhattan, KS", city),
+            ("Manhattan, NY", city),
+        ]
+
+        # With a location, the nearest names come first.
+        new_york = (40.8056, -73.9169)
+        assert complete("manha", new_york, production=False) == [
+            ("Manhattan, NY", city),
+            ("Manhasset Library", library),
+            ("Manhattan Public Library", library),
+            ("Manhattan, KS", city),
+        ]
+
+        # Case, extra spaces and the state abbreviation don't matter.
+        assert complete("  MANHATTAN,   k") == [("Manhattan, KS", city)]
+
+        # States and nations are completed without a suffix.
+        assert complete("new y") == [("New York", Place.STATE), ("New York, NY", city)]
+
+        # Postal codes aren't completed, and neither is anything
+        # shorter than the minimum.
+        assert complete("Brooklyn") == [("Brooklyn, NY", city)]
+        assert complete("11212") == []
+        assert complete("m") == []
+        assert complete("") == []
+
+    def test_cache(self, db: DatabaseTransactionFixture):
+        nypl = db.nypl
+        Completions.cache.clear()
+
+        def complete(prefix, target=None):
+            return [x.text for x in Completions.lookup(db.session, prefix, target)]
+
+        assert complete("nyp") == ["NYPL"]
+        assert Completions.stats()["misses"] == 1
+
+        # The same prefix, typed differently from nearby, is found in
+        # the cache.
+        assert complete("NYP") == ["NYPL"]
+        assert Completions.stats()["hits"] == 1
+        complete("nyp", (40.8056, -73.9169))
+        complete("nyp", (40.8051, -73.911))
+        assert Completions.stats()["hits"] == 2
+
+        # Renaming a library rebuilds the index.
+        nypl.name = "New York Public Library"
+        nypl.update_search_document()
+        assert complete("nyp") == []
+        assert complete("new york p") == ["New York Public Library"]
+
+    def test_rebuild(self, db: DatabaseTransactionFixture):
+        nypl = db.nypl
+        first = Completions.current(db.session)
+
+        # Changing a library only rebuilds the library index.
+        nypl.name = "New York Public Library"
+        nypl.update_search_document()
+        with mock.patch.object(
+            Completions, "load_places", wraps=Completions.load_places
+        ) as load_places, mock.patch.object(
+            Completions, "load_libraries", wraps=Completions.load_libraries
+        ) as load_libraries:
+            second = Completions.current(db.session)
+            assert (load_places.call_count, load_libraries.call_count) == (0, 1)
+            assert second.places is first.places
+            assert second.libraries is not first.libraries
+
+            # Reloading the places only rebuilds the place index.
+            Gazetteer.places_changed(db.session)
+            third = Completions.current(db.session)
+            assert (load_places.call_count, load_libraries.call_count) == (1, 1)
+            assert third.libraries is second.libraries
+
+            # Nothing is rebuilt if nothing has changed.
+            assert Completions.current(db.session) is third
+            assert (load_places.call_count, load_libraries.call_count) == (1, 1)
+
+    def test_rebuild_in_background(self, db: DatabaseTransactionFixture):
+        nypl = db.nypl
+
+        # The test database session is tied to a single connection, so
+        # it can't be used to rebuild the Completions in the background.
+        assert Completions.engine(db.session) is None
+        old = Completions.current(db.session)
+        nypl.update_search_document()
+
+        # When there's an engine to use, newer Completions are built
+        # in another thread, and the old ones are used until they're
+        # ready.
+        engine = mock.create_autospec(Engine, instance=True)
+        new = Completions(old.places, old.libraries, (None, None))
+        with mock.patch.object(Completions, "engine", return_value=engine), mock.patch(
+            "model.Thread"
+        ) as thread:
+            assert Completions.current(db.session) is old
+            [call] = thread.call_args_list
+            thread.return_value.start.assert_called_once()
+
+            # Only one thread is started at a time.
+            assert Completions.current(db.session) is old
+            assert thread.call_count == 1
+
+            with mock.patch.object(
+                Completions, "load", return_value=new
+            ) as load, mock.patch("model.Session") as session:
+                call.kwargs["target"]()
+            session.assert_called_once_with(bind=engine)
+            assert load.call_args.args[-1] is old
+        assert Completions._current is new
+        assert Completions._rebuilding is False
+
+
+class TestPlaceResolver:
+    def test_lookups(self, db: DatabaseTransactionFixture):
+        us = db.crude_us
+        zip_10018 = db.zip_10018
+        nyc = db.new_york_city
+        new_york = db.new_york_state
+        connecticut = db.connecticut_state
+        manhattan_ks = db.manhattan_ks
+        kings_county = db.crude_kings_county
+        zip_12601 = db.zip_12601
+
+        names = [
+            "NY",
+            "10018",
+            "10018, NY",
+            "New York",
+            "New York, NY",
+            "New York State",
+            "Kings County, NY",
+            "Manhattan, KS",
+            "Manhattan, Kansas",
+            "NY, 10018",
+            "Poughkeepsie, NY",
+            "Manhattan",
+            "Nowhere",
+        ]
+        resolver = PlaceResolver(db.session, {"US": names})
+
+        # Every Place that was found was loaded up front, including
+        # the postal code that stands in for Poughkeepsie.
+        assert set(resolver.places.values()) == {
+            us,
+            new_york,
+            zip_10018,
+            nyc,
+            kings_county,
+            manhattan_ks,
+            zip_12601,
+        }
+
+        # The resolver gets the same answers as lookup_inside().
+        assert resolver.lookup_one_by_name("US", place_type=Place.NATION) == us
+        for name in names:
+            assert resolver.lookup_inside(us, name) == us.lookup_inside(name)
+        for place, name, expect in [
+            (new_york, "10018", zip_10018),
+            (new_york, "New York", nyc),
+            (new_york, "Poughkeepsie", zip_12601),
+            (new_york, "Manhattan, KS", None),
+            (connecticut, "New York", None),
+            (connecticut, "10018", None),
+            (kings_county, "NY", None),
+            (zip_10018, "NY", None),
+        ]:
+            assert resolver.lookup_inside(place, name) == expect
+        assert resolver.lookup_inside(us, "Kings County, NY") == kings_county
+        assert resolver.lookup_inside(us, "Manhattan, KS") == manhattan_ks
+
+        # Ambiguous and unknown names are handled the same way as
+        # lookup_one_by_name() and lookup_inside() handle them.
+        db.place(external_name="Manhattan", type=Place.CITY, parent=new_york)
+        resolver = PlaceResolver(db.session, {"US": ["Manhattan"]})
+        with pytest.raises(MultipleResultsFound) as exc:
+            resolver.lookup_inside(Place.everywhere(db.session), "Manhattan")
+        assert "More than one place called Manhattan inside Everywhere." in str(
+            exc.value
+        )
+        with pytest.raises(NoResultFound):
+            resolver.lookup_one_by_name("Nowhere")
+
+
+class TestNameIndex:
+    def test_matches(self):
+        index = NameIndex(
+            [(1, "Denver Public Library"), (2, "Denver"), (3, "NYPL"), (3, "New York")]
+        )
+
+        # Short names only match exactly, apart from case.
+        assert index.matches("nypl") == {3}
+        assert index.matches("NyPL") == {3}
+        assert index.matches("NYP") == set()
+
+        # Long names also match within a small Levenshtein distance,
+        # whatever the case of the value.
+        assert index.matches("denver") == {2}
+        assert index.matches("Dinvar") == {2}
+        assert index.matches("DENVER PUBLIC LIBRARY") == {1}
+        assert index.matches("Denver Pubic Library") == {1}
+        assert index.matches("NEW YORKK") == {3}
+
+
+class TestGazetteer:
+    def test_current(self, db: DatabaseTransactionFixture):
+        new_york = db.new_york_state
+        gazetteer = Gazetteer.current(db.session)
+        assert gazetteer.lookup_one_by_name("NY").id == new_york.id
+
+        # The same Gazetteer is used until something changes.
+        assert Gazetteer.current(db.session) is gazetteer
+
+        # Creating a Place invalidates the Gazetteer for this process.
+        connecticut = db.connecticut_state
+        gazetteer2 = Gazetteer.current(db.session)
+        assert gazetteer2 is not gazetteer
+        assert gazetteer2.lookup_one_by_name("CT").id == connecticut.id
+
+        # So does changing the default nation.
+        setting = ConfigurationSetting.sitewide(
+            db.session, Configuration.DEFAULT_NATION_ABBREVIATION
+        )
+        setting.value = "US"
+        assert Gazetteer.current(db.session) is not gazetteer2
+
+        # Another process signals that it has changed the Places by
+        # updating a sitewide setting. This process notices the next
+        # time it checks.
+        gazetteer3 = Gazetteer.current(db.session)
+        db.session.query(ConfigurationSetting).filter(
+            ConfigurationSetting.key == Configuration.PLACES_LAST_UPDATE
+        ).delete()
+        db.session.execute(
+            ConfigurationSetting.__table__.insert().values(
+                key=Configuration.PLACES_LAST_UPDATE, value="later"
+            )
+        )
+        assert Gazetteer.current(db.session) is gazetteer3
+        Gazetteer._checked -= Gazetteer.CHECK_INTERVAL
+        assert Gazetteer.current(db.session) is not gazetteer3
+
+        # places_changed() both updates that setting and invalidates
+        # the Gazetteer for this process.
+        gazetteer4 = Gazetteer.current(db.session)
+        Gazetteer.places_changed(db.session)
+        assert (
+            ConfigurationSetting.sitewide(
+                db.session, Configuration.PLACES_LAST_UPDATE
+            ).value
+            != "later"
+        )
+        assert Gazetteer.current(db.session) is not gazetteer4
+
+    def test_lookups(self, db: DatabaseTransactionFixture):
+        us = db.crude_us
+        new_york = db.new_york_state
+        nyc = db.new_york_city
+        zip_10018 = db.zip_10018
+        kings_county = db.crude_kings_county
+        everywhere = Place.everywhere(db.session)
+        gazetteer = Gazetteer.current(db.session)
+
+        assert gazetteer.everywhere.id == everywhere.id
+
+        # Places can be found by name, abbreviation, or alias.
+        for name in ("New York", "NY"):
+            assert new_york.id in [x.id for x in gazetteer.named(name)]
+        assert [x.id for x in gazetteer.named("Brooklyn")] == [nyc.id]
+        assert [x.id for x in gazetteer.named("Brooklyn", Place.COUNTY)] == []
+
+        # Counties must be asked for explicitly.
+        assert [x.id for x in gazetteer.named("Kings")] == []
+        assert [x.id for x in gazetteer.named("Kings County")] == [kings_county.id]
+
+        # Postal codes are inside their state, and also inside the
+        # state's nation.
+        assert gazetteer.is_inside(gazetteer.entries[zip_10018.id], new_york)
+        assert gazetteer.is_inside(gazetteer.entries[zip_10018.id], us)
+        assert not gazetteer.is_inside(gazetteer.entries[nyc.id], us)
+
+        # lookup_inside() works on entries as well as Places, and
+        # returns entries.
+        ny_entry = gazetteer.lookup_inside(us, "NY")
+        assert ny_entry.id == new_york.id
+        assert gazetteer.lookup_inside(ny_entry, "New York").id == nyc.id
+
+        # Looking up Places doesn't need the Gazetteer to go to the
+        # database.
+        with mock.patch.object(Gazetteer, "load") as load:
+            assert us.lookup_inside("New York, NY") == nyc
+            assert Place.lookup_one_by_name(db.session, "NY") == new_york
+            assert Place.everywhere(db.session) == everywhere
+        assert load.call_count == 0
+
+        # If a Place has vanished, the Gazetteer is out of date.
+        entry = GazetteerEntry(-1, Place.CITY, "Nowhere", None, None)
+        assert Gazetteer.place(db.session, entry) is None
+        assert Gazetteer._current is None
+
+
+class TestSearchCache:
+    def test_cell(self):
+        # Locations are moved to the center of a grid cell.
+        assert SearchCache.cell((40.8056, -73.9169)) == (40.805, -73.915)
+        assert SearchCache.cell(GeometryUtility.point(40.8056, -73.9169)) == (
+            40.805,
+            -73.915,
+        )
+        assert SearchCache.cell((-0.001, 0)) == (-0.005, 0.005)
+        assert SearchCache.cell("not a point") is None
+
+    def test_search(self, db: DatabaseTransactionFixture):
+        nypl = db.nypl
+        kansas = db.kansas_state_library
+        manhattan_ks = db.manhattan_ks  # noqa: F841
+        SearchCache.cache.clear()
+
+        here = (40.8056, -73.9169)
+        expect = Library.search(db.session, SearchCache.cell(here), "manhattan")
+        assert [x[0] for x in expect] == [nypl, kansas]
+        assert SearchCache.search(db.session, here, "manhattan") == expect
+        assert SearchCache.stats()["misses"] == 1
+
+        # Searching again, for the same thing spelled differently,
+        # from nearby, finds the results in the cache.
+        assert SearchCache.search(db.session, (40.8051, -73.911), " MANHATTAN ") == (
+            expect
+        )
+        assert SearchCache.stats()["hits"] == 1
+
+        # Searching from farther away, or for libraries in testing,
+        # or with no location, is a different search.
+        SearchCache.search(db.session, (40.7, -73.9), "manhattan")
+        SearchCache.search(db.session, here, "manhattan", production=False)
+        assert SearchCache.search(db.session, None, "manhattan") == [nypl, kansas]
+        assert SearchCache.stats()["misses"] == 4
+
+        assert SearchCache.search(db.session, here, "") == []
+
+    def test_invalidation(self, db: DatabaseTransactionFixture):
+        nypl = db.nypl
+        here = (40.8056, -73.9169)
+
+        def search(query):
+            return [x for x, distance in SearchCache.search(db.session, here, query)]
+
+        assert search("nypl") == [nypl]
+        assert search("brooklyn public") == []
+
+        # Changing a library's name updates its search document and
+        # invalidates the cache.
+        nypl.name = "Brooklyn Public Library"
+        nypl.update_search_document()
+        assert search("brooklyn public") == [nypl]
+
+        # So does changing its stage.
+        nypl.registry_stage = Library.TESTING_STAGE
+        nypl.service_areas_changed()
+        assert search("brooklyn public") == []
+
+        # Another process signals that it has changed a library by
+        # updating a sitewide setting. This process notices the next
+        # time it checks.
+        nypl.registry_stage = Library.PRODUCTION_STAGE
+        db.session.flush()
+        assert search("brooklyn public") == []
+        db.session.query(ConfigurationSetting).filter(
+            ConfigurationSetting.key == Configuration.LIBRARIES_LAST_UPDATE
+        ).delete()
+        db.session.execute(
+            ConfigurationSetting.__table__.insert().values(
+                key=Configuration.LIBRARIES_LAST_UPDATE, value="later"
+            )
+        )
+        assert search("brooklyn public") == []
+        SearchCache._checked -= SearchCache.CHECK_INTERVAL
+        assert search("brooklyn public") == [nypl]
+
+        # Reloading the Places also invalidates the cache.
+        search("manhattan")
+        misses = SearchCache.stats()["misses"]
+        search("manhattan")
+        assert SearchCache.stats()["misses"] == misses
+        Gazetteer.places_changed(db.session)
+        search("manhattan")
+        assert SearchCache.stats()["misses"] == misses + 1
+
+
+class TestPlaceSubdivision:
+    def test_refresh(self, db: DatabaseTransactionFixture):
+        new_york = db.new_york_state
+
+        def pieces(place):
+            return (
+                db.session.query(PlaceSubdivision)
+                .filter(PlaceSubdivision.place_id == place.id)
+                .all()
+            )
+
+        # Creating a place subdivides its geometry.
+        new_york_pieces = pieces(new_york)
+        assert len(new_york_pieces) > 0
+
+        # No piece has more than the maximum number of vertices, and
+        # together the pieces make up the whole place.
+        for piece in new_york_pieces:
+            [[vertices]] = (
+                db.session.query().add_columns(func.ST_NPoints(piece.geometry)).all()
+            )
+            assert vertices <= PlaceSubdivision.MAX_VERTICES
+        union = func.ST_Union(PlaceSubdivision.geometry)
+        [[difference]] = (
+            db.session.query(PlaceSubdivision)
+            .filter(PlaceSubdivision.place_id == new_york.id)
+            .with_entities(
+                func.ST_Area(func.ST_SymDifference(union, new_york.geometry))
+            )
+            .all()
+        )
+        assert difference < 0.000001
+
+        # When a place's geometry changes, its pieces are replaced.
+        new_york.geometry = "SRID=4326;POINT(-75 43)"
+        PlaceSubdivision.refresh(db.session, [new_york.id])
+        [piece] = pieces(new_york)
+        [[distance]] = (
+            db.session.query()
+            .add_columns(func.ST_Distance(piece.geometry, new_york.geometry))
+            .all()
+        )
+        assert distance == 0
+
+        # A place with no geometry has no pieces.
+        new_york.geometry = None
+        PlaceSubdivision.refresh(db.session, [new_york.id])
+        assert pieces(new_york) == []
+
+    def test_intersects(self, db: DatabaseTransactionFixture):
+        nyc = db.new_york_city
+        new_york = db.new_york_state
+        connecticut = db.connecticut_state
+
+        def intersects(place1, place2, not_counting_border):
+            clause = PlaceSubdivision.intersects(
+                place1.id, place2.id, not_counting_border=not_counting_border
+            )
+            [[result]] = db.session.query().add_columns(clause).all()
+            return result
+
+        # Places that contain each other intersect.
+        assert intersects(nyc, new_york, True) is True
+        assert intersects(new_york, nyc, False) is True
+
+        # Places that are far apart don't.
+        assert intersects(nyc, connecticut, False) is False
+
+        # New York and Connecticut share a border, which only counts
+        # if we say it does.
+        assert intersects(new_york, connecticut, False) is True
+        assert intersects(new_york, connecticut, True) is False
+
+
+class TestPlaceGeoJSON:
+    def test_refresh(self, db: DatabaseTransactionFixture):
+        zip = db.zip_10018
+
+        def fragments():
+            return {
+                x.resolution: x
+                for x in db.session.query(PlaceGeoJSON).filter(
+                    PlaceGeoJSON.place_id == zip.id
+                )
+            }
+
+        # Creating a place generates GeoJSON at every resolution.
+        by_resolution = fragments()
+        assert set(by_resolution) == set(PlaceGeoJSON.RESOLUTIONS)
+        full = by_resolution[PlaceGeoJSON.FULL]
+        assert json.loads(full.geojson) == json.loads(db.zip_10018_geojson)
+        assert full.digest == hashlib.md5(full.geojson.encode("utf8")).hexdigest()
+
+        # Lower resolutions mean fewer decimal places.
+        low = by_resolution[PlaceGeoJSON.LOW]
+        assert len(low.geojson) < len(full.geojson)
+
+        # When a place's geometry changes, its GeoJSON is regenerated.
+        zip.geometry = "SRID=4326;POINT(-75 43)"
+        PlaceGeoJSON.refresh(db.session, [zip.id])
+        db.session.expire_all()
+        full = fragments()[PlaceGeoJSON.FULL]
+        assert json.loads(full.geojson) == {"type": "Point", "coordinates": [-75, 43]}
+
+        # A place with no geometry has no GeoJSON.
+        zip.geometry = None
+        PlaceGeoJSON.refresh(db.session, [zip.id])
+        assert fragments() == {}
+
+
+class TestServedPlace:
+    def test_refresh(self, db: DatabaseTransactionFixture):
+        nyc = db.new_york_city
+        connecticut = db.connecticut_state
+        kansas = db.kansas_state
+
+        def served():
+            return {
+                x.place_id: (x.in_production_feed, x.in_testing_feed)
+                for x in db.session.query(ServedPlace)
+            }
+
+        # Places that aren't part of any service area aren't served.
+        assert served() == {}
+
+        # Creating a library with service areas creates ServedPlaces.
+        nypl = db.library("NYPL", eligibility_areas=[nyc])
+        ct = db.library(
+            "CT", focus_areas=[connecticut], registry_stage=Library.TESTING_STAGE
+        )
+        assert served() == {nyc.id: (True, True), connecticut.id: (False, True)}
+
+        # The geometry of a served place is a copy of the Place's geometry.
+        [served_nyc] = db.session.query(ServedPlace).filter(
+            ServedPlace.place_id == nyc.id
+        )
+        [[distance]] = (
+            db.session.query()
+            .add_columns(func.ST_Distance(served_nyc.geometry, nyc.geometry))
+            .all()
+        )
+        assert distance == 0
+
+        # When a library's stage changes, the feeds its service areas
+        # show up in change.
+        ct.registry_stage = Library.PRODUCTION_STAGE
+        ct.service_areas_changed()
+        assert served()[connecticut.id] == (True, True)
+
+        # A place that's only served by a cancelled library doesn't
+        # show up in any feed, so it's not a ServedPlace.
+        ct.registry_stage = Library.CANCELLED_STAGE
+        ct.service_areas_changed()
+        assert connecticut.id not in served()
+
+        # When a library stops serving a place, the place is no longer
+        # served, assuming no one else serves it.
+        old_place_ids = [x.place_id for x in nypl.service_areas]
+        get_one_or_create(db.session, ServiceArea, library=nypl, place=kansas)
+        nypl.service_areas = [x for x in nypl.service_areas if x.place == kansas]
+        nypl.service_areas_changed(old_place_ids)
+        assert served() == {kansas.id: (True, True)}
+
+        # refresh() with no arguments rebuilds everything.
+        db.session.query(ServedPlace).delete()
+        ServedPlace.refresh(db.session)
+        assert served() == {kansas.id: (True, True)}
+
+
+class TestPlaceLibraryOverlap:
+    def test_refresh(self, db: DatabaseTransactionFixture):
+        new_york = db.new_york_state
+        connecticut = db.connecticut_state
+        nyc = db.new_york_city
+        ct = db.library("CT", eligibility_areas=[connecticut])
+
+        # This place is created after the library.
+        zip = db.zip_10018
+
+        def overlaps(library):
+            return {
+                x.place_id: x.overlap_type
+                for x in db.session.query(PlaceLibraryOverlap).filter(
+                    PlaceLibraryOverlap.library_id == library.id
+                )
+            }
+
+        # Connecticut overlaps itself and the nation it's in. It
+        # shares a border with New York State, but has nothing to do
+        # with New York City or the postal code.
+        by_place = overlaps(ct)
+        assert by_place[connecticut.id] == PlaceLibraryOverlap.INTERIOR
+        assert by_place[db.crude_us.id] == PlaceLibraryOverlap.INTERIOR
+        assert by_place[new_york.id] == PlaceLibraryOverlap.BORDER
+        assert nyc.id not in by_place
+        assert zip.id not in by_place
+
+        # When the library's service areas change, so do the overlaps.
+        old_place_ids = [x.place_id for x in ct.service_areas]
+        ct.service_areas = [ServiceArea(place=nyc, type=ServiceArea.ELIGIBILITY)]
+        ct.service_areas_changed(old_place_ids)
+        by_place = overlaps(ct)
+        assert by_place[zip.id] == PlaceLibraryOverlap.INTERIOR
+        assert connecticut.id not in by_place
+
+
+class TestPostalCodeLibrary:
+    def test_refresh(self, db: DatabaseTransactionFixture):
+        # This postal code exists before any libraries do.
+        zip_10018 = db.zip_10018
+
+        nypl = db.library("NYPL", eligibility_areas=[db.new_york_city])
+        ct = db.library("CT", eligibility_areas=[db.connecticut_state])
+        ks = db.library("KS", eligibility_areas=[db.kansas_state])
+
+        # This one is created after the libraries.
+        zip_12601 = db.zip_12601
+
+        def records(postal_code):
+            return {
+                x.library_id: (x.serves, x.distance)
+                for x in db.session.query(PostalCodeLibrary).filter(
+                    PostalCodeLibrary.place_id == postal_code.id
+                )
+            }
+
+        # NYPL serves 10018, and Connecticut is nearby. Kansas is
+        # much too far away.
+        by_library = records(zip_10018)
+        assert set(by_library) == {nypl.id, ct.id}
+        assert by_library[nypl.id] == (True, 0)
+        serves, distance = by_library[ct.id]
+        assert serves is False
+        assert 0 < distance < PostalCodeLibrary.NEARBY_RADIUS * 1000
+
+        # No one serves 12601, but it's close to both NYPL and CT.
+        by_library = records(zip_12601)
+        assert set(by_library) == {nypl.id, ct.id}
+        assert not any(serves for serves, distance in by_library.values())
+
+        # If NYPL starts serving 12601, the records are brought up to date.
+        old_place_ids = [x.place_id for x in nypl.service_areas]
+        nypl.service_areas = [
+            ServiceArea(place=zip_12601, type=ServiceArea.ELIGIBILITY)
+        ]
+        nypl.service_areas_changed(old_place_ids)
+        assert records(zip_12601)[nypl.id] == (True, 0)
+        assert records(zip_10018)[nypl.id][0] is False
+
+        # Only the records for postal codes near a place the library
+        # started or stopped serving are rebuilt. If the library's
+        # service area didn't change, nothing is.
+        db.session.query(PostalCodeLibrary).filter(
+            PostalCodeLibrary.place_id == zip_10018.id,
+            PostalCodeLibrary.library_id == nypl.id,
+        ).delete()
+        nypl.service_areas_changed([zip_12601.id])
+        assert nypl.id not in records(zip_10018)
+        PostalCodeLibrary.refresh(
+            db.session, library_ids=[nypl.id], served_place_ids=[db.kansas_state.id]
+        )
+        assert nypl.id not in records(zip_10018)
+        PostalCodeLibrary.refresh(
+            db.session, library_ids=[nypl.id], served_place_ids=[zip_12601.id]
+        )
+        assert records(zip_10018)[nypl.id][0] is False
+
+        # refresh() with no arguments rebuilds everything.
+        db.session.query(PostalCodeLibrary).delete()
+        PostalCodeLibrary.refresh(db.session)
+        assert set(records(zip_12601)) == {nypl.id, ct.id}
+        assert ks.id not in records(zip_10018)
+
+
+class TestServiceAreaTile:
+    def test_is_valid(self):
+        m = ServiceAreaTile.is_valid
+        assert m(0, 0, 0) is True
+        assert m(2, 3, 3) is True
+        assert m(2, 4, 3) is False
+        assert m(2, 3, -1) is False
+        assert m(-1, 0, 0) is False
+        assert m(ServiceAreaTile.MAX_ZOOM + 1, 0, 0) is False
+
+    def test_tile_range(self):
+        m = ServiceAreaTile.tile_range
+        world = (-180, -90, 180, 90)
+        assert m(0, world) == (0, 0, 0, 0)
+        assert m(1, world) == (0, 0, 1, 1)
+        assert m(2, world) == (0, 0, 3, 3)
+
+        # Rows are numbered from north to south.
+        assert m(1, (-100, 30, -90, 40)) == (0, 0, 0, 0)
+        assert m(1, (100, -40, 110, -30)) == (1, 1, 1, 1)
+        assert m(4, (-74, 40.7, -74, 40.7)) == (4, 6, 4, 6)
+
+    def test_tile(self, db: DatabaseTransactionFixture):
+        db.library(
+            "NYPL", eligibility_areas=[db.new_york_state], focus_areas=[db.zip_10018]
+        )
+        ct = db.library(
+            "CT",
+            focus_areas=[db.connecticut_state],
+            registry_stage=Library.TESTING_STAGE,
+        )
+        db.library("KS", focus_areas=[db.kansas_state])
+
+        def cached():
+            return db.session.query(ServiceAreaTile).count()
+
+        # The whole world fits in a single tile at zoom level 0. It
+        # shows NYPL's areas, but not CT's, since CT isn't in
+        # production.
+        assert cached() == 0
+        production = ServiceAreaTile.tile(db.session, 0, 0, 0, True)
+        assert len(production) > 0
+        assert cached() == 1
+
+        # The testing feed gets its own tile, which shows more areas.
+        testing = ServiceAreaTile.tile(db.session, 0, 0, 0, False)
+        assert len(testing) > len(production)
+        assert cached() == 2
+
+        # The second time a tile is requested, it comes from the cache.
+        with mock.patch.object(ServiceAreaTile, "draw") as draw:
+            assert ServiceAreaTile.tile(db.session, 0, 0, 0, True) == production
+            draw.assert_not_called()
+
+        # A tile that doesn't cover any service area is empty, and
+        # isn't cached.
+        assert ServiceAreaTile.tile(db.session, 2, 3, 3, True) == b""
+        assert cached() == 2
+
+        # Neither are tiles more detailed than MAX_CACHED_ZOOM.
+        z = ServiceAreaTile.MAX_CACHED_ZOOM + 1
+        x, y = ServiceAreaTile.tile_range(z, (-98, 38.5, -98, 38.5))[:2]
+        assert len(ServiceAreaTile.tile(db.session, z, x, y, True)) > 0
+        assert cached() == 2
+
+        # This tile shows Kansas, but not New York or Connecticut.
+        x, y = ServiceAreaTile.tile_range(4, (-98, 38.5, -98, 38.5))[:2]
+        kansas = ServiceAreaTile.tile(db.session, 4, x, y, True)
+        assert len(kansas) > 0
+        assert cached() == 3
+
+        # When service areas change, the tiles that show them are
+        # thrown away, but other tiles are kept.
+        ct.registry_stage = Library.PRODUCTION_STAGE
+        ct.service_areas_changed()
+        assert [(t.z, t.x, t.y) for t in db.session.query(ServiceAreaTile)] == [
+            (4, x, y)
+        ]
+        new_production = ServiceAreaTile.tile(db.session, 0, 0, 0, True)
+        assert len(new_production) > len(production)
+
+        # A tile that's been cached for too long is drawn again.
+        db.session.query(ServiceAreaTile).update(
+            {
+                ServiceAreaTile.created: datetime.datetime.utcnow()
+                - ServiceAreaTile.MAX_AGE
+            }
+        )
+        with mock.patch.object(ServiceAreaTile, "draw", return_value=b"new") as draw:
+            assert ServiceAreaTile.tile(db.session, 4, x, y, True) == b"new"
+            draw.assert_called_once()
+
+        # Expired tiles are thrown away when a new tile is cached.
+        assert [t.data for t in db.session.query(ServiceAreaTile)] == [b"new"]
+
 
 class TestCollectionSummary:
     def test_set(self, db: DatabaseTransactionFixture):
@@ -1499,6 +2647,45 @@ class TestCollectionSummary:
         assert "Collection size cannot be negative." in str(exc.value)
 
 
+class TestCollectionSizeStatistics:
+    def test_refresh(self, db: DatabaseTransactionFixture):
+        def statistics(language):
+            x = CollectionSizeStatistics.for_language(db.session, language)
+            if x is None:
+                return None
+            return (x.max_size, x.total_size, x.libraries)
+
+        # Setting a collection size keeps the statistics up to date.
+        library1 = db.library()
+        library2 = db.library()
+        CollectionSummary.set(library1, "eng", 100)
+        CollectionSummary.set(library2, "eng", 50)
+        CollectionSummary.set(library2, "spa", 10)
+        CollectionSummary.set(library2, "mmmmmm", 1000)
+        assert statistics("eng") == (100, 150, 2)
+        assert statistics("spa") == (10, 10, 1)
+        assert statistics("fre") is None
+        assert statistics(None) is None
+
+        CollectionSummary.set(library1, "eng", 20)
+        assert statistics("eng") == (50, 70, 2)
+
+        # A collection that no longer belongs to a library still
+        # counts towards the largest collection in its language, as it
+        # always has for Library.relevant(), but not towards anything
+        # else.
+        [spanish] = [x for x in library2.collections if x.language == "spa"]
+        library2.collections.remove(spanish)
+        CollectionSizeStatistics.refresh(db.session, ["spa"])
+        assert statistics("spa") == (10, 0, 0)
+
+        # Refreshing everything gives the same results.
+        CollectionSizeStatistics.refresh(db.session)
+        assert statistics("eng") == (50, 70, 2)
+        assert statistics("spa") == (10, 0, 0)
+        assert db.session.query(CollectionSizeStatistics).count() == 2
+
+
 class TestAudience:
     def test_unrecognized_audience(self, db: DatabaseTransactionFixture):
         with pytest.raises(ValueError) as exc:
@@ -352,3 +352,35 @@ class TestRegistrar:
         assert type(args[0][1]) == BytesIO
 
         assert library.logo_url == "http://localhost/logo"
+
+    def test_register_stage_change(self, db: DatabaseTransactionFixture):
+        # This document doesn't say anything about the library's
+        # coverage, so its service areas are left alone.
+        library: Library = db.library(registry_stage=Library.TESTING_STAGE)
+        library.authentication_url = "http://auth"
+        registrar = LibraryRegistrar(db.session)
+        registrar._make_request = MagicMock(
+            return_value=mock_response(
+                200,
+                self._auth_document(),
+                url="http://auth",
+                headers={"Content-Type": OPDSCatalog.OPDS_1_TYPE},
+            )
+        )
+
+        def register(library_stage):
+            with patch(
+                "registrar.LibraryRegistrar.opds_response_links_to_auth_document",
+                return_value=True,
+            ), patch.object(Library, "service_areas_changed") as changed:
+                registrar.register(library, library_stage)
+            return changed.call_count
+
+        # When the library's stage changes, the tables derived from its
+        # service areas are refreshed, since the areas now show up in
+        # different feeds.
+        assert register(Library.TESTING_STAGE) == 1
+        assert library.library_stage == Library.TESTING_STAGE
+
+        # Registering again in the same stage doesn't refresh them.
+        assert register(Library.TESTING_STAGE) == 0
@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+
+from model import (
+    Audience,
+    CollectionSizeStatistics,
+    CollectionSummary,
+    Library,
+    Place,
+)
+from relevance import RelevanceEngine
+
+from .fixtures.database import DatabaseTransactionFixture
+
+
+class TestRelevanceEngine:
+    def test_relevant_matches_library_relevant(self, db: DatabaseTransactionFixture):
+        everywhere = Place.everywhere(db.session)
+        nypl = db.library(
+            "New York Public Library",
+            eligibility_areas=[db.new_york_city],
+            focus_areas=[db.new_york_city, db.zip_11212],
+        )
+        CollectionSummary.set(nypl, "eng", 100000)
+        CollectionSummary.set(nypl, "spa", 500)
+        research = db.library(
+            "Research",
+            eligibility_areas=[db.new_york_state, db.connecticut_state],
+            focus_areas=[db.new_york_city],
+            audiences=[Audience.PUBLIC, Audience.RESEARCH],
+        )
+        CollectionSummary.set(research, "eng", 10)
+        school = db.library(
+            "School",
+            eligibility_areas=[db.connecticut_state],
+            focus_areas=[db.connecticut_state],
+            audiences=[Audience.EDUCATIONAL_PRIMARY],
+        )
+        CollectionSummary.set(school, "eng", 0)
+        db.library(
+            "Kansas",
+            eligibility_areas=[db.kansas_state],
+            focus_areas=[db.kansas_state],
+        )
+        db.library(
+            "Universal",
+            eligibility_areas=[everywhere],
+            focus_areas=[everywhere],
+        )
+        db.library(
+            "Testing",
+            eligibility_areas=[db.new_york_city],
+            focus_areas=[db.new_york_city],
+            library_stage=Library.TESTING_STAGE,
+        )
+        # No focus area, so this library is never scored.
+        db.library("No focus area", eligibility_areas=[db.new_york_city])
+
+        # This Spanish collection no longer belongs to a library, but
+        # it's still the largest one.
+        gone = db.library("Gone")
+        orphan = CollectionSummary.set(gone, "spa", 20000)
+        gone.collections.remove(orphan)
+        CollectionSizeStatistics.refresh(db.session, ["spa"])
+        db.session.flush()
+
+        engine = RelevanceEngine.load(db.session)
+        for target in [(40.65, -73.94), (41.3, -73.3), (39.1, -94.6), (-15, 91)]:
+            for language in ["eng", "spa", "fre"]:
+                for audiences in [None, [Audience.RESEARCH], [Audience.OTHER]]:
+                    for production in [True, False]:
+                        args = (db.session, target, language, audiences, production)
+                        expect = Library.relevant(*args)
+                        actual = engine.relevant(*args)
+                        assert set(actual) == set(expect)
+                        for library, score in expect.items():
+                            assert actual[library] == pytest.approx(score)
+
+    def test_exponential_decrease(self):
+        decrease = RelevanceEngine.exponential_decrease
+        values = np.array([0, 1, -1000, 1000])
+        assert decrease(values) == pytest.approx(
+            [1, np.exp(-1), np.exp(500), np.exp(-500)]
+        )
+
+    def test_group_min_and_sum(self):
+        # Like SQL's min() and sum(), these ignore missing values, and
+        # a group with no values gets no result.
+        groups = np.array([0, 0, 1, 2, 2])
+        values = np.array([3.0, 1.0, np.nan, 2.0, np.nan])
+        mins = RelevanceEngine.group_min(groups, values, 4)
+        assert mins[:1].tolist() == [1.0]
+        assert mins[2] == 2.0
+        assert np.isnan(mins[1]) and np.isnan(mins[3])
+
+        sums = RelevanceEngine.group_sum(groups, values, 4)
+        assert sums[0] == 4.0
+        assert sums[2] == 2.0
+        assert np.isnan(sums[1]) and np.isnan(sums[3])
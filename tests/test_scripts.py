@@ -9,6 +9,8 @@ from model import (
     ExternalIntegration,
     Library,
     Place,
+    PlaceLibraryOverlap,
+    PlaceSubdivision,
     ServiceArea,
     create,
     get_one,
@@ -23,6 +25,7 @@ from scripts import (
     ConfigureVendorIDScript,
     LibraryScript,
     LoadPlacesScript,
+    RebuildPlaceIndexesScript,
     RegistrationRefreshScript,
     SearchLibraryScript,
     SearchPlacesScript,
@@ -74,7 +77,7 @@ class TestLibraryScript:
 
 
 class TestLoadPlacesScript:
-    def test_run(self, db: DatabaseTransactionFixture):
+    def test_run(self, db: DatabaseTransactionFixture, capsys):
         test_ndjson = """{"parent_id": null, "name": "United States", "full_name": null, "aliases": [], "type": "nation", "abbreviated_name": "US", "id": "US"}
 {"type": "Point", "coordinates": [-159.459551, 54.948652]}
 {"parent_id": "US", "name": "Alabama", "full_name": null, "aliases": [], "type": "state", "abbreviated_name": "AL", "id": "01"}
@@ -94,6 +97,47 @@ class TestLoadPlacesScript:
             "Montgomery",
         }
         assert {x.external_id for x in places} == {"US", "01", "0151000"}
+        out = capsys.readouterr().out
+        assert "3 new places, 0 updated, 0 unchanged." in out
+        assert "Peak memory usage: " in out
+
+    def test_run_bulk(self, db: DatabaseTransactionFixture, capsys):
+        test_ndjson = """{"parent_id": null, "name": "United States", "full_name": null, "aliases": [], "type": "nation", "abbreviated_name": "US", "id": "US"}
+{"type": "Point", "coordinates": [-159.459551, 54.948652]}
+{"parent_id": "US", "name": "Alabama", "full_name": null, "aliases": [], "type": "state", "abbreviated_name": "AL", "id": "01"}
+{"type": "Point", "coordinates": [-88.053375, 30.506987]}"""
+        script = LoadPlacesScript(db.session)
+        script.run(cmd_args=["--bulk"], stdin=StringIO(test_ndjson))
+
+        places = db.session.query(Place).all()
+        assert {x.external_name for x in places} == {"United States", "Alabama"}
+        out = capsys.readouterr().out
+        assert "Staged 2 records" in out
+        assert "2 new places, 0 updated" in out
+
+
+class TestRebuildPlaceIndexesScript:
+    def test_run(self, db: DatabaseTransactionFixture):
+        nypl = db.library("NYPL", eligibility_areas=[db.new_york_city])
+        zip = db.zip_10018
+
+        def overlaps():
+            return {
+                (x.place_id, x.library_id, x.overlap_type)
+                for x in db.session.query(PlaceLibraryOverlap)
+            }
+
+        # Lose some derived records.
+        expect = overlaps()
+        assert (zip.id, nypl.id, PlaceLibraryOverlap.INTERIOR) in expect
+        db.session.query(PlaceLibraryOverlap).delete()
+        db.session.query(PlaceSubdivision).delete()
+
+        # The script brings them back.
+        script = RebuildPlaceIndexesScript(db.session)
+        script.run(cmd_args=[])
+        assert db.session.query(PlaceSubdivision).count() > 0
+        assert overlaps() == expect
 
 
 class TestSearchPlacesScript:
@@ -153,6 +197,12 @@ class TestAddLibraryScript:
 
         assert [x.place for x in library.service_areas] == [nyc]
 
+        # The library can be found by its description and alias.
+        assert Library.search_within_description(db.session, "boroughs").all() == [
+            library
+        ]
+        assert Library.search_within_description(db.session, "nypl").all() == [library]
+
 
 class TestSearchLibraryScript:
     def test_run(self, db: DatabaseTransactionFixture):
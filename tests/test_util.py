@@ -1,4 +1,8 @@
-from util import GeometryUtility
+import math
+
+import pytest
+
+from util import GeometryUtility, LazyLocation
 
 
 class TestGeometryUtility:
@@ -6,6 +10,16 @@ class TestGeometryUtility:
         point = GeometryUtility.point("80", "-4")
         assert point == "SRID=4326;POINT(-4 80)"
 
+    def test_distance(self):
+        d = GeometryUtility.distance
+        assert d((40.8056, -73.9169), (40.8056, -73.9169)) == 0
+        # New York to Los Angeles.
+        assert d((40.7128, -74.006), (34.0522, -118.2437)) == pytest.approx(3936, abs=1)
+        # A quarter of the way around the equator.
+        assert d((0, 0), (0, 90)) == pytest.approx(
+            GeometryUtility.EARTH_RADIUS * math.pi / 2
+        )
+
     def test_point_from_ip(self):
         point = GeometryUtility.point_from_ip("65.88.88.124")
         assert point == "SRID=4326;POINT(-73.9169 40.8056)"
@@ -26,3 +40,50 @@ class TestGeometryUtility:
         # Here are some strings that do.
         for coords in ("40.7769, -73.9813", "40.7769,-73.9813"):
             assert m(coords) == "SRID=4326;POINT(-73.9813 40.7769)"
+
+
+class TestLazyLocation:
+    def test_resolve(self):
+        created = LazyLocation.created
+        resolved = LazyLocation.resolved
+
+        # Setting up a location doesn't do any work.
+        location = LazyLocation("40.7769,-73.9813", "65.88.88.124")
+        assert LazyLocation.created == created + 1
+        assert LazyLocation.resolved == resolved
+
+        # The provided lat/long takes precedence over the IP address.
+        assert location.resolve() == "SRID=4326;POINT(-73.9813 40.7769)"
+        assert LazyLocation.resolved == resolved + 1
+
+        # The answer is remembered.
+        assert location.resolve() == "SRID=4326;POINT(-73.9813 40.7769)"
+        assert LazyLocation.resolved == resolved + 1
+
+        # If no usable lat/long is provided, the IP address is used.
+        for location_string in (None, "", "Not a location"):
+            location = LazyLocation(location_string, "65.88.88.124")
+            assert location.resolve() == "SRID=4326;POINT(-73.9169 40.8056)"
+
+        # If neither is usable, the location is unknown.
+        location = LazyLocation(None, "127.0.0.1")
+        assert location.resolve() is None
+        assert str(location) == "None"
+
+        # Checking whether a location is true makes the guess, so an
+        # unknown location is false.
+        assert not location
+        location = LazyLocation("40.7769,-73.9813")
+        assert location
+        assert LazyLocation.resolved == resolved + 6
+
+        stats = LazyLocation.stats()
+        assert stats["created"] == created + 6
+        assert stats["resolved"] == resolved + 6
+
+    def test_value_of(self):
+        m = LazyLocation.value_of
+        assert m(None) is None
+        point = "SRID=4326;POINT(-73.9813 40.7769)"
+        assert m(point) == point
+        assert m(LazyLocation("40.7769,-73.9813")) == point
@@ -0,0 +1,80 @@
+import pytest
+
+from util.cache import LRUCache
+
+
+class TestLRUCache:
+    def test_get_and_set(self):
+        cache = LRUCache(2)
+        assert cache.get("a") is LRUCache.MISSING
+
+        # None can be cached like any other value.
+        cache.set("a", None)
+        cache.set("b", 2)
+        assert cache.get("a") is None
+        assert cache.get("b") == 2
+
+        # When the cache is full, the least recently used item is
+        # discarded. "a" was used more recently than "b".
+        cache.get("a")
+        cache.set("c", 3)
+        assert len(cache) == 2
+        assert "a" in cache
+        assert "b" not in cache
+        assert cache.get("c") == 3
+
+    def test_stats(self):
+        cache = LRUCache(10)
+        assert cache.hit_rate == 0
+        cache.set("a", 1)
+        cache.get("a")
+        cache.get("a")
+        cache.get("a")
+        cache.get("b")
+        assert cache.stats() == dict(
+            size=1, max_size=10, hits=3, misses=1, hit_rate=0.75
+        )
+
+        cache.clear()
+        assert cache.stats() == dict(
+            size=0, max_size=10, hits=0, misses=0, hit_rate=0.0
+        )
+
+    def test_max_size(self):
+        with pytest.raises(ValueError):
+            LRUCache(0)
+
+    def test_max_weight(self):
+        with pytest.raises(ValueError):
+            LRUCache(10, max_weight=5)
+
+        cache = LRUCache(10, max_weight=5, weigh=len)
+        cache.set("a", "xx")
+        cache.set("b", "xx")
+        assert cache.weight == 4
+
+        # When the items get too heavy, the least recently used items
+        # are discarded until there's room.
+        cache.get("a")
+        cache.set("c", "xxx")
+        assert "b" not in cache
+        assert "c" in cache
+        assert cache.stats()["weight"] == 5
+        cache.set("d", "x")
+        assert "a" not in cache
+        assert cache.weight == 4
+
+        # Replacing an item replaces its weight.
+        cache.set("d", "xx")
+        assert cache.weight == 5
+
+        # An item that's too heavy to fit isn't cached at all, but it
+        # does replace an older value.
+        cache.set("c", "xxxxxx")
+        assert "c" not in cache
+        assert "d" in cache
+        assert cache.stats()["weight"] == cache.weight == 2
+        assert cache.stats()["max_weight"] == 5
+
+        cache.clear()
+        assert cache.weight == 0
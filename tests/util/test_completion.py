@@ -0,0 +1,45 @@
+import random
+
+from util.completion import PrefixIndex
+
+
+class TestPrefixIndex:
+    def test_search(self):
+        index = PrefixIndex(
+            [
+                ("new york", 1),
+                ("newark", 2),
+                ("new haven", 3),
+                ("new york", 4),
+                ("newton", 5),
+                ("norwalk", 6),
+            ]
+        )
+        assert len(index) == 6
+
+        # Values come back in the order of their strings.
+        assert index.search("new") == [3, 1, 4, 2, 5]
+        assert index.search("new ") == [3, 1, 4]
+        assert index.search("new york") == [1, 4]
+        assert index.search("n") == [3, 1, 4, 2, 5, 6]
+        assert index.search("new", limit=2) == [3, 1]
+        assert index.count("new") == 5
+
+        assert index.search("new yorkshire") == []
+        assert index.search("z") == []
+        assert index.count("a") == 0
+
+        # An empty prefix matches everything.
+        assert index.count("") == 6
+
+    def test_matches_brute_force(self):
+        rng = random.Random(0)
+        strings = [
+            "".join(rng.choice("ab ") for i in range(rng.randint(0, 6)))
+            for i in range(300)
+        ]
+        index = PrefixIndex([(x, i) for i, x in enumerate(strings)])
+        for prefix in ["a", "b", " ", "ab", "ba ", "aab", "bbbb"]:
+            expect = {i for i, x in enumerate(strings) if x.startswith(prefix)}
+            assert set(index.search(prefix)) == expect
+            assert index.count(prefix) == len(expect)
@@ -0,0 +1,64 @@
+import random
+
+import pytest
+
+from util.fuzzy import DeletionIndex, levenshtein
+
+
+class TestLevenshtein:
+    def test_levenshtein(self):
+        assert levenshtein("", "") == 0
+        assert levenshtein("kitten", "sitting") == 3
+        assert levenshtein("sitting", "kitten") == 3
+        assert levenshtein("flaw", "lawn") == 2
+        assert levenshtein("abc", "") == 3
+
+        # With a maximum distance, the exact distance isn't always
+        # found, but anything too far away is reported as one more
+        # than the maximum.
+        assert levenshtein("kitten", "sitting", 2) == 3
+        assert levenshtein("kitten", "kitten and more", 2) == 3
+        assert levenshtein("flaw", "lawn", 2) == 2
+
+
+class TestDeletionIndex:
+    def test_prefix_length(self):
+        with pytest.raises(ValueError):
+            DeletionIndex(max_distance=2, prefix_length=2)
+
+    def test_deletions_of(self):
+        index = DeletionIndex(max_distance=1, prefix_length=3)
+        assert index.deletions_of("abcd") == {"abc", "bc", "ac", "ab"}
+
+    def test_search(self):
+        index = DeletionIndex(max_distance=2)
+        index.add("brooklyn public library", 1)
+        index.add("bklynlib", 1)
+        index.add("bklynlib", 2)
+        index.add("boston public library", 3)
+        assert len(index) == 3
+
+        assert index.search("brooklyn public library") == {1}
+        assert index.search("broklyn pubic library") == {1}
+        assert index.search("zklynlib") == {1, 2}
+        assert index.search("zklynlibs") == {1, 2}
+        assert index.search("zkynlibs") == set()
+        assert index.search("public library") == set()
+
+    def test_search_finds_everything_within_max_distance(self):
+        # Using only a prefix of each string to file it doesn't lose
+        # any matches.
+        rng = random.Random(0)
+        words = [
+            "".join(rng.choice("abc") for i in range(rng.randint(1, 12)))
+            for i in range(300)
+        ]
+        index = DeletionIndex(max_distance=2, prefix_length=4)
+        for i, word in enumerate(words):
+            index.add(word, i)
+        for query in words[:50]:
+            query = query[1:] + rng.choice("abc")
+            expect = {
+                i for i, word in enumerate(words) if levenshtein(word, query) <= 2
+            }
+            assert index.search(query) == expect
@@ -0,0 +1,87 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from util.geoip import GeoIPService
+
+
+class TestGeoIPService:
+    def test_location(self):
+        service = GeoIPService()
+        assert service.location("65.88.88.124") == (40.8056, -73.9169)
+
+        # Addresses that aren't in the database have no location.
+        assert service.location(None) is None
+        assert service.location("not an address") is None
+        assert service.location("127.0.0.1") is None
+        assert service.location("192.168.1.10") is None
+
+    def test_cache(self):
+        service = GeoIPService()
+        location = service.location("65.88.88.124")
+        assert service.cache.stats()["misses"] == 1
+
+        # Another address in the same /24 network is found in the
+        # cache without consulting the database.
+        with mock.patch.object(GeoIPService, "reader") as reader:
+            assert service.location("65.88.88.1") == location
+            reader.get_with_prefix_len.assert_not_called()
+        assert service.cache.stats()["hits"] == 1
+
+        # Private addresses are never looked up in the database, and
+        # the answer is cached for the whole network.
+        with mock.patch.object(GeoIPService, "reader") as reader:
+            assert service.location("10.1.2.3") is None
+            assert service.location("10.1.2.4") is None
+            reader.get_with_prefix_len.assert_not_called()
+
+        stats = service.stats()
+        assert stats["lookups"] == 4
+        assert stats["private"] == 1
+        assert stats["hits"] == 2
+        assert stats["misses"] == 2
+        assert stats["hit_rate"] == 0.5
+
+    def test_stats_are_thread_safe(self):
+        service = GeoIPService()
+        addresses = ["10.%d.%d.1" % (i // 256, i % 256) for i in range(2000)]
+        addresses += ["not an address"] * 2000
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(service.location, addresses))
+        stats = service.stats()
+        assert stats["lookups"] == 4000
+        assert stats["invalid"] == 2000
+        assert stats["private"] == 2000
+
+    def test_cache_key(self):
+        m = GeoIPService().cache_key
+        assert m("65.88.88.124") == "65.88.88"
+        assert m("65.88.88.999") is None
+        assert m("2001:db8::1") == "2001:db8::/48"
+        assert m("not an address") is None
+
+    def test_small_networks_are_not_cached(self):
+        # If the database has different information for part of a
+        # /24 network, answers for that network can't be cached.
+        service = GeoIPService()
+        reader = mock.Mock()
+        reader.get_with_prefix_len.return_value = (
+            {"location": {"latitude": 1, "longitude": 2}},
+            28,
+        )
+        service._reader = reader
+        assert service.location("65.88.88.124") == (1, 2)
+        assert len(service.cache) == 0
+
+        # An address that isn't in the database is cached like any other.
+        reader.get_with_prefix_len.return_value = (None, 16)
+        assert service.location("65.89.88.124") is None
+        assert len(service.cache) == 1
+        assert service.cache.get("65.89.88") is None
+
+    def test_close(self):
+        service = GeoIPService()
+        service.location("65.88.88.124")
+        assert service._reader is not None
+        service.close()
+        assert service._reader is None
+        assert len(service.cache) == 0
@@ -0,0 +1,47 @@
+from unittest import mock
+
+import sqlalchemy as sa
+from uszipcode.model import SimpleZipcode
+
+from util.postal_codes import CityPostalCodes
+
+
+class TestCityPostalCodes:
+    def test_postal_codes(self, tmp_path):
+        # Make a tiny uszipcode database.
+        path = str(tmp_path / "simple_db.sqlite")
+        engine = sa.create_engine("sqlite:///%s" % path)
+        SimpleZipcode.__table__.create(engine)
+        with engine.begin() as connection:
+            connection.execute(
+                SimpleZipcode.__table__.insert(),
+                [
+                    dict(zipcode=z, zipcode_type=t, major_city=c, state=s)
+                    for z, t, c, s in [
+                        ("12603", "STANDARD", "Poughkeepsie", "NY"),
+                        ("12601", "STANDARD", "Poughkeepsie", "NY"),
+                        ("12602", "PO BOX", "Poughkeepsie", "NY"),
+                        ("10018", "STANDARD", "New York", "NY"),
+                        ("06830", "STANDARD", "Greenwich", "CT"),
+                    ]
+                ],
+            )
+        engine.dispose()
+
+        postal_codes = CityPostalCodes(path)
+        m = postal_codes.postal_codes
+
+        # Standard postal codes are returned in order.
+        assert m("NY", "Poughkeepsie") == ["12601", "12603"]
+        assert m("ny", "New York") == ["10018"]
+
+        # The city must be in the given state.
+        assert m("CT", "Poughkeepsie") == []
+        assert m("NY", "Nowhere") == []
+        assert m("ON", "Hamilton") == []
+        assert m(None, "Poughkeepsie") == []
+
+        # The database was only read once.
+        with mock.patch.object(postal_codes, "load") as load:
+            assert m("CT", "Greenwich") == ["06830"]
+        assert load.call_count == 0
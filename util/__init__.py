@@ -1,8 +1,15 @@
-from geolite2 import geolite2
+import math
+from threading import Lock
+
 from sqlalchemy import func
 
+from .geoip import geoip
+
 
 class GeometryUtility:
+    # The mean radius of the Earth, in kilometers.
+    EARTH_RADIUS = 6371.0088
+
     @classmethod
     def from_geojson(cls, geojson):
         """
@@ -27,16 +34,10 @@ class GeometryUtility:
 
                 'SRID=4326;POINT({longitude} {latitude})'
         """
-        reader = geolite2.reader()  # TODO: Move this instantiation after None check
-        if not ip_address:
+        location = geoip.location(ip_address)
+        if location is None:
             return None
-
-        match = reader.get(ip_address)
-        if match is None:
-            return None
-
-        latitude, longitude = (match["location"][x] for x in ("latitude", "longitude"))
-        return cls.point(latitude, longitude)
+        return cls.point(*location)
 
     @classmethod
     def point_from_string(cls, s):
@@ -72,3 +73,88 @@ class GeometryUtility:
         :return: (str) - Formatted string: 'SRID=4326;POINT({longitude} {latitude})'
         """
         return f"SRID=4326;POINT({longitude} {latitude})"
+
+    @classmethod
+    def distance(cls, a, b):
+        """
+        Find the great-circle distance between two points on a spherical Earth
+
+        :param a: (tuple) - (latitude, longitude)
+        :param b: (tuple) - (latitude, longitude)
+        :return: (float) - Distance in kilometers
+        """
+        lat1, lon1, lat2, lon2 = (math.radians(x) for x in a + b)
+        h = (
+            math.sin((lat2 - lat1) / 2) ** 2
+            + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+        )
+        return 2 * cls.EARTH_RADIUS * math.asin(min(1, math.sqrt(h)))
+
+
+class LazyLocation:
+    """A guess at a client's location, made only when someone needs it.
+
+    Guessing means parsing a latitude/longitude string or looking up
+    the client's IP address, and many requests never use the result.
+    """
+
+    # How many guesses have been set up, and how many were actually
+    # needed, since the process started. Requests are handled in
+    # several threads, so these are only changed while holding _lock.
+    created = 0
+    resolved = 0
+    _lock = Lock()
+
+    def __init__(self, location_string=None, ip_address=None):
+        """Constructor.
+
+        :param location_string: (str) - A comma-separated lat/long pair
+            provided by the client, if any.
+        :param ip_address: (str) - The client's IP address, used if
+            `location_string` is missing or can't be parsed.
+        """
+        self.location_string = location_string
+        self.ip_address = ip_address
+        self._resolved = False
+        self._value = None
+        with LazyLocation._lock:
+            LazyLocation.created += 1
+
+    def resolve(self):
+        """Make the guess, if it hasn't been made already.
+
+        :return: (str, None) - A string that can be used as a Geometry,
+            or None if the location can't be guessed.
+        """
+        if not self._resolved:
+            with LazyLocation._lock:
+                LazyLocation.resolved += 1
+            location = None
+            if self.location_string:
+                location = GeometryUtility.point_from_string(self.location_string)
+            if not location:
+                location = GeometryUtility.point_from_ip(self.ip_address)
+            self._value = location
+            self._resolved = True
+        return self._value
+
+    @classmethod
+    def value_of(cls, location):
+        """Resolve `location` if it's a LazyLocation; otherwise return it
+        as is.
+        """
+        if isinstance(location, cls):
+            return location.resolve()
+        return location
+
+    @classmethod
+    def stats(cls):
+        """Summarize how often locations were actually needed."""
+        return dict(created=cls.created, resolved=cls.resolved)
+
+    def __bool__(self):
+        """A location is true only if it can be guessed."""
+        return self.resolve() is not None
+
+    def __str__(self):
+        return str(self.resolve())
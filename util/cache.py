@@ -0,0 +1,116 @@
+"""Simple in-process caches."""
+from collections import OrderedDict
+from threading import Lock
+
+
+class LRUCache:
+    """A thread-safe dictionary that holds a limited number of items,
+    discarding the least recently used item when it's full.
+
+    If the items vary a lot in size, the cache can also be given a
+    function that weighs each item (e.g. by its length in bytes) and
+    a limit on the total weight of the items it holds.
+
+    The cache keeps track of how often a lookup finds what it's
+    looking for.
+    """
+
+    # Returned by get() when a key isn't in the cache. This lets the
+    # cache hold None as a value.
+    MISSING = object()
+
+    def __init__(self, max_size, max_weight=None, weigh=None):
+        """Constructor.
+
+        :param max_size: Hold no more than this many items.
+        :param max_weight: Hold items whose weights add up to no more
+            than this. An item heavier than this is never cached.
+        :param weigh: A function that finds the weight of a value.
+        """
+        if max_size < 1:
+            raise ValueError("An LRUCache must be able to hold at least one item.")
+        if (max_weight is None) != (weigh is None):
+            raise ValueError("max_weight and weigh must be given together.")
+        self.max_size = max_size
+        self.max_weight = max_weight
+        self.weigh = weigh
+        self.weight = 0
+        self._items = OrderedDict()
+        self._weights = {}
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key):
+        """Look up an item, marking it as recently used.
+
+        :return: The cached value, or LRUCache.MISSING.
+        """
+        with self._lock:
+            try:
+                value = self._items[key]
+            except KeyError:
+                self.misses += 1
+                return self.MISSING
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """Cache an item, discarding the least recently used item if
+        there's no room for it.
+        """
+        weight = self.weigh(value) if self.weigh else 0
+        with self._lock:
+            if key in self._items:
+                self._discard(key)
+            if self.max_weight is not None and weight > self.max_weight:
+                return
+            self._items[key] = value
+            self._weights[key] = weight
+            self.weight += weight
+            while len(self._items) > self.max_size or (
+                self.max_weight is not None and self.weight > self.max_weight
+            ):
+                self._discard(next(iter(self._items)))
+
+    def _discard(self, key):
+        """Remove an item. The caller must hold the lock."""
+        del self._items[key]
+        self.weight -= self._weights.pop(key)
+
+    def clear(self):
+        """Discard every item and reset the statistics."""
+        with self._lock:
+            self._items.clear()
+            self._weights.clear()
+            self.weight = 0
+            self.hits = 0
+            self.misses = 0
+
+    @property
+    def hit_rate(self):
+        """The fraction of lookups that found an item in the cache."""
+        lookups = self.hits + self.misses
+        if not lookups:
+            return 0.0
+        return self.hits / lookups
+
+    def stats(self):
+        """Summarize the state of the cache."""
+        stats = dict(
+            size=len(self._items),
+            max_size=self.max_size,
+            hits=self.hits,
+            misses=self.misses,
+            hit_rate=self.hit_rate,
+        )
+        if self.max_weight is not None:
+            stats.update(weight=self.weight, max_weight=self.max_weight)
+        return stats
@@ -0,0 +1,62 @@
+"""Find strings that start with a prefix."""
+from bisect import bisect_left
+
+
+class PrefixIndex:
+    """A sorted list of strings, each with a value attached.
+
+    Every string that starts with a given prefix sits in one
+    contiguous run of the list, which two binary searches can find.
+    """
+
+    def __init__(self, entries):
+        """Constructor.
+
+        :param entries: A list of (string, value) 2-tuples. The same
+            string can have several values.
+        """
+        entries = sorted(entries, key=lambda x: x[0])
+        self.keys = [key for key, ignore in entries]
+        self.values = [value for ignore, value in entries]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def bounds(self, prefix):
+        """Find the run of strings that start with `prefix`.
+
+        :return: A 2-tuple (start, end), suitable for slicing.
+        """
+        start = bisect_left(self.keys, prefix)
+        if not prefix:
+            return start, len(self.keys)
+        # Every string that starts with the prefix sorts before the
+        # prefix with its last character incremented.
+        after = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        return start, bisect_left(self.keys, after, start)
+
+    def count(self, prefix):
+        """Count the strings that start with `prefix`."""
+        start, end = self.bounds(prefix)
+        return end - start
+
+    def search(self, prefix, limit=None):
+        """Find the values attached to strings that start with `prefix`,
+        in the order of the strings.
+
+        :param limit: Return no more than this many values.
+        :return: A list of values.
+        """
+        return [value for ignore, value in self.items(prefix, limit)]
+
+    def items(self, prefix, limit=None):
+        """Find the strings that start with `prefix`, in order, along
+        with their values.
+
+        :param limit: Return no more than this many strings.
+        :return: A list of (string, value) 2-tuples.
+        """
+        start, end = self.bounds(prefix)
+        if limit is not None:
+            end = min(end, start + limit)
+        return list(zip(self.keys[start:end], self.values[start:end]))
@@ -0,0 +1,100 @@
+"""Find strings that are within a small edit distance of a query."""
+from collections import defaultdict
+
+
+def levenshtein(a, b, max_distance=None):
+    """Find the Levenshtein distance between two strings.
+
+    :param max_distance: If this is given, stop as soon as the distance
+        is known to be larger, and return max_distance + 1.
+    """
+    if len(a) < len(b):
+        a, b = b, a
+    if max_distance is not None and len(a) - len(b) > max_distance:
+        return max_distance + 1
+    previous = list(range(len(b) + 1))
+    for i, x in enumerate(a, 1):
+        current = [i]
+        for j, y in enumerate(b, 1):
+            current.append(
+                min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (x != y))
+            )
+        if max_distance is not None and min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+    return previous[-1]
+
+
+class DeletionIndex:
+    """A SymSpell-style index of strings.
+
+    Two strings are within edit distance N of each other only if
+    deleting at most N characters from each of them gives the same
+    string. So every string in the index is filed under each of the
+    strings that can be made by deleting up to N of its characters,
+    and a query is answered by looking up the deletions of the query
+    and checking the real edit distance of the few strings found.
+
+    To save memory, only the first `prefix_length` characters of each
+    string are used to file it. This finds the same candidates as long
+    as `prefix_length` is larger than `max_distance`.
+    """
+
+    def __init__(self, max_distance=2, prefix_length=7):
+        if prefix_length <= max_distance:
+            raise ValueError("prefix_length must be larger than max_distance.")
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.terms = []
+        self.values = []
+        self.term_index = {}
+        self.deletions = defaultdict(list)
+
+    def __len__(self):
+        return len(self.terms)
+
+    def deletions_of(self, term):
+        """Find every string that can be made by deleting up to
+        max_distance characters from the prefix of a string.
+        """
+        term = term[: self.prefix_length]
+        found = {term}
+        edge = [term]
+        for i in range(self.max_distance):
+            next_edge = []
+            for string in edge:
+                for j in range(len(string)):
+                    deletion = string[:j] + string[j + 1 :]
+                    if deletion not in found:
+                        found.add(deletion)
+                        next_edge.append(deletion)
+            edge = next_edge
+        return found
+
+    def add(self, term, value):
+        """File `value` under `term`."""
+        index = self.term_index.get(term)
+        if index is None:
+            index = len(self.terms)
+            self.term_index[term] = index
+            self.terms.append(term)
+            self.values.append([])
+            for deletion in self.deletions_of(term):
+                self.deletions[deletion].append(index)
+        self.values[index].append(value)
+
+    def search(self, query):
+        """Find the values filed under every term within max_distance
+        of `query`.
+
+        :return: A set of values.
+        """
+        candidates = set()
+        for deletion in self.deletions_of(query):
+            candidates.update(self.deletions.get(deletion, ()))
+        found = set()
+        for index in candidates:
+            distance = levenshtein(self.terms[index], query, self.max_distance)
+            if distance <= self.max_distance:
+                found.update(self.values[index])
+        return found
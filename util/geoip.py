@@ -0,0 +1,146 @@
+"""Find the approximate location of an IP address."""
+import ipaddress
+from threading import Lock
+
+import maxminddb
+from geolite2 import geolite2
+
+from .cache import LRUCache
+
+
+class GeoIPService:
+    """Look up IP addresses in the GeoLite2 city database.
+
+    Each process opens the database once, as a memory-mapped file.
+    Addresses in the same network almost always have the same
+    location, so lookups are cached by network prefix rather than by
+    individual address. Private addresses are never looked up in the
+    database at all.
+    """
+
+    # How many network prefixes to remember.
+    CACHE_SIZE = 50000
+
+    # Addresses are grouped into networks of this size for caching.
+    # (The IPv4 prefix is baked into cache_key().)
+    IPV4_PREFIX = 24
+    IPV6_PREFIX = 48
+
+    # Requests are handled in several threads, so the lookup counters
+    # are only changed while holding this lock.
+    _stats_lock = Lock()
+
+    def __init__(self, filename=None, cache_size=None):
+        """Constructor.
+
+        :param filename: Path to a MaxMind database. By default, the
+            database that comes with the `maxminddb-geolite2` package
+            is used.
+        :param cache_size: Number of network prefixes to remember.
+        """
+        self.filename = filename or geolite2.filename
+        self.cache = LRUCache(cache_size or self.CACHE_SIZE)
+        self._reader = None
+        self._lock = Lock()
+        self.lookups = 0
+        self.private = 0
+        self.invalid = 0
+
+    @property
+    def reader(self):
+        """The database reader for this process, opened on first use."""
+        if self._reader is None:
+            with self._lock:
+                if self._reader is None:
+                    self._reader = maxminddb.open_database(
+                        self.filename, maxminddb.MODE_AUTO
+                    )
+        return self._reader
+
+    def close(self):
+        with self._lock:
+            if self._reader is not None:
+                self._reader.close()
+                self._reader = None
+            self.cache.clear()
+
+    def cache_key(self, ip_address):
+        """Find the network prefix used to cache lookups of an address.
+
+        This happens on almost every request, so IPv4 addresses are
+        handled without fully parsing them.
+
+        :return: A string, or None if `ip_address` is obviously invalid.
+        """
+        network, dot, host = ip_address.rpartition(".")
+        if dot and ":" not in ip_address:
+            # The first three parts of a dotted quad are its /24 prefix.
+            if host.isdigit() and int(host) < 256:
+                return network
+            return None
+        try:
+            address = ipaddress.ip_address(ip_address)
+        except ValueError:
+            return None
+        return str(ipaddress.ip_network((address, self.IPV6_PREFIX), strict=False))
+
+    def location(self, ip_address):
+        """Find the location of an IP address.
+
+        :param ip_address: (str) - An IPv4 or IPv6 address.
+        :return: (tuple, None) - A 2-tuple (latitude, longitude), or None
+            if the location of the address is unknown.
+        """
+        if not ip_address:
+            return None
+        self._count("lookups")
+        key = self.cache_key(ip_address)
+        if key is not None:
+            location = self.cache.get(key)
+            if location is not LRUCache.MISSING:
+                return location
+
+        try:
+            address = ipaddress.ip_address(ip_address)
+        except ValueError:
+            self._count("invalid")
+            return None
+        if not address.is_global:
+            # Private, loopback and reserved addresses aren't in the
+            # database. These ranges are never smaller than a cache
+            # prefix, so the whole prefix can be written off.
+            self._count("private")
+            self.cache.set(key, None)
+            return None
+
+        match, prefix_length = self.reader.get_with_prefix_len(address)
+        if match is None or "location" not in match:
+            location = None
+        else:
+            location = tuple(match["location"][x] for x in ("latitude", "longitude"))
+        if address.version == 4:
+            cache_prefix_length = self.IPV4_PREFIX
+        else:
+            cache_prefix_length = self.IPV6_PREFIX
+        if prefix_length <= cache_prefix_length:
+            # Everything in our prefix gets the same answer from the
+            # database, so it's safe to cache.
+            self.cache.set(key, location)
+        return location
+
+    def _count(self, counter):
+        with GeoIPService._stats_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self):
+        """Summarize how well the cache is working."""
+        stats = self.cache.stats()
+        with GeoIPService._stats_lock:
+            stats.update(
+                lookups=self.lookups, private=self.private, invalid=self.invalid
+            )
+        return stats
+
+
+# The GeoIPService used by this process.
+geoip = GeoIPService()
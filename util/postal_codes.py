@@ -0,0 +1,74 @@
+"""Find the postal codes of US cities."""
+from threading import Lock
+
+import sqlalchemy as sa
+import uszipcode
+from uszipcode.model import SimpleZipcode, ZipcodeTypeEnum
+
+
+class CityPostalCodes:
+    """An index of the postal codes of every US city, built from the
+    uszipcode database.
+
+    Opening the uszipcode database and searching it is slow, so each
+    process reads every (state, city, postal code) row at once, the
+    first time it needs to, and answers all lookups from memory.
+    """
+
+    def __init__(self, db_file_path=None):
+        """Constructor.
+
+        :param db_file_path: Path to the uszipcode 'simple' database.
+            It will be downloaded if it doesn't exist.
+        """
+        self.db_file_path = db_file_path
+        self._index = None
+        self._lock = Lock()
+
+    @property
+    def index(self):
+        """A dictionary mapping state abbreviations to dictionaries
+        that map city names to lists of postal codes.
+        """
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    self._index = self.load()
+        return self._index
+
+    def load(self):
+        """Read the postal codes of every city from the uszipcode
+        database.
+        """
+        search = uszipcode.SearchEngine(db_file_path=self.db_file_path)
+        try:
+            # This matches what SearchEngine.by_city_and_state finds
+            # when given the exact name of a city.
+            qu = (
+                sa.select(
+                    SimpleZipcode.state,
+                    SimpleZipcode.major_city,
+                    SimpleZipcode.zipcode,
+                )
+                .where(SimpleZipcode.zipcode_type == ZipcodeTypeEnum.Standard.value)
+                .order_by(SimpleZipcode.zipcode)
+            )
+            index = {}
+            for state, city, zipcode in search.ses.execute(qu):
+                if not state or not city:
+                    continue
+                index.setdefault(state.upper(), {}).setdefault(city, []).append(zipcode)
+        finally:
+            search.close()
+        return index
+
+    def postal_codes(self, state, city):
+        """Find the postal codes of a city.
+
+        :param state: The abbreviated name of a US state.
+        :param city: The exact name of a city in that state.
+        :return: A list of postal codes, possibly empty.
+        """
+        if not state or not city:
+            return []
+        return self.index.get(state.upper(), {}).get(city, [])